@@ -1,9 +1,32 @@
 from django.contrib import admin
-from .models import OTP, Profile, Event, EventBooking, Ticket, User
+from .inventory import available_for, set_available
+from .models import OTP, OutboundSMS, Profile, Event, EventBooking, RazorpayWebhookEvent, Ticket, TicketReservation, User
 
 admin.site.register(OTP)
 admin.site.register(Profile)
 admin.site.register(Event)
-admin.site.register(EventBooking)
-admin.site.register(Ticket)
+# EventBooking.__str__ shows the event name and user's mobile
+admin.site.register(EventBooking, list_select_related=('event', 'user'))
+admin.site.register(TicketReservation)
 admin.site.register(User)
+admin.site.register(OutboundSMS)
+admin.site.register(RazorpayWebhookEvent)
+
+
+@admin.register(Ticket)
+class TicketAdmin(admin.ModelAdmin):
+    """
+    Once a ticket's inventory is sharded, total_tickets_available is no longer kept up to
+    date, so the form shows the seats left over the shards, and an edit redistributes them.
+    """
+
+    def get_object(self, request, object_id, from_field=None):
+        ticket = super().get_object(request, object_id, from_field)
+        if ticket is not None:
+            ticket.total_tickets_available = available_for(ticket)
+        return ticket
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'total_tickets_available' in form.changed_data:
+            set_available(obj, obj.total_tickets_available)
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class EventRegistrationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'event_registration'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from . import metrics  # noqa: F401  instruments database connections as they open
+        from . import waiting_room  # noqa: F401  registers its system check
+        from . import otp_store  # noqa: F401  registers its system check
+        from . import log
+        log.configure()
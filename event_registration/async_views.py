@@ -0,0 +1,278 @@
+import datetime
+import json
+import logging
+import math
+import uuid
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.http import JsonResponse
+from django.shortcuts import redirect
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework_simplejwt.exceptions import TokenError, AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.tokens import AccessToken
+from .models import EventBooking
+from .authentication import CachedJWTAuthentication
+from .serializers import SendOTPSerializer, VerifyOTPSerializer
+from .utility import generate_otp, generate_tokens_for_user
+from .sms import send_sms
+from . import otp_store, ratelimit
+from .otp_store import get_otp_store
+from .gateways import async_razorpay_client, circuit
+from .ticket_qr import ticket_qr
+from .inventory import SoldOut
+from .booking import (validate_booking, booking_error_response, create_pending_booking, arequest_payment_link, attach_payment_link,
+                      aabandon_pending_booking, complete_payment, bookings_for_ticket, BookingExists)
+
+# Async versions of the views that wait on a provider, served under async/ through
+# settings/asgi.py. Provider calls go through aiohttp and the ORM through its async API, so
+# an ASGI worker keeps serving other requests while these wait. Transactions, serializer
+# validation and QR rendering are still sync and run in a thread via sync_to_async.
+# The responses match the sync views in views.py.
+
+User = get_user_model()
+
+logger = logging.getLogger(__name__)
+
+
+def request_data(request):
+    """
+    The request body as a dict, from JSON or a form post.
+    """
+    if request.content_type == 'application/json':
+        return json.loads(request.body or b'{}')
+
+    return request.POST.dict()
+
+
+async def authenticated_user(request):
+    """
+    The active user named by the request's bearer access token, or None.
+    """
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+
+    try:
+        return await CachedJWTAuthentication().aget_user(AccessToken(header[len('Bearer '):]))
+    except (TokenError, AuthenticationFailed, InvalidToken):
+        return None
+
+
+async def throttled(request, scope, mobile=None, user=None):
+    """
+    The 429 response if the request is over one of the scope's rate limits, else None.
+    """
+    # Not on the shared sync thread: the cache client is thread-safe.
+    wait = await sync_to_async(ratelimit.check, thread_sensitive=False)(scope, request, mobile, user)
+    if not wait:
+        return None
+
+    response = JsonResponse(
+        {'detail': f'Request was throttled. Expected available in {math.ceil(wait)} seconds.'},
+        status=status.HTTP_429_TOO_MANY_REQUESTS
+    )
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+class AsyncAPIView(View):
+    """
+    Base for the async views. Like DRF's APIView, they authenticate with tokens, not cookies, so skip CSRF.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+
+        return csrf_exempt(super().as_view(**initkwargs))
+
+
+class AsyncSendOTP(AsyncAPIView):
+    query_budget = 5
+
+    async def post(self, request):
+        try:
+            data = request_data(request)
+            limited = await throttled(request, 'send-otp', mobile=data.get('mobile') if isinstance(data, dict) else None)
+            if limited:
+                return limited
+
+            serializer = SendOTPSerializer(data=data)
+            if not serializer.is_valid():
+                return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+            mobile_number = serializer.validated_data['mobile']
+
+            user, created = await User.objects.aget_or_create(mobile=mobile_number)
+
+            otp = generate_otp()
+
+            await sync_to_async(get_otp_store().issue)(user, otp)
+
+            # Delivered by the SMS queue's workers, not on this request
+            await sync_to_async(send_sms)(f'+91{mobile_number}', f'Your Kitsa Hydrovibe 2024 code is {otp}')
+
+            data = {
+                'user': {
+                    'mobile': user.mobile,
+                    'is_new_user': created,
+                },
+                'Message': 'OTP sent successfully'
+            }
+
+            return JsonResponse(data, status=status.HTTP_200_OK)
+
+        except ValueError as e:
+            logger.info('Invalid request: %s', e)
+            return JsonResponse({'error': 'Invalid request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception:
+            logger.exception('Unexpected error')
+            return JsonResponse({'error': 'Something went wrong. Please try again later.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class AsyncVerifyOTP(AsyncAPIView):
+    query_budget = 6
+
+    async def post(self, request):
+        try:
+            data = request_data(request)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        limited = await throttled(request, 'verify-otp', mobile=data.get('mobile') if isinstance(data, dict) else None)
+        if limited:
+            return limited
+
+        serializer = VerifyOTPSerializer(data=data)
+
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        mobile_number = serializer.validated_data['mobile']
+        otp_input = serializer.validated_data['otp']
+
+        try:
+            user = await User.objects.aget(mobile=mobile_number)
+
+            result = await sync_to_async(get_otp_store().verify)(user, otp_input)
+            if result != otp_store.VERIFIED:
+                return otp_store.error_response(result, JsonResponse)
+
+            tokens = await sync_to_async(generate_tokens_for_user)(user)
+            event_booking = await bookings_for_ticket().filter(user=user, payment_completed=True).afirst()
+
+            img_str = await sync_to_async(ticket_qr)(event_booking) if event_booking else None
+
+            return JsonResponse({"message": "OTP verified successfully!", "ticket": img_str, 'access': tokens['access'],
+                                 'refresh': tokens['refresh']}, status=status.HTTP_200_OK)
+
+        except User.DoesNotExist:
+            return JsonResponse({"error": "User does not exist."}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncCreateProfileAndBookingView(AsyncAPIView):
+    query_budget = 17
+
+    async def post(self, request):
+        user = await authenticated_user(request)
+        if user is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        limited = await throttled(request, 'book-tickets', user=user)
+        if limited:
+            return limited
+
+        try:
+            try:
+                profile_data, booking_data = await sync_to_async(validate_booking)(request_data(request))
+            except ValidationError as e:
+                logger.info('Booking validation error', extra={'errors': e.detail})
+                return booking_error_response(e, JsonResponse)
+
+            ticket_amount = booking_data['ticket'].price * booking_data['ticket_quantity']
+            reference_id = str(uuid.uuid4())
+
+            # Phase 1: short local transaction saving the profile, the seat hold and a pending booking
+            try:
+                event_booking, reservation = await sync_to_async(create_pending_booking)(
+                    user, profile_data, booking_data, reference_id, ticket_amount
+                )
+            except SoldOut as e:
+                return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            except BookingExists as e:
+                return JsonResponse(
+                    {'error': str(e), 'id': e.event_booking.formis_payment_id, 'payment_link': e.event_booking.payment_link},
+                    status=status.HTTP_409_CONFLICT
+                )
+
+            # Phase 2: create payment link, without holding a thread while Razorpay answers
+            try:
+                with circuit('razorpay'):
+                    payment_details = await arequest_payment_link(
+                        async_razorpay_client(),
+                        event_booking,
+                        customer={
+                            "name": profile_data['name'],
+                            "contact": profile_data['mobile']
+                        },
+                        callback_url=f"{request.scheme}://{request.get_host()}/event-registration/async/callback-for-razorpay",
+                        expire_by=int(reservation.expires_at.timestamp())
+                    )
+            except Exception as e:
+                logger.warning('Payment link creation failed', exc_info=True, extra={'reference_id': reference_id})
+                await aabandon_pending_booking(async_razorpay_client(), event_booking, e)
+                return JsonResponse({'error': 'Failed to create payment link'}, status=status.HTTP_502_BAD_GATEWAY)
+
+            payment_link = await sync_to_async(attach_payment_link)(event_booking, payment_details)
+
+            return JsonResponse({'id': reference_id, 'payment_link': payment_link}, status=status.HTTP_201_CREATED)
+
+        except ValueError as e:
+            logger.info('Invalid request: %s', e)
+            return JsonResponse({'error': 'Invalid request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception:
+            logger.exception('Unexpected error')
+            return JsonResponse({'error': 'Something went wrong. Please try again later.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class AsyncCallbackForPaymentGateway(AsyncAPIView):
+    query_budget = 5
+
+    async def get(self, request):
+        try:
+            razorpay_payment_id = request.GET.get('razorpay_payment_id')
+            razorpay_payment_link_reference_id = request.GET.get('razorpay_payment_link_reference_id')
+
+            event_booking = await EventBooking.objects.filter(formis_payment_id=razorpay_payment_link_reference_id).afirst()
+            if event_booking is None:
+                logger.info('Callback for unknown booking', extra={'reference_id': razorpay_payment_link_reference_id})
+                return JsonResponse({'error': 'Booking not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            if event_booking.payment_completed:
+                # The webhook got here first
+                return redirect('https://heyformis.com/hydrovibe2024/tickets')
+
+            with circuit('razorpay'):
+                razorpay_payment_status = await async_razorpay_client().fetch_payment(razorpay_payment_id)
+
+            if razorpay_payment_status.get('captured'):
+                paid_at = datetime.datetime.fromtimestamp(razorpay_payment_status.get('created_at'), tz=datetime.timezone.utc)
+
+                if not await sync_to_async(complete_payment)(event_booking, razorpay_payment_id, paid_at):
+                    logger.error('Payment captured after reservation expired and tickets sold out', extra={'reference_id': event_booking.formis_payment_id})
+            else:
+                logger.info('Payment not captured', extra={'reference_id': event_booking.formis_payment_id, 'payment_status': razorpay_payment_status.get('status')})
+
+            return redirect('https://heyformis.com/hydrovibe2024/tickets')
+
+        except ValueError as e:
+            logger.info('Invalid request: %s', e)
+            return JsonResponse({'error': 'Invalid request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception:
+            logger.exception('Unexpected error')
+            return JsonResponse({'error': 'Something went wrong. Please try again later.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
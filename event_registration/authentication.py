@@ -0,0 +1,120 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+# JWT authentication reading the token's user through the Django cache, so an authenticated
+# request needs no query to find out who is asking. Only CACHED_USER_FIELDS are cached, never
+# the password hash; the user is rebuilt from them, and other fields load from the database
+# if read. signals.py drops a cached user when the user is saved or deleted, and when one of
+# their refresh tokens is blacklisted. Saves that go through QuerySet.update() send no
+# signals: call invalidate_cached_user() after them.
+#
+#   AUTH_USER_CACHE_TTL    seconds a user is kept; bounds how stale it can get if an
+#                          invalidation is missed. With a cache each worker keeps to itself
+#                          (the default local memory one), an invalidation only reaches the
+#                          worker that made it, so the others go on seeing a deactivated user,
+#                          or a revoked is_staff, for up to this long. Views that grant staff
+#                          powers, like CheckInView, authenticate with JWTAuthentication instead.
+
+AUTH_USER_CACHE_TTL = getattr(settings, 'AUTH_USER_CACHE_TTL', 300)
+
+# What authentication, permissions and the views read of request.user
+CACHED_USER_FIELDS = ('id', 'mobile', 'is_active', 'is_staff', 'is_superuser')
+
+
+def user_cache_key(user_id):
+
+    return f'auth-user:{user_id}'
+
+
+def invalidate_cached_user(user_id):
+
+    cache.delete(user_cache_key(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    simplejwt's JWTAuthentication, with the user looked up in the cache before the database.
+    """
+
+    def user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+    def to_cache(self, user):
+        """
+        What is cached of `user`: its CACHED_USER_FIELDS, and the fingerprint of its password
+        that tokens are checked against when CHECK_REVOKE_TOKEN is on.
+        """
+        entry = {name: getattr(user, name) for name in CACHED_USER_FIELDS}
+        if api_settings.CHECK_REVOKE_TOKEN:
+            entry['password_md5'] = get_md5_hash_password(user.password)
+
+        return entry
+
+    def from_cache(self, entry):
+        """
+        A user rebuilt from a cache entry, as if loaded from the database with only the
+        cached fields; the rest are deferred.
+        """
+        names = [field.attname for field in self.user_model._meta.concrete_fields if field.attname in entry]
+        user = self.user_model.from_db(None, names, [entry[name] for name in names])
+
+        return user, entry.get('password_md5')
+
+    def check_user(self, user, validated_token, password_md5=None):
+        """
+        The checks JWTAuthentication makes on the user it found.
+        """
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if password_md5 is None:
+                password_md5 = get_md5_hash_password(user.password)
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_md5:
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        return user
+
+    def get_user(self, validated_token):
+        user_id = self.user_id(validated_token)
+        key = user_cache_key(user_id)
+        entry = cache.get(key)
+
+        if entry is not None:
+            user, password_md5 = self.from_cache(entry)
+            return self.check_user(user, validated_token, password_md5)
+
+        user = self.user_model.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is not None:
+            cache.set(key, self.to_cache(user), AUTH_USER_CACHE_TTL)
+
+        return self.check_user(user, validated_token)
+
+    async def aget_user(self, validated_token):
+        """
+        get_user() for async views.
+        """
+        user_id = self.user_id(validated_token)
+        key = user_cache_key(user_id)
+        entry = await cache.aget(key)
+
+        if entry is not None:
+            user, password_md5 = self.from_cache(entry)
+            return self.check_user(user, validated_token, password_md5)
+
+        user = await self.user_model.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).afirst()
+        if user is not None:
+            await cache.aset(key, self.to_cache(user), AUTH_USER_CACHE_TTL)
+
+        return self.check_user(user, validated_token)
@@ -0,0 +1,465 @@
+import datetime
+import logging
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from .models import Profile, EventBooking
+from .serializers import ProfileSerializer, EventBookingSerializer
+from .gateways import circuit, never_reached
+from .inventory import (reserve_tickets, release_reservation, confirm_reservation, confirm_reservations,
+                        expired_reservations, release_expired_reservations)
+from . import ticket_qr
+from .caching import bump_booking_version
+from .pubsub import publish, payment_channel
+
+# Booking runs in two phases so no database transaction is open while we wait on Razorpay:
+#   1. create_pending_booking() - a short transaction that saves the profile, holds the
+#      seats and writes an EventBooking without a payment link.
+#   2. request_payment_link() + attach_payment_link() - the gateway round-trip, outside any
+#      transaction, then an idempotent update that stores the link on the booking.
+# If phase 2 fails, abandon_pending_booking() gives the seats back. A booking left without a
+# link (the process died between the phases, or Razorpay could not be asked whether a link
+# was made) holds its seats until release_expired_bookings() settles it with Razorpay and
+# deletes it with its hold.
+
+logger = logging.getLogger(__name__)
+
+# Payment links that can still be paid, and so must be cancelled before their booking is dropped
+OPEN_LINK_STATUSES = ('created', 'partially_paid')
+
+# Columns ticket_qr() and the payment status views read; ticket_payload only needs the
+# booking's own columns, so nothing is joined.
+TICKET_FIELDS = ('pk', 'event_id', 'user_id', 'ticket_quantity', 'formis_payment_id', 'payment_completed',
+                 'ticket_qr_image')
+
+
+def bookings_for_ticket():
+    """
+    Bookings loaded with just what showing their ticket QR and payment state reads.
+    """
+    return EventBooking.objects.only(*TICKET_FIELDS)
+
+
+def bookings_for_details():
+    """
+    Bookings loaded with their ticket, user and the user's profile in the same query,
+    for views showing the booking in full.
+    """
+    return EventBooking.objects.select_related('ticket', 'user__profile').only(
+        *TICKET_FIELDS, 'attending_time', 'cab_facility_required', 'payment_link',
+        'ticket__name', 'user__mobile', 'user__profile__name'
+    )
+
+
+class InvalidBooking(ValidationError):
+    """
+    Raised by validate_booking() when the booking, rather than the profile, does not validate.
+    """
+
+
+def validate_booking(data):
+    """
+    Run a booking request's profile and booking through their serializers.
+    Returns (profile data, booking data); raises ValidationError, or InvalidBooking for the booking.
+    """
+    if not isinstance(data, dict):
+        raise ValidationError({'non_field_errors': ['Expected a JSON object.']})
+
+    profile_serializer = ProfileSerializer(data={
+        'name': data.get('name'),
+        'age': data.get('age'),
+        'mobile': data.get('mobile'),
+        'email': data.get('email'),
+        'gender': data.get('gender')
+    })
+    profile_serializer.is_valid(raise_exception=True)
+
+    booking_serializer = EventBookingSerializer(data={
+        'event': data.get('event'),
+        'ticket': data.get('ticket'),
+        'ticket_quantity': data.get('ticket_quantity'),
+        'attending_time': data.get('attending_time'),
+        'cab_facility_required': data.get('cab_facility_required', False)
+    })
+    if not booking_serializer.is_valid():
+        raise InvalidBooking(booking_serializer.errors)
+
+    return profile_serializer.validated_data, booking_serializer.validated_data
+
+
+def booking_error_response(error, response_class):
+    """
+    The response for the ValidationError validate_booking() raised: 400 with the details for an
+    invalid profile, 400 naming the clash for a booking that already exists, and 207 with the
+    details for any other invalid booking.
+    """
+    detail = error.detail
+    if not isinstance(error, InvalidBooking):
+        return response_class({'error': detail}, status=status.HTTP_400_BAD_REQUEST)
+
+    unique_error_messages = [
+        f'An event booking with this {field} already exists.'
+        for field in ('event', 'ticket') if field in detail and 'unique' in detail[field][0].code
+    ]
+
+    if unique_error_messages:
+        return response_class({'error': unique_error_messages}, status=status.HTTP_400_BAD_REQUEST)
+
+    return response_class({'error_detail': detail}, status=status.HTTP_207_MULTI_STATUS)
+
+
+class BookingExists(Exception):
+    """
+    Raised by create_pending_booking() for a user who already has a booking, paid or pending.
+    """
+
+    def __init__(self, event_booking):
+        self.event_booking = event_booking
+        super().__init__('You already have a booking.')
+
+
+def create_pending_booking(user, profile_data, booking_data, reference_id, payment_amount):
+    """
+    Phase 1: save the profile, hold the seats and create an EventBooking that has no payment link yet.
+    Returns (event_booking, reservation). Raises inventory.SoldOut when the seats are gone, and
+    BookingExists, with the seats given back, when the user already has a booking.
+    """
+    try:
+        return _create_pending_booking(user, profile_data, booking_data, reference_id, payment_amount)
+    except IntegrityError:
+        existing = EventBooking.objects.filter(user=user).only('formis_payment_id', 'payment_link').first()
+        if existing is None:
+            raise
+        raise BookingExists(existing)
+
+
+def _create_pending_booking(user, profile_data, booking_data, reference_id, payment_amount):
+
+    with transaction.atomic():
+        Profile.objects.get_or_create(user=user, defaults=profile_data)
+
+        reservation = reserve_tickets(booking_data['ticket'], booking_data['ticket_quantity'], reference_id)
+
+        event_booking = EventBooking.objects.create(
+            event=booking_data['event'],
+            user=user,
+            ticket=booking_data['ticket'],
+            ticket_quantity=booking_data['ticket_quantity'],
+            attending_time=booking_data['attending_time'],
+            cab_facility_required=booking_data.get('cab_facility_required', False),
+            location=booking_data.get('location', ''),
+            address=booking_data.get('address', ''),
+            formis_payment_id=reference_id,
+            payment_amount=payment_amount
+        )
+
+    return event_booking, reservation
+
+
+def payment_link_request(event_booking, customer, callback_url, expire_by):
+    """
+    The Razorpay payment link request for a pending booking.
+    """
+    return {
+        "amount": int(event_booking.payment_amount * 100),
+        "currency": "INR",
+        "description": "For Hydrovibe 2024",
+        "customer": customer,
+        "notify": {
+            "sms": True
+        },
+        "reminder_enable": True,
+        "notes": {
+            "event_name": "Hydrovibe 2024"
+        },
+        "reference_id": event_booking.formis_payment_id,
+        "callback_url": callback_url,
+        "callback_method": "get",
+        "expire_by": expire_by
+    }
+
+
+def request_payment_link(razorpay_client, event_booking, customer, callback_url, expire_by):
+    """
+    Phase 2: create the Razorpay payment link for a pending booking. Must not be called inside a transaction.
+
+    Razorpay rejects a second link with the same reference_id, so if an earlier attempt created the
+    link but never stored it, that link is looked up and reused.
+    """
+    try:
+        return razorpay_client.payment_link.create(payment_link_request(event_booking, customer, callback_url, expire_by))
+    except Exception as e:
+        if never_reached(e):
+            raise
+        try:
+            existing = razorpay_client.payment_link.all({'reference_id': event_booking.formis_payment_id})
+        except Exception:
+            # The create call's error is the one that says whether a link may have been made.
+            raise e
+        links = existing.get('payment_links') or []
+        if not links:
+            raise
+        return links[0]
+
+
+async def arequest_payment_link(async_razorpay_client, event_booking, customer, callback_url, expire_by):
+    """
+    request_payment_link() for the async views, with a gateways.AsyncRazorpayClient.
+    """
+    try:
+        return await async_razorpay_client.create_payment_link(
+            payment_link_request(event_booking, customer, callback_url, expire_by)
+        )
+    except Exception as e:
+        if never_reached(e):
+            raise
+        try:
+            existing = await async_razorpay_client.payment_links(event_booking.formis_payment_id)
+        except Exception:
+            raise e
+        links = existing.get('payment_links') or []
+        if not links:
+            raise
+        return links[0]
+
+
+def attach_payment_link(event_booking, payment_details):
+    """
+    Store the gateway's payment link on a pending booking. Safe to repeat: the first stored link wins.
+    Returns the link the booking ends up with.
+    """
+    EventBooking.objects.filter(pk=event_booking.pk, payment_link__isnull=True).update(
+        vendor_payment_id=payment_details.get('id'),
+        payment_link=payment_details.get('short_url')
+    )
+    bump_booking_version(event_booking.formis_payment_id, event_booking.user_id)
+
+    return EventBooking.objects.filter(pk=event_booking.pk).values_list('payment_link', flat=True).first()
+
+
+def _delete_pending_booking(event_booking):
+
+    with transaction.atomic():
+        release_reservation(event_booking.formis_payment_id)
+        EventBooking.objects.filter(pk=event_booking.pk, payment_link__isnull=True).delete()
+
+
+def _keep_pending_booking(event_booking, reason):
+    logger.warning('Pending booking kept for the expiry sweep: %s', reason, extra={'reference_id': event_booking.formis_payment_id})
+
+    return False
+
+
+def settle_payment_links(razorpay_client, reference_id):
+    """
+    Cancel every payment link Razorpay made for a booking that can still be paid, so none is
+    paid after the booking is dropped. Returns the booking's paid link instead, if it has one.
+    Raises when Razorpay cannot be asked, or refuses a cancel because the link was just paid.
+    """
+    with circuit('razorpay'):
+        links = razorpay_client.payment_link.all({'reference_id': reference_id}).get('payment_links') or []
+
+        for link in links:
+            if link.get('status') == 'paid':
+                return link
+
+        for link in links:
+            if link.get('status') in OPEN_LINK_STATUSES:
+                razorpay_client.payment_link.cancel(link['id'])
+
+    return None
+
+
+async def asettle_payment_links(async_razorpay_client, reference_id):
+    """
+    settle_payment_links() with a gateways.AsyncRazorpayClient.
+    """
+    with circuit('razorpay'):
+        existing = await async_razorpay_client.payment_links(reference_id)
+        links = existing.get('payment_links') or []
+
+        for link in links:
+            if link.get('status') == 'paid':
+                return link
+
+        for link in links:
+            if link.get('status') in OPEN_LINK_STATUSES:
+                await async_razorpay_client.cancel_payment_link(link['id'])
+
+    return None
+
+
+def captured_payment(payment_link):
+    """
+    (payment id, paid at) for a paid payment link, else None.
+    """
+    if not payment_link or payment_link.get('status') != 'paid':
+        return None
+
+    payments = [payment for payment in payment_link.get('payments') or [] if payment.get('status') == 'captured']
+    if not payments:
+        return None
+
+    paid_at = payments[-1].get('created_at')
+    return (
+        payments[-1]['payment_id'],
+        datetime.datetime.fromtimestamp(paid_at, tz=datetime.timezone.utc) if paid_at else timezone.now()
+    )
+
+
+def release_expired_bookings(razorpay_client, batch_size=500):
+    """
+    Release every held reservation whose TTL has passed, `batch_size` rows per transaction,
+    and delete the unpaid bookings they held seats for. Each booking's payment links are
+    settled on Razorpay first: a booking whose link was paid is completed instead, and one
+    Razorpay cannot be asked about keeps its hold until the next run.
+    Returns the number of reservations released.
+    """
+    total = 0
+    after = 0
+
+    while True:
+        batch = expired_reservations(batch_size, after)
+        if not batch:
+            return total
+        after = batch[-1][0]
+
+        reference_ids = {reference_id for _, reference_id in batch}
+        unpaid = EventBooking.objects.filter(formis_payment_id__in=reference_ids, payment_completed=False).only(
+            'pk', 'user_id', 'formis_payment_id'
+        )
+
+        for event_booking in unpaid:
+            try:
+                paid_link = settle_payment_links(razorpay_client, event_booking.formis_payment_id)
+            except Exception as e:
+                logger.warning('Expired booking kept: its payment link could not be settled: %s', e,
+                               extra={'reference_id': event_booking.formis_payment_id})
+                reference_ids.discard(event_booking.formis_payment_id)
+                continue
+
+            if paid_link:
+                reference_ids.discard(event_booking.formis_payment_id)
+                _complete_paid_link(event_booking, paid_link)
+
+        total += release_expired_reservations(reference_ids)
+
+
+def _complete_paid_link(event_booking, payment_link):
+    """
+    Store a link found paid on Razorpay on its booking and complete the booking's payment.
+    """
+    attach_payment_link(event_booking, payment_link)
+
+    payment = captured_payment(payment_link)
+    if not payment:
+        logger.warning('Paid payment link has no captured payment', extra={'reference_id': event_booking.formis_payment_id})
+        return
+
+    _, oversold = complete_payments({event_booking.formis_payment_id: payment})
+    if oversold:
+        logger.error('Payment captured after reservation expired and tickets sold out', extra={'reference_id': event_booking.formis_payment_id})
+
+
+def abandon_pending_booking(razorpay_client, event_booking, error=None):
+    """
+    Undo phase 1 after the payment link could not be created, `error` being why. When the
+    create call never reached Razorpay the booking is dropped at once. Otherwise the failed
+    call may still have made the link, so any link made for the booking is cancelled first,
+    and a paid one completes the booking instead; when Razorpay cannot settle it, the booking
+    is kept. Returns True if the booking was removed.
+    """
+    if error is None or not never_reached(error):
+        try:
+            paid_link = settle_payment_links(razorpay_client, event_booking.formis_payment_id)
+        except Exception as e:
+            return _keep_pending_booking(event_booking, f'its payment link could not be settled: {e}')
+
+        if paid_link:
+            _complete_paid_link(event_booking, paid_link)
+            return False
+
+    _delete_pending_booking(event_booking)
+    return True
+
+
+async def aabandon_pending_booking(async_razorpay_client, event_booking, error=None):
+    """
+    abandon_pending_booking() for the async views, with a gateways.AsyncRazorpayClient.
+    """
+    if error is None or not never_reached(error):
+        try:
+            paid_link = await asettle_payment_links(async_razorpay_client, event_booking.formis_payment_id)
+        except Exception as e:
+            return _keep_pending_booking(event_booking, f'its payment link could not be settled: {e}')
+
+        if paid_link:
+            await sync_to_async(_complete_paid_link)(event_booking, paid_link)
+            return False
+
+    await sync_to_async(_delete_pending_booking)(event_booking)
+    return True
+
+
+def _after_payment(event_booking):
+    """
+    What follows a booking being paid, once the payment is committed.
+    """
+    ticket_qr.invalidate(event_booking.formis_payment_id)
+    ticket_qr.schedule_prerender(event_booking)
+    transaction.on_commit(
+        lambda: publish(payment_channel(event_booking.formis_payment_id), {'payment_completed': True})
+    )
+
+
+def complete_payment(event_booking, vendor_payment_id, payment_completed_at):
+    """
+    Mark a booking paid and turn its seat hold into a sale. Safe to repeat for the same payment.
+    Returns False when the hold had expired and its seats were sold in the meantime.
+    """
+    event_booking.vendor_payment_id = vendor_payment_id
+    event_booking.payment_completed = True
+    event_booking.payment_completed_at = payment_completed_at
+    event_booking.save(update_fields=['vendor_payment_id', 'payment_completed', 'payment_completed_at'])
+    _after_payment(event_booking)
+
+    return confirm_reservation(event_booking.formis_payment_id)
+
+
+def complete_payments(payments):
+    """
+    complete_payment() for many bookings in one transaction. `payments` maps a booking's
+    reference id to (vendor_payment_id, payment_completed_at); bookings already paid are skipped.
+    Returns (bookings completed, reference ids whose seats were sold in the meantime).
+    """
+    with transaction.atomic():
+        bookings = list(
+            EventBooking.objects.select_for_update()
+            .filter(formis_payment_id__in=list(payments), payment_completed=False)
+            .only('pk', 'user_id', 'event_id', 'ticket_quantity', 'formis_payment_id')
+        )
+
+        for event_booking in bookings:
+            vendor_payment_id, payment_completed_at = payments[event_booking.formis_payment_id]
+            event_booking.vendor_payment_id = vendor_payment_id
+            event_booking.payment_completed = True
+            event_booking.payment_completed_at = payment_completed_at
+
+        # bulk_update() sends no post_save, so the version bump the signal would do happens here.
+        EventBooking.objects.bulk_update(bookings, ['vendor_payment_id', 'payment_completed', 'payment_completed_at'])
+        for event_booking in bookings:
+            bump_booking_version(event_booking.formis_payment_id, event_booking.user_id)
+            _after_payment(event_booking)
+
+        oversold = confirm_reservations([event_booking.formis_payment_id for event_booking in bookings])
+
+        # A payment for a booking that is gone has to be refunded or the booking restored by hand.
+        unmatched = set(payments) - {event_booking.formis_payment_id for event_booking in bookings}
+        if unmatched:
+            unmatched -= set(EventBooking.objects.filter(formis_payment_id__in=unmatched).values_list('formis_payment_id', flat=True))
+        for reference_id in unmatched:
+            logger.warning('Payment captured for a booking that does not exist', extra={'reference_id': reference_id})
+
+    return bookings, oversold
@@ -0,0 +1,134 @@
+import time
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils import timezone
+
+# Keys and invalidation for data cached in the Django cache (CACHES['default'],
+# local memory unless configured otherwise).
+#
+#   LATEST_EVENT_CACHE_TTL    seconds the latest-event-details payload is kept.
+#   LATEST_EVENT_SEATS_DELAY  seconds the payload may go on showing seat counts from before a
+#                             reservation or release. Seats move with every booking, so dropping
+#                             the payload on each would leave it uncached through a rush; instead
+#                             it is rebuilt at most this often while they keep moving.
+#   VERSION_STAMP_TTL         seconds a version stamp is kept. With a cache each worker keeps
+#                             to itself, a bump reaches only the worker that made it, and the
+#                             others answer 304 for at most this long; None keeps stamps until
+#                             evicted, for a cache every worker shares. Booking endpoints, whose
+#                             staleness a user would notice, only answer 304 from a shared cache.
+
+LATEST_EVENT_CACHE_TTL = getattr(settings, 'LATEST_EVENT_CACHE_TTL', 60)
+LATEST_EVENT_SEATS_DELAY = getattr(settings, 'LATEST_EVENT_SEATS_DELAY', 2)
+VERSION_STAMP_TTL = getattr(settings, 'VERSION_STAMP_TTL', 60)
+
+
+SEATS_CHANGED_KEY = 'latest-active-event:seats-changed'
+
+
+def latest_event_key():
+    # Dated, so yesterday's event drops out at midnight without an invalidation.
+    return f'latest-active-event:{timezone.now().date().isoformat()}'
+
+
+def get_latest_event():
+    """
+    The cached latest-event-details payload as (time it was built, data), or None if there is
+    none or its seat counts have been out of date for over LATEST_EVENT_SEATS_DELAY seconds.
+    """
+    key = latest_event_key()
+    cached = cache.get_many([key, SEATS_CHANGED_KEY])
+    entry = cached.get(key)
+    if entry is None:
+        return None
+
+    built_at, data = entry
+    seats_changed_at = cached.get(SEATS_CHANGED_KEY)
+    if seats_changed_at is not None and seats_changed_at > built_at and time.time() - built_at > LATEST_EVENT_SEATS_DELAY:
+        return None
+
+    return entry
+
+
+def set_latest_event(data):
+    """
+    Cache the latest-event-details payload. Returns the time it was built.
+    """
+    built_at = time.time()
+    cache.set(latest_event_key(), (built_at, data), LATEST_EVENT_CACHE_TTL)
+    return built_at
+
+
+def seats_changed():
+    """
+    Note that seat counts moved, so the cached payload is rebuilt once it is
+    LATEST_EVENT_SEATS_DELAY seconds old.
+    """
+    cache.set(SEATS_CHANGED_KEY, time.time(), LATEST_EVENT_CACHE_TTL)
+
+
+def invalidate_latest_event(*args, **kwargs):
+    """
+    Drop the cached latest-event-details payload and move its version on.
+    Accepts and ignores signal arguments.
+    """
+    cache.delete(latest_event_key())
+    bump_version(EVENTS_SCOPE)
+
+
+# Version stamps: the time a piece of state last changed, per scope. Read endpoints derive
+# ETags from them, so a conditional request can be answered with a 304
+# from the cache alone. Bump a scope after the change commits, never before.
+
+EVENTS_SCOPE = 'events'
+
+
+def booking_scope(formis_payment_id):
+
+    return f'booking:{formis_payment_id}'
+
+
+def user_bookings_scope(user_id):
+
+    return f'user-bookings:{user_id}'
+
+
+def cache_is_shared():
+    """
+    Whether every worker process reads and writes the same default cache.
+    """
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def get_version(scope):
+    """
+    The scope's version stamp. A scope the cache does not know (e.g. after eviction or
+    expiry) starts a new version, which only costs clients one full response.
+    """
+    key = f'version:{scope}'
+    version = cache.get(key)
+
+    if version is None:
+        cache.add(key, time.time(), VERSION_STAMP_TTL)
+        version = cache.get(key)
+
+    return version
+
+
+def bump_version(scope):
+
+    cache.set(f'version:{scope}', time.time(), VERSION_STAMP_TTL)
+
+
+def bump_booking_version(formis_payment_id, user_id):
+    """
+    Move on the versions of every response showing this booking, once the change commits.
+    Call it after changing a booking with QuerySet.update(), which sends no signals.
+    """
+    def bump():
+        bump_version(booking_scope(formis_payment_id))
+        bump_version(user_bookings_scope(user_id))
+
+    transaction.on_commit(bump)
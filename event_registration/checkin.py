@@ -0,0 +1,154 @@
+import logging
+import os
+import struct
+import threading
+from django.conf import settings
+from django.utils import timezone
+from .models import EventBooking
+
+# Gate check-in without a read per scan.
+#
+# Each process keeps, per event, a hash index of the paid bookings (booking id -> ticket
+# quantity) and the ones already checked in. The index is loaded once, from a file written
+# by `manage.py build_checkin_index` when CHECKIN_INDEX_DIR has one, otherwise with a single
+# query. A scan is a dict lookup that turns away unknown and already admitted tickets, then
+# one conditional UPDATE of EventBooking.checked_in_at by primary key: the database admits
+# a ticket once however many gates and workers scan it.
+#
+#   CHECKIN_INDEX_DIR         directory holding exported event indexes, optional.
+
+INDEX_DIR = getattr(settings, 'CHECKIN_INDEX_DIR', None)
+
+ADMITTED = 'admitted'
+ALREADY_CHECKED_IN = 'already_checked_in'
+NOT_FOUND = 'not_found'
+
+# Index file: header (magic, version, event id, record count), then one record per paid booking.
+FILE_MAGIC = b'ERCI'
+FILE_HEADER = struct.Struct('>4sBII')
+FILE_RECORD = struct.Struct('>QHB')
+
+logger = logging.getLogger(__name__)
+
+
+class CheckInIndex:
+    """
+    The paid bookings of one event, held in memory for check-in.
+    """
+
+    def __init__(self, event_id, bookings, checked_in=()):
+        self.event_id = event_id
+        self.bookings = bookings
+        self.checked_in = set(checked_in)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_database(cls, event_id):
+        bookings = {}
+        checked_in = []
+        rows = EventBooking.objects.filter(event_id=event_id, payment_completed=True).values_list(
+            'pk', 'ticket_quantity', 'checked_in_at'
+        )
+        for booking_id, quantity, checked_in_at in rows.iterator(chunk_size=5000):
+            bookings[booking_id] = quantity
+            if checked_in_at:
+                checked_in.append(booking_id)
+
+        return cls(event_id, bookings, checked_in)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'rb') as index_file:
+            magic, version, event_id, count = FILE_HEADER.unpack(index_file.read(FILE_HEADER.size))
+            if magic != FILE_MAGIC or version != 1:
+                raise ValueError(f'{path} is not a check-in index')
+
+            bookings = {}
+            checked_in = []
+            for booking_id, quantity, flags in FILE_RECORD.iter_unpack(index_file.read(FILE_RECORD.size * count)):
+                bookings[booking_id] = quantity
+                if flags & 1:
+                    checked_in.append(booking_id)
+
+        return cls(event_id, bookings, checked_in)
+
+    def export(self, path):
+        """
+        Write the index in the compact binary format scanner devices load.
+        """
+        with open(path, 'wb') as index_file:
+            index_file.write(FILE_HEADER.pack(FILE_MAGIC, 1, self.event_id, len(self.bookings)))
+            for booking_id, quantity in self.bookings.items():
+                index_file.write(FILE_RECORD.pack(booking_id, quantity, 1 if booking_id in self.checked_in else 0))
+
+    def add(self, booking_id, quantity):
+
+        with self.lock:
+            self.bookings[booking_id] = quantity
+
+    def check_in(self, booking_id):
+        """
+        Admit a booking once. Returns (result, ticket quantity).
+        """
+        quantity = self.bookings.get(booking_id)
+        if quantity is None:
+            return NOT_FOUND, 0
+
+        if booking_id in self.checked_in:
+            return ALREADY_CHECKED_IN, quantity
+
+        # Only the scan whose UPDATE finds checked_in_at still unset gets in.
+        admitted = EventBooking.objects.filter(pk=booking_id, checked_in_at__isnull=True).update(
+            checked_in_at=timezone.now()
+        )
+        with self.lock:
+            self.checked_in.add(booking_id)
+
+        return (ADMITTED if admitted else ALREADY_CHECKED_IN), quantity
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def index_path(event_id, directory=None):
+
+    return os.path.join(directory or INDEX_DIR, f'event-{event_id}.idx')
+
+
+def get_index(event_id):
+    """
+    The process's check-in index for an event, loaded on first use.
+    """
+    index = _indexes.get(event_id)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(event_id)
+            if index is None:
+                if INDEX_DIR and os.path.exists(index_path(event_id)):
+                    index = CheckInIndex.from_file(index_path(event_id))
+                else:
+                    index = CheckInIndex.from_database(event_id)
+                _indexes[event_id] = index
+
+    return index
+
+
+def check_in(payload):
+    """
+    Check in the booking of a decoded ticket payload. Returns (result, ticket quantity).
+    """
+    index = get_index(payload.event_id)
+    result, quantity = index.check_in(payload.booking_id)
+
+    if result == NOT_FOUND:
+        # Paid after the index was loaded: one lookup, then it is indexed too.
+        quantity = EventBooking.objects.filter(
+            pk=payload.booking_id, event_id=payload.event_id, payment_completed=True
+        ).values_list('ticket_quantity', flat=True).first()
+        if quantity is None:
+            return NOT_FOUND, 0
+        index.add(payload.booking_id, quantity)
+        result, quantity = index.check_in(payload.booking_id)
+
+    return result, quantity
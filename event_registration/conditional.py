@@ -0,0 +1,46 @@
+import hashlib
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+# Conditional GET for read endpoints, driven by the version stamps in caching.py:
+#
+#     version = get_version(booking_scope(reference_id))
+#     not_modified = not_modified_response(request, version, reference_id)
+#     if not_modified:
+#         return not_modified
+#     ...
+#     return with_validators(Response(data), version, reference_id)
+#
+# The 304 path reads one cache key and touches neither the database nor the serializers.
+# Only ETags are sent: Last-Modified has one-second resolution, so a client holding a copy
+# from the same second as a change would be told its stale copy is current.
+
+
+def make_etag(version, *parts):
+
+    digest = hashlib.blake2s(repr((version,) + parts).encode(), digest_size=12).hexdigest()
+    return quote_etag(digest)
+
+
+def not_modified_response(request, version, *parts):
+    """
+    A 304 response when the client's copy matches `version`, otherwise None.
+    `parts` tell apart responses that share a version, e.g. different query parameters.
+    """
+    etag = make_etag(version, *parts)
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+
+    if not if_none_match or not (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+        return None
+
+    return with_validators(Response(status=status.HTTP_304_NOT_MODIFIED), version, *parts)
+
+
+def with_validators(response, version, *parts):
+    """
+    Add the ETag for `version` to a response.
+    """
+    response['ETag'] = make_etag(version, *parts)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
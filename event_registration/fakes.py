@@ -0,0 +1,201 @@
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# A local stand-in for the Razorpay and Twilio HTTP APIs, for benchmarks and tests.
+# Point the shared clients at it with RAZORPAY_BASE_URL / TWILIO_BASE_URL (see gateways.py).
+# It answers the handful of endpoints this app calls, after `latency` seconds, fails an
+# `error_rate` share of them with a 503 as an overloaded provider would, and counts the
+# TCP connections it accepts so connection reuse can be checked. Whether a call fails is a
+# hash of the `seed` and the call itself (its path, the mobile number or reference it is
+# for, and how many times that was asked before), not a draw from a shared generator, so
+# the outcome does not depend on the order concurrent clients happen to arrive in. Calls
+# keyed by a mobile number fail alike on every run with the same seed; those keyed by a
+# booking reference fail alike for the same reference.
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes; without this, delayed ACKs add ~40ms per call.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status_code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(raw or b'{}')
+        return {key: values[0] for key, values in parse_qs(raw.decode()).items()}
+
+    def _handle(self, method):
+        server = self.server
+        url = urlsplit(self.path)
+        path = url.path.rstrip('/')
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        data = self._read_body() if method == 'POST' else {}
+
+        with server.lock:
+            server.requests += 1
+        failing = server.error_rate and server.draw(method, path, query, data) < server.error_rate
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if failing:
+            with server.lock:
+                server.errors += 1
+            if path.endswith('/Messages.json'):
+                return self._reply(503, {'code': 20503, 'message': 'Service unavailable', 'status': 503})
+            return self._reply(503, {'error': {'code': 'SERVER_ERROR', 'description': 'Service unavailable'}})
+
+        if method == 'POST' and path == '/v1/payment_links':
+            return self._reply(200, server.add_payment_link(data.get('reference_id'), data.get('amount')))
+
+        if method == 'GET' and path == '/v1/payment_links':
+            with server.lock:
+                links = [link for link in server.payment_links.values()
+                         if link['reference_id'] == query.get('reference_id')]
+            return self._reply(200, {'payment_links': links})
+
+        if method == 'POST' and path.startswith('/v1/payment_links/') and path.endswith('/cancel'):
+            with server.lock:
+                link = server.payment_links.get(path.split('/')[3])
+                if link and link['status'] == 'created':
+                    link['status'] = 'cancelled'
+            if not link or link['status'] != 'cancelled':
+                return self._reply(400, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'cannot cancel'}})
+            return self._reply(200, link)
+
+        if method == 'GET' and path.startswith('/v1/payment_links/'):
+            link = server.payment_links.get(path.rsplit('/', 1)[1])
+            if not link:
+                return self._reply(404, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'not found'}})
+            return self._reply(200, link)
+
+        if method == 'GET' and path.startswith('/v1/payments/'):
+            return self._reply(200, {
+                'id': path.rsplit('/', 1)[1], 'status': 'captured', 'captured': True, 'created_at': int(time.time())
+            })
+
+        if method == 'POST' and path.endswith('/Messages.json'):
+            with server.lock:
+                server.messages.append((data.get('To'), data.get('Body')))
+            return self._reply(201, {
+                'sid': f'SM{uuid.uuid4().hex}', 'status': 'queued', 'to': data.get('To'), 'body': data.get('Body')
+            })
+
+        return self._reply(404, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': f'no fake for {method} {path}'}})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    """
+    Runs the fake provider API on a background thread:
+
+        with FakeProviderServer(latency=0.05, error_rate=0.01) as server:
+            ...  # RAZORPAY_BASE_URL = TWILIO_BASE_URL = server.url
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, seed=None):
+        super().__init__((host, port), FakeProviderHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = random.getrandbits(64) if seed is None else seed
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self.payment_links = {}
+        self.messages = []
+        self.thread = None
+
+    def draw(self, method, path, query, data):
+        """
+        A number in [0, 1) standing for this call, the same for the same seed and call.
+        """
+        customer = data.get('customer') or {}
+        subject = data.get('To') or customer.get('contact') or data.get('reference_id') or query.get('reference_id')
+        with self.lock:
+            attempt = self.calls[method, path, subject] = self.calls.get((method, path, subject), 0) + 1
+
+        digest = hashlib.blake2b(repr((self.seed, method, path, subject, attempt)).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big') / 2 ** 64
+
+    def add_payment_link(self, reference_id, amount=None, paid=False):
+        """
+        Create a payment link as if through the API; `paid` gives it a captured payment.
+        """
+        link = {
+            'id': f'plink_{uuid.uuid4().hex[:14]}',
+            'short_url': f'https://rzp.io/i/{uuid.uuid4().hex[:10]}',
+            'reference_id': reference_id,
+            'amount': amount,
+            'status': 'created',
+            'payments': None,
+        }
+        if paid:
+            link['status'] = 'paid'
+            link['payments'] = [{
+                'payment_id': f'pay_{uuid.uuid4().hex[:14]}', 'plink_id': link['id'], 'amount': amount,
+                'status': 'captured', 'created_at': int(time.time())
+            }]
+
+        with self.lock:
+            self.payment_links[link['id']] = link
+        return link
+
+    def messages_to(self, to):
+        """
+        Bodies of the text messages sent to `to` so far, oldest first.
+        """
+        with self.lock:
+            return [body for recipient, body in self.messages if recipient == to]
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
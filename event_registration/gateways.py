@@ -0,0 +1,285 @@
+import asyncio
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit, urlunsplit
+import aiohttp
+import razorpay
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from twilio.http.http_client import TwilioHttpClient
+from twilio.rest import Client
+from settings.config import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, RAZORPAY_KEY, RAZORPAY_SECRET
+from . import metrics
+
+# Process-wide provider clients. Each provider gets one client whose HTTP session keeps
+# connections alive, so calls after the first skip the TCP and TLS handshakes, and a
+# circuit breaker that fails calls fast while the provider is down.
+#
+#   GATEWAY_POOL_SIZE           keep-alive connections kept per provider host.
+#   GATEWAY_CONNECT_TIMEOUT     seconds to wait for a connection.
+#   GATEWAY_READ_TIMEOUT        seconds to wait for a response.
+#   GATEWAY_BREAKER_THRESHOLD   consecutive failures that open a provider's circuit.
+#   GATEWAY_BREAKER_RESET       seconds an open circuit waits before letting a trial call through.
+#   ASYNC_GATEWAY_POOL_SIZE     connections the async views' client may open per event loop.
+#   RAZORPAY_BASE_URL, TWILIO_BASE_URL
+#                               point a provider at another host, e.g. a local stub server.
+
+POOL_SIZE = getattr(settings, 'GATEWAY_POOL_SIZE', 20)
+CONNECT_TIMEOUT = getattr(settings, 'GATEWAY_CONNECT_TIMEOUT', 3.05)
+READ_TIMEOUT = getattr(settings, 'GATEWAY_READ_TIMEOUT', 15)
+BREAKER_THRESHOLD = getattr(settings, 'GATEWAY_BREAKER_THRESHOLD', 5)
+BREAKER_RESET = getattr(settings, 'GATEWAY_BREAKER_RESET', 30)
+ASYNC_POOL_SIZE = getattr(settings, 'ASYNC_GATEWAY_POOL_SIZE', 500)
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling a provider whose circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive provider failures. After `threshold` of them the circuit opens and
+    calls fail at once with CircuitOpen. After `reset_after` seconds one trial call is let
+    through: success closes the circuit again, failure keeps it open for another period.
+
+        with circuit('razorpay'):
+            razorpay_client().payment.fetch(payment_id)
+    """
+
+    def __init__(self, name, threshold=BREAKER_THRESHOLD, reset_after=BREAKER_RESET):
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def __enter__(self):
+        if self.opened_at is None:
+            return self
+
+        with self.lock:
+            if self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_after:
+                metrics.provider_circuit_open.inc(self.name)
+                raise CircuitOpen(f'{self.name} circuit is open')
+            # Let this call through as the trial; others keep failing fast until it returns.
+            self.opened_at = time.monotonic()
+
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self.lock:
+            if exc is None or not _is_provider_failure(exc):
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.failures >= self.threshold:
+                    self.opened_at = time.monotonic()
+
+        return False
+
+
+def _is_provider_failure(exc):
+    """
+    Only network errors and provider-side (5xx) errors count against a provider.
+    Rejections of a bad request mean the provider is up.
+    """
+    if isinstance(exc, (requests.RequestException, aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return True
+
+    if isinstance(exc, (razorpay.errors.ServerError, razorpay.errors.GatewayError)):
+        return True
+
+    return (getattr(exc, 'status', None) or 0) >= 500
+
+
+def never_reached(exc):
+    """
+    Whether a failed provider call certainly never reached the provider: its circuit was open,
+    or no connection could be made. A call that failed later may still have been acted on.
+    """
+    if isinstance(exc, (CircuitOpen, requests.ConnectTimeout, aiohttp.ClientConnectorError)):
+        return True
+
+    # requests reports a refused connection as a ConnectionError wrapping urllib3's NewConnectionError.
+    reason = getattr(exc.args[0], 'reason', None) if isinstance(exc, requests.ConnectionError) and exc.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+class PooledSession(requests.Session):
+    """
+    A requests session with a sized keep-alive pool and default timeouts. Calls are timed
+    in metrics under `provider`.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), provider='other'):
+        super().__init__()
+        self.timeout = timeout
+        self.provider = provider
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+    def send(self, request, **kwargs):
+        # Every call ends up here, including Twilio's, which prepares its own requests.
+        started = time.perf_counter()
+        status = None
+        try:
+            response = super().send(request, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            metrics.provider_request_duration.observe(
+                time.perf_counter() - started, self.provider, request.method, metrics.outcome(status)
+            )
+
+
+class PooledTwilioHttpClient(TwilioHttpClient):
+    """
+    Twilio's HTTP client on a PooledSession, optionally sending to `base_url` instead of Twilio.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, timeout=READ_TIMEOUT, base_url=None):
+        super().__init__(pool_connections=True, timeout=timeout)
+        self.session = PooledSession(pool_size, timeout=(CONNECT_TIMEOUT, timeout), provider='twilio')
+        self.base_url = base_url
+
+    def request(self, method, url, *args, **kwargs):
+        if self.base_url:
+            base = urlsplit(self.base_url)
+            url = urlunsplit(urlsplit(url)._replace(scheme=base.scheme, netloc=base.netloc))
+        return super().request(method, url, *args, **kwargs)
+
+
+class AsyncRazorpayClient:
+    """
+    The Razorpay calls the async views make, over aiohttp, so waiting on Razorpay holds no thread.
+    Bound to the event loop it was created on; use async_razorpay_client().
+    """
+
+    def __init__(self, base_url=None, pool_size=ASYNC_POOL_SIZE):
+        self.base_url = (base_url or razorpay.constants.url.URL.BASE_URL).rstrip('/')
+        self.session = aiohttp.ClientSession(
+            auth=aiohttp.BasicAuth(RAZORPAY_KEY, RAZORPAY_SECRET),
+            connector=aiohttp.TCPConnector(limit=pool_size),
+            timeout=aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT),
+            raise_for_status=True
+        )
+
+    async def _request(self, method, path, **kwargs):
+        started = time.perf_counter()
+        status = None
+        try:
+            async with self.session.request(method, f'{self.base_url}/v1{path}', **kwargs) as response:
+                status = response.status
+                return await response.json()
+        except aiohttp.ClientResponseError as e:
+            status = e.status
+            raise
+        finally:
+            metrics.provider_request_duration.observe(
+                time.perf_counter() - started, 'razorpay', method, metrics.outcome(status)
+            )
+
+    async def create_payment_link(self, data):
+
+        return await self._request('POST', '/payment_links', json=data)
+
+    async def payment_links(self, reference_id):
+
+        return await self._request('GET', '/payment_links', params={'reference_id': reference_id})
+
+    async def cancel_payment_link(self, payment_link_id):
+
+        return await self._request('POST', f'/payment_links/{payment_link_id}/cancel')
+
+    async def fetch_payment(self, payment_id):
+
+        return await self._request('GET', f'/payments/{payment_id}')
+
+    async def close(self):
+
+        await self.session.close()
+
+
+_clients = {}
+_breakers = {}
+_async_clients = weakref.WeakKeyDictionary()
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(registry, name, factory):
+
+    instance = registry.get(name)
+    if instance is None:
+        with _registry_lock:
+            instance = registry.get(name)
+            if instance is None:
+                instance = registry[name] = factory()
+
+    return instance
+
+
+def razorpay_client():
+    """
+    The shared Razorpay client.
+    """
+    def build():
+        base_url = getattr(settings, 'RAZORPAY_BASE_URL', None)
+        options = {'base_url': base_url} if base_url else {}
+        return razorpay.Client(session=PooledSession(provider='razorpay'), auth=(RAZORPAY_KEY, RAZORPAY_SECRET), **options)
+
+    return _get_or_create(_clients, 'razorpay', build)
+
+
+def twilio_client():
+    """
+    The shared Twilio client.
+    """
+    def build():
+        return Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=PooledTwilioHttpClient(base_url=getattr(settings, 'TWILIO_BASE_URL', None)))
+
+    return _get_or_create(_clients, 'twilio', build)
+
+
+def async_razorpay_client():
+    """
+    The running event loop's Razorpay client. Call from a coroutine.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncRazorpayClient(base_url=getattr(settings, 'RAZORPAY_BASE_URL', None))
+
+    return client
+
+
+def circuit(provider):
+    """
+    The circuit breaker guarding calls to `provider`.
+    """
+    return _get_or_create(_breakers, provider, lambda: CircuitBreaker(provider))
+
+
+def reset():
+    """
+    Drop every shared client and breaker, e.g. after changing settings in tests.
+    """
+    with _registry_lock:
+        _clients.clear()
+        _breakers.clear()
+        _async_clients.clear()
@@ -0,0 +1,280 @@
+import random
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Ticket, TicketInventoryShard, TicketReservation, EventBooking
+from .caching import invalidate_latest_event, seats_changed
+
+# How long seats stay held while the payment link is pending. Razorpay does not
+# accept payment links expiring sooner than 15 minutes, so keep this above that.
+RESERVATION_TTL = getattr(settings, 'TICKET_RESERVATION_TTL', timedelta(minutes=20))
+
+# Number of counter rows each new ticket's inventory is split across.
+SHARD_COUNT = getattr(settings, 'TICKET_INVENTORY_SHARDS', 8)
+
+
+class SoldOut(Exception):
+    """
+    Raised when a ticket does not have enough seats left to satisfy a reservation.
+    """
+
+    def __init__(self, available):
+        self.available = available
+        super().__init__(f'Only {available} tickets are available.')
+
+
+def create_shards(ticket, shard_count=None):
+    """
+    Split the seats currently available on `ticket` across `shard_count` counter rows.
+    From then on the shards, not `Ticket.total_tickets_available`, hold the live count.
+    """
+    shard_count = shard_count or SHARD_COUNT
+    base, remainder = divmod(ticket.total_tickets_available, shard_count)
+
+    TicketInventoryShard.objects.bulk_create([
+        TicketInventoryShard(ticket=ticket, shard=index, available=base + (1 if index < remainder else 0))
+        for index in range(shard_count)
+    ])
+
+
+def set_available(ticket, available):
+    """
+    Make `available` seats of `ticket` bookable, whatever its shards hold now, e.g. after
+    the count is edited in the admin. Seats held by pending bookings are not included.
+    """
+    with transaction.atomic():
+        shards = list(TicketInventoryShard.objects.select_for_update().filter(ticket_id=ticket.pk).order_by('pk'))
+
+        if shards:
+            base, remainder = divmod(available, len(shards))
+            for index, shard in enumerate(shards):
+                shard.available = base + (1 if index < remainder else 0)
+            TicketInventoryShard.objects.bulk_update(shards, ['available'])
+
+        Ticket.objects.filter(pk=ticket.pk).update(total_tickets_available=available)
+        transaction.on_commit(invalidate_latest_event)
+
+
+def with_available(tickets):
+    """
+    Annotate a Ticket queryset with `available`, the seats left summed over its
+    shards, in the same query. Unsharded tickets fall back to their own column.
+    """
+    return tickets.annotate(available=Coalesce(Sum('inventory_shards__available'), F('total_tickets_available')))
+
+
+def available_for(ticket):
+    """
+    Seats left for a single ticket.
+    """
+    available = getattr(ticket, 'available', None)
+    if available is not None:
+        return available
+
+    return with_available(Ticket.objects.filter(pk=ticket.pk)).values_list('available', flat=True).first() or 0
+
+
+def _take_seats(ticket_id, quantity):
+    """
+    Conditionally decrement the ticket inventory. The `gte` filter and the `F()`
+    decrement run as a single UPDATE, so concurrent callers can never push the
+    count below zero and nobody has to hold a lock across a read-modify-write.
+
+    A random shard is tried first, which is the only write in the common case.
+    When it runs short, seats are gathered from the other shards under row locks,
+    taken in pk order so concurrent callers cannot deadlock.
+    Must be called inside a transaction.
+    """
+    transaction.on_commit(seats_changed)
+
+    if TicketInventoryShard.objects.filter(
+        ticket_id=ticket_id, shard=random.randrange(SHARD_COUNT), available__gte=quantity
+    ).update(available=F('available') - quantity):
+        return 1
+
+    shards = list(
+        TicketInventoryShard.objects.select_for_update()
+        .filter(ticket_id=ticket_id)
+        .order_by('pk')
+        .values_list('pk', 'available')
+    )
+
+    if not shards:
+        # Ticket created before inventory sharding
+        return Ticket.objects.filter(
+            pk=ticket_id, total_tickets_available__gte=quantity
+        ).update(total_tickets_available=F('total_tickets_available') - quantity)
+
+    if sum(available for _, available in shards) < quantity:
+        return 0
+
+    remaining = quantity
+    for pk, available in shards:
+        take = min(available, remaining)
+        if take:
+            TicketInventoryShard.objects.filter(pk=pk).update(available=F('available') - take)
+            remaining -= take
+        if not remaining:
+            break
+
+    return 1
+
+
+def _return_seats(ticket_id, quantity):
+
+    transaction.on_commit(seats_changed)
+
+    if TicketInventoryShard.objects.filter(
+        ticket_id=ticket_id, shard=random.randrange(SHARD_COUNT)
+    ).update(available=F('available') + quantity):
+        return
+
+    shard_id = TicketInventoryShard.objects.filter(ticket_id=ticket_id).values_list('pk', flat=True).first()
+
+    if shard_id:
+        TicketInventoryShard.objects.filter(pk=shard_id).update(available=F('available') + quantity)
+    else:
+        Ticket.objects.filter(pk=ticket_id).update(total_tickets_available=F('total_tickets_available') + quantity)
+
+
+def reserve_tickets(ticket, quantity, reference_id, ttl=None):
+    """
+    Take `quantity` seats out of `ticket` and hold them under `reference_id`.
+    Raises SoldOut if the seats are not available.
+    """
+    ttl = ttl or RESERVATION_TTL
+
+    with transaction.atomic():
+        if not _take_seats(ticket.pk, quantity):
+            raise SoldOut(available_for(ticket))
+
+        return TicketReservation.objects.create(
+            ticket_id=ticket.pk,
+            reference_id=reference_id,
+            quantity=quantity,
+            expires_at=timezone.now() + ttl
+        )
+
+
+def release_reservation(reference_id):
+    """
+    Give the seats of a held reservation back to the inventory.
+    Returns True if this call released it, False if it was already confirmed or released.
+    """
+    reservation = TicketReservation.objects.filter(reference_id=reference_id).only('ticket_id', 'quantity').first()
+
+    if not reservation:
+        return False
+
+    with transaction.atomic():
+        # Only the caller that flips the status gets to return the seats.
+        released = TicketReservation.objects.filter(
+            pk=reservation.pk, status=TicketReservation.HELD
+        ).update(status=TicketReservation.RELEASED)
+
+        if released:
+            _return_seats(reservation.ticket_id, reservation.quantity)
+
+    return bool(released)
+
+
+def confirm_reservation(reference_id):
+    """
+    Turn a held reservation into a permanent sale once its payment is captured.
+    If the hold already expired, the seats are taken again when still available.
+    Returns False only when an expired hold could not be re-taken (an oversell).
+    """
+    with transaction.atomic():
+        confirmed = TicketReservation.objects.filter(
+            reference_id=reference_id, status=TicketReservation.HELD
+        ).update(status=TicketReservation.CONFIRMED)
+
+        if confirmed:
+            return True
+
+        reservation = TicketReservation.objects.select_for_update().filter(
+            reference_id=reference_id, status=TicketReservation.RELEASED
+        ).first()
+
+        if not reservation:
+            # Already confirmed, or booked before reservations existed.
+            return True
+
+        reservation.status = TicketReservation.CONFIRMED
+        reservation.save(update_fields=['status'])
+
+        return bool(_take_seats(reservation.ticket_id, reservation.quantity))
+
+
+def confirm_reservations(reference_ids):
+    """
+    confirm_reservation() for many payments: one UPDATE for the holds still live, then the
+    expired ones one by one. Returns the reference ids that could not be confirmed.
+    """
+    reference_ids = list(reference_ids)
+
+    with transaction.atomic():
+        held = set(
+            TicketReservation.objects.select_for_update()
+            .filter(reference_id__in=reference_ids, status=TicketReservation.HELD)
+            .values_list('reference_id', flat=True)
+        )
+        TicketReservation.objects.filter(reference_id__in=held).update(status=TicketReservation.CONFIRMED)
+
+        # Holds that expired meanwhile need their seats taken again; no reservation at all,
+        # or one already confirmed, needs nothing.
+        released = TicketReservation.objects.filter(
+            reference_id__in=reference_ids, status=TicketReservation.RELEASED
+        ).values_list('reference_id', flat=True)
+
+        return [reference_id for reference_id in released if not confirm_reservation(reference_id)]
+
+
+def expired_reservations(batch_size=500, after=0):
+    """
+    (pk, reference id) of up to `batch_size` held reservations whose TTL has passed, in pk order
+    from `after` on.
+    """
+    return list(
+        TicketReservation.objects.filter(status=TicketReservation.HELD, expires_at__lte=timezone.now(), pk__gt=after)
+        .order_by('pk').values_list('pk', 'reference_id')[:batch_size]
+    )
+
+
+def release_expired_reservations(reference_ids):
+    """
+    Release those of `reference_ids` whose holds have expired and delete the unpaid bookings
+    they held seats for, in one transaction. A user has only one booking, so the row would
+    otherwise stop them booking again. Settle the bookings' payment links first (see
+    booking.release_expired_bookings()). Returns the number of reservations released.
+    """
+    with transaction.atomic():
+        expired = list(
+            TicketReservation.objects.select_for_update(skip_locked=True)
+            .filter(reference_id__in=list(reference_ids), status=TicketReservation.HELD, expires_at__lte=timezone.now())
+            .values_list('pk', 'ticket_id', 'quantity', 'reference_id')
+        )
+
+        if not expired:
+            return 0
+
+        TicketReservation.objects.filter(
+            pk__in=[pk for pk, _, _, _ in expired]
+        ).update(status=TicketReservation.RELEASED)
+
+        EventBooking.objects.filter(
+            formis_payment_id__in=[reference_id for _, _, _, reference_id in expired], payment_completed=False
+        ).delete()
+
+        # One UPDATE per ticket rather than one per reservation.
+        seats_per_ticket = {}
+        for _, ticket_id, quantity, _ in expired:
+            seats_per_ticket[ticket_id] = seats_per_ticket.get(ticket_id, 0) + quantity
+
+        for ticket_id, quantity in seats_per_ticket.items():
+            _return_seats(ticket_id, quantity)
+
+    return len(expired)
@@ -0,0 +1,56 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+
+# Small in-process pool for work that should not run on the request thread.
+# Jobs are lost if the process exits before they run, so only submit work that
+# can be redone later (e.g. by a management command).
+#
+#   BACKGROUND_JOB_WORKERS    threads in the pool.
+
+WORKERS = getattr(settings, 'BACKGROUND_JOB_WORKERS', 2)
+
+_executor = None
+_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def _run(func, args, kwargs):
+
+    close_old_connections()
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception('Background job %s failed', func.__name__)
+    finally:
+        close_old_connections()
+
+
+def submit(func, *args, **kwargs):
+    """
+    Run func(*args, **kwargs) on the background pool.
+    """
+    global _executor
+
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='background-job')
+
+    return _executor.submit(_run, func, args, kwargs)
+
+
+def wait():
+    """
+    Block until every job submitted so far has run, e.g. before a command exits.
+    """
+    global _executor
+
+    with _lock:
+        executor, _executor = _executor, None
+
+    if executor is not None:
+        executor.shutdown(wait=True)
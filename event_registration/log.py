@@ -0,0 +1,221 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+from django.conf import settings
+
+# Logging for the event_registration.* loggers without I/O on the request path. A record is
+# put on an in-memory queue and a background thread formats it as one JSON object per line,
+# redacts mobile numbers and email addresses, and writes it out. If the writer falls behind
+# and the queue fills, new records are dropped and counted rather than blocking requests.
+#
+# Modules log through the standard library, with structured fields passed as `extra`:
+#
+#     logger = logging.getLogger(__name__)
+#     logger.warning('Payment link creation failed', extra={'reference_id': reference_id})
+#
+# configure() runs when the app loads, and again in each child a pre-fork server forks after
+# loading the app, since the listener thread does not survive the fork.
+#
+#   LOG_ENABLED              False leaves the event_registration loggers to the LOGGING setting.
+#   LOG_LEVEL                lowest level written in full.
+#   LOG_DEBUG_SAMPLE_RATE    share of DEBUG records written (0 to 1) when LOG_LEVEL is above
+#                            DEBUG; they are high-volume.
+#   LOG_QUEUE_SIZE           records waiting to be written before new ones are dropped.
+
+ENABLED = getattr(settings, 'LOG_ENABLED', True)
+LEVEL = getattr(settings, 'LOG_LEVEL', 'INFO')
+DEBUG_SAMPLE_RATE = getattr(settings, 'LOG_DEBUG_SAMPLE_RATE', 0.01)
+QUEUE_SIZE = getattr(settings, 'LOG_QUEUE_SIZE', 10000)
+
+LOGGER_NAME = 'event_registration'
+
+# Attributes every LogRecord has; anything else on a record came in through `extra`.
+RECORD_ATTRIBUTES = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+MOBILE_PATTERN = re.compile(r'(?<!\d)(?:\+?91[\s-]?)?([6-9]\d{5})(\d{4})(?!\d)')
+EMAIL_PATTERN = re.compile(r'\b([A-Za-z0-9._%+-])[A-Za-z0-9._%+-]*@([A-Za-z0-9.-]+\.[A-Za-z]{2,})\b')
+
+# Fields masked whole, whatever they look like.
+SENSITIVE_FIELDS = {'name', 'age', 'gender', 'mobile', 'contact', 'phone', 'email', 'otp', 'password', 'token', 'access',
+                    'refresh'}
+
+
+def redact_text(text):
+    """
+    `text` with mobile numbers cut to their last four digits and email addresses to their
+    first letter and domain.
+    """
+    text = MOBILE_PATTERN.sub(lambda match: '******' + match.group(2), text)
+    return EMAIL_PATTERN.sub(lambda match: f'{match.group(1)}***@{match.group(2)}', text)
+
+
+def redact(value, key=None):
+    """
+    A copy of a logged value, nested dicts and lists included, with personal data masked.
+    """
+    if key is not None and str(key).lower() in SENSITIVE_FIELDS and value not in (None, ''):
+        return '***'
+    if isinstance(value, str):
+        return redact_text(value)
+    if isinstance(value, dict):
+        return {name: redact(item, name) for name, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+
+    return value
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    One JSON object per record: time, level, logger, message, the record's extra fields
+    and any traceback, with personal data redacted.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact_text(record.getMessage()),
+        }
+
+        for name, value in record.__dict__.items():
+            if name not in RECORD_ATTRIBUTES:
+                entry[name] = redact(value, name)
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = redact_text(record.exc_text)
+
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps every record at `level` and above, and a random `rate` share of DEBUG ones below it.
+    """
+
+    def __init__(self, rate, level=logging.INFO):
+        super().__init__()
+        self.rate = rate
+        self.level = level if isinstance(level, int) else logging.getLevelName(level)
+
+    def filter(self, record):
+
+        return record.levelno >= self.level or (record.levelno == logging.DEBUG and random.random() < self.rate)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    A QueueHandler that drops records when the queue is full instead of reporting an error
+    for each, and leaves formatting to the listener's thread.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Merge the arguments now, while they still hold what they held at the call, and
+        # keep the traceback as text; the listener formats the rest. Unlike QueueHandler's,
+        # this changes the record in place: it is the only handler the record reaches.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+_handler = None
+_arguments = None
+_lock = threading.Lock()
+
+
+def configure(stream=None, enabled=ENABLED, level=LEVEL, debug_sample_rate=DEBUG_SAMPLE_RATE, queue_size=QUEUE_SIZE):
+    """
+    Route the event_registration loggers through the queue to `stream` (stderr by default).
+    Calling it again replaces the previous setup; enabled=False turns it off.
+    """
+    global _listener, _handler, _arguments
+
+    logger = logging.getLogger(LOGGER_NAME)
+
+    with _lock:
+        _arguments = {'stream': stream, 'enabled': enabled, 'level': level, 'debug_sample_rate': debug_sample_rate,
+                      'queue_size': queue_size}
+
+        if _listener is not None:
+            _listener.stop()
+            logger.removeHandler(_handler)
+            _listener = _handler = None
+
+        if not enabled:
+            logger.propagate = True
+            return
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JSONFormatter())
+
+        _handler = DroppingQueueHandler(queue.Queue(queue_size))
+        _handler.addFilter(SamplingFilter(debug_sample_rate, level))
+        _listener = logging.handlers.QueueListener(_handler.queue, output)
+
+        logger.addHandler(_handler)
+        # DEBUG records must reach the filter to be sampled.
+        logger.setLevel(logging.DEBUG if debug_sample_rate else level)
+        logger.propagate = False
+        _listener.start()
+
+
+def flush():
+    """
+    Wait until every record queued so far has been written.
+    """
+    if _listener is not None:
+        _handler.queue.join()
+
+
+def dropped():
+
+    return _handler.dropped if _handler is not None else 0
+
+
+@atexit.register
+def _stop():
+    # Write out what is still queued when the process exits.
+    if _listener is not None:
+        _listener.stop()
+
+
+def _restart_after_fork():
+    # Only the forking thread survives in the child: the listener is gone, and the queue's or
+    # this module's lock may have been held by a thread that no longer exists. Start afresh.
+    global _listener, _handler, _lock
+
+    _lock = threading.Lock()
+    if _listener is not None:
+        logging.getLogger(LOGGER_NAME).removeHandler(_handler)
+        _listener = _handler = None
+        configure(**_arguments)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
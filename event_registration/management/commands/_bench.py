@@ -0,0 +1,129 @@
+"""
+Helpers shared by the bench_* management commands. Django does not load modules
+starting with an underscore as commands.
+"""
+import asyncio
+import contextlib
+import os
+import tempfile
+import threading
+import time
+from django.db import connection, connections
+
+
+@contextlib.contextmanager
+def scratch_database():
+    """
+    Run the block against a freshly migrated throwaway copy of the default database,
+    so benchmarks never touch real bookings.
+    """
+    old_name = connection.settings_dict['NAME']
+    old_options = dict(connection.settings_dict.get('OPTIONS', {}))
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+
+    if connection.vendor == 'sqlite':
+        # Threads sharing an in-memory SQLite database fail with "table is locked"
+        # instead of waiting for the writer, so use a file. Deferred transactions that
+        # upgrade to a write lock fail at once too, so take the write lock up front.
+        if not test_settings.get('NAME'):
+            test_settings['NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+        connection.settings_dict['OPTIONS'] = {**old_options, 'transaction_mode': 'IMMEDIATE', 'timeout': 60}
+
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        connection.settings_dict['OPTIONS'] = old_options
+
+
+def run_concurrently(func, jobs, concurrency):
+    """
+    Call func(job) for every job from `concurrency` threads.
+    Returns (elapsed seconds, per-call latencies in seconds, error count).
+    """
+    jobs = list(jobs)
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+
+    def worker():
+        try:
+            while True:
+                with lock:
+                    if not jobs:
+                        return
+                    job = jobs.pop()
+
+                started = time.perf_counter()
+                try:
+                    func(job)
+                except Exception:
+                    with lock:
+                        errors[0] += 1
+                    continue
+
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return time.perf_counter() - started, latencies, errors[0]
+
+
+async def run_concurrently_async(func, jobs, concurrency):
+    """
+    Await func(job) for every job, at most `concurrency` at a time.
+    Returns the same (elapsed seconds, latencies, error count) as run_concurrently().
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def run(job):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await func(job)
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run(job) for job in jobs))
+
+    return time.perf_counter() - started, latencies, errors
+
+
+def percentile(values, pct):
+
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(elapsed, latencies, errors):
+    """
+    Throughput and latency percentiles (in milliseconds) for one benchmark run.
+    """
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
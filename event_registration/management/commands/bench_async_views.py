@@ -0,0 +1,122 @@
+import asyncio
+import datetime
+import json
+import threading
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from event_registration import gateways, jobs
+from event_registration.fakes import FakeProviderServer
+from event_registration.models import Event, Ticket
+from event_registration.utility import generate_tokens_for_user
+from ._bench import scratch_database, run_concurrently_async, summarize
+
+User = get_user_model()
+
+STACKS = {
+    'sync': '/event-registration/',
+    'async': '/event-registration/async/',
+}
+
+
+class ThreadCounter:
+    """
+    Samples the number of live threads while a run is in progress.
+    """
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self.running = True
+
+    async def sample(self):
+        while self.running:
+            self.peak = max(self.peak, threading.active_count())
+            await asyncio.sleep(0.01)
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive booking and the Razorpay callback through the ASGI handler on the sync views and on '
+        'their async/ versions, against a local stub of Razorpay with injected latency. '
+        'Runs against a throwaway copy of the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Bookings, then callbacks, per stack.')
+        parser.add_argument('--concurrency', type=int, default=100, help='Requests in flight at once.')
+        parser.add_argument('--latency', type=float, default=0.2, help='Stub gateway latency in seconds.')
+
+    def handle(self, *args, **options):
+        with scratch_database(), FakeProviderServer(latency=options['latency']) as server, \
+                override_settings(RAZORPAY_BASE_URL=server.url, ALLOWED_HOSTS=['*']):
+            gateways.reset()
+            results = asyncio.run(self.run_stacks(options))
+            jobs.wait()
+            gateways.reset()
+
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def seed(self, count):
+        event = Event.objects.create(
+            name='Benchmark', event_date=datetime.date.today(),
+            event_start_time=datetime.time(17), event_end_time=datetime.time(23), active=True
+        )
+        ticket = Ticket.objects.create(
+            event=event, name='General', price=500, total_tickets=count * 4, total_tickets_available=count * 4
+        )
+
+        # One user per booking: a user can only book once.
+        tokens = {}
+        for stack in STACKS:
+            users = [User.objects.create_user(mobile=f'9{len(tokens) * count + index:09d}') for index in range(count)]
+            tokens[stack] = [generate_tokens_for_user(user)['access'] for user in users]
+
+        payload = {
+            'name': 'Benchmark Attendee', 'age': '25-40', 'mobile': '9876543210', 'gender': 'Male',
+            'event': event.pk, 'ticket': ticket.pk, 'ticket_quantity': 1, 'attending_time': '5PM-7PM'
+        }
+
+        return payload, tokens
+
+    async def run_stacks(self, options):
+        count = options['requests']
+        payload, tokens = await sync_to_async(self.seed)(count)
+        client = AsyncClient()
+        results = {}
+
+        for stack, prefix in STACKS.items():
+            references = []
+
+            async def book(job):
+                # Each from its own address, as real clients would be, so the per-IP rate limit stays out of it.
+                index, token = job
+                response = await AsyncClient(client=[f'10.0.{index // 256}.{index % 256}', 0]).post(
+                    prefix + 'book-tickets', payload, content_type='application/json',
+                    headers={'Authorization': f'Bearer {token}'}
+                )
+                if response.status_code != 201:
+                    raise RuntimeError(response.status_code)
+                references.append(json.loads(response.content)['id'])
+
+            async def callback(reference_id):
+                response = await client.get(prefix + 'callback-for-razorpay', {
+                    'razorpay_payment_id': f'pay_{reference_id[:14]}',
+                    'razorpay_payment_link_reference_id': reference_id
+                })
+                if response.status_code != 302:
+                    raise RuntimeError(response.status_code)
+
+            for name, func, jobs in (('book_tickets', book, enumerate(tokens[stack])), ('callback', callback, references)):
+                threads = ThreadCounter()
+                sampler = asyncio.ensure_future(threads.sample())
+                result = summarize(*await run_concurrently_async(func, list(jobs), options['concurrency']))
+                threads.running = False
+                await sampler
+
+                result['peak_threads'] = threads.peak
+                results.setdefault(name, {})[stack] = result
+
+        await gateways.async_razorpay_client().close()
+
+        return results
@@ -0,0 +1,86 @@
+import datetime
+import json
+import time
+import uuid
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from event_registration.booking import create_pending_booking, request_payment_link, attach_payment_link
+from event_registration.models import Event, Ticket
+from ._bench import scratch_database, run_concurrently, summarize
+
+User = get_user_model()
+
+
+class StubPaymentLinks:
+    """
+    Stands in for razorpay.Client.payment_link, answering after a fixed delay.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def create(self, data):
+        time.sleep(self.latency)
+        return {'id': f'plink_{uuid.uuid4().hex[:14]}', 'short_url': f'https://rzp.io/i/{uuid.uuid4().hex[:8]}'}
+
+
+class StubRazorpayClient:
+
+    def __init__(self, latency):
+        self.payment_link = StubPaymentLinks(latency)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare booking throughput with the payment link created inside the booking transaction '
+        '(the old flow) against the two-phase flow, using a stubbed gateway with injected latency. '
+        'Runs against a throwaway copy of the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookings', type=int, default=200, help='Bookings per run.')
+        parser.add_argument('--concurrency', type=int, default=20, help='Concurrent booking threads.')
+        parser.add_argument('--latency', type=float, default=0.1, help='Gateway latency in seconds.')
+
+    def handle(self, *args, **options):
+        bookings = options['bookings']
+        client = StubRazorpayClient(options['latency'])
+
+        with scratch_database():
+            event = Event.objects.create(
+                name='Benchmark', event_date=datetime.date.today(),
+                event_start_time=datetime.time(17), event_end_time=datetime.time(23), active=True
+            )
+            ticket = Ticket.objects.create(
+                event=event, name='General', price=500, total_tickets=bookings * 2, total_tickets_available=bookings * 2
+            )
+
+            results = {}
+            for mode in ('inline', 'two_phase'):
+                users = [User.objects.create_user(mobile=f'9{mode == "inline":d}{index:08d}') for index in range(bookings)]
+
+                def book(user):
+                    profile = {'name': 'Benchmark', 'age': '25-40', 'mobile': user.mobile, 'gender': 'Rather Not To Say'}
+                    booking = {'event': event, 'ticket': ticket, 'ticket_quantity': 1, 'attending_time': '5PM-7PM'}
+
+                    def phases():
+                        event_booking, reservation = create_pending_booking(
+                            user, profile, booking, str(uuid.uuid4()), ticket.price
+                        )
+                        details = request_payment_link(
+                            client, event_booking, {'name': 'Benchmark', 'contact': user.mobile},
+                            'http://localhost/event-registration/callback-for-razorpay',
+                            int(reservation.expires_at.timestamp())
+                        )
+                        attach_payment_link(event_booking, details)
+
+                    if mode == 'inline':
+                        with transaction.atomic():
+                            phases()
+                    else:
+                        phases()
+
+                results[mode] = summarize(*run_concurrently(book, users, options['concurrency']))
+
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,60 @@
+import json
+import razorpay
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from twilio.rest import Client
+from settings.config import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER, RAZORPAY_KEY, RAZORPAY_SECRET
+from event_registration import gateways
+from event_registration.fakes import FakeProviderServer
+from ._bench import run_concurrently, summarize
+
+
+class Command(BaseCommand):
+    help = (
+        'Call a local stub of the Razorpay and Twilio APIs with a new client per call (the old way) '
+        'and with the shared pooled clients, and report the TCP connections each approach opened.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=200, help='Calls per provider and mode.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent calling threads.')
+        parser.add_argument('--latency', type=float, default=0.0, help='Stub server latency in seconds.')
+
+    def handle(self, *args, **options):
+        results = {}
+
+        with FakeProviderServer(latency=options['latency']) as server, \
+                override_settings(RAZORPAY_BASE_URL=server.url, TWILIO_BASE_URL=server.url):
+            gateways.reset()
+
+            def fresh_razorpay():
+                return razorpay.Client(auth=(RAZORPAY_KEY, RAZORPAY_SECRET), base_url=server.url)
+
+            def fresh_twilio():
+                return Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN,
+                              http_client=gateways.PooledTwilioHttpClient(base_url=server.url))
+
+            providers = {
+                'razorpay': lambda client: client.payment.fetch('pay_benchmark'),
+                'twilio': lambda client: client.messages.create(body='benchmark', from_=TWILIO_PHONE_NUMBER, to='+919999999999'),
+            }
+            factories = {
+                ('razorpay', 'per_call_client'): fresh_razorpay,
+                ('razorpay', 'pooled_client'): gateways.razorpay_client,
+                ('twilio', 'per_call_client'): fresh_twilio,
+                ('twilio', 'pooled_client'): gateways.twilio_client,
+            }
+
+            for (provider, mode), factory in factories.items():
+                connections_before = server.connections
+
+                def call(_):
+                    providers[provider](factory())
+
+                result = summarize(*run_concurrently(call, range(options['calls']), options['concurrency']))
+                result['tcp_connections'] = server.connections - connections_before
+                results.setdefault(provider, {})[mode] = result
+
+            gateways.reset()
+
+        self.stdout.write(json.dumps(results, indent=2))
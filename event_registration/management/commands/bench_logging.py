@@ -0,0 +1,107 @@
+import datetime
+import json
+import logging
+import os
+import tempfile
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+from event_registration import gateways, log
+from event_registration.fakes import FakeProviderServer
+from event_registration.models import Event, Ticket
+from event_registration.views import CreateProfileAndBookingView
+from ._bench import scratch_database, run_concurrently, summarize
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare booking throughput with logging off, with each record formatted and written on the '
+        'request thread, and through the queue in event_registration/log.py. Books through the '
+        'book-tickets view against a local stub of Razorpay and a throwaway copy of the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookings', type=int, default=500, help='Bookings per mode.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent booking threads.')
+        parser.add_argument('--sample-rate', type=float, default=1.0,
+                            help='Share of the view\'s DEBUG records kept; 1 logs every booking.')
+        parser.add_argument('--records', type=int, default=20000,
+                            help='Records logged back to back, to time the cost to the caller alone.')
+
+    def handle(self, *args, **options):
+        bookings = options['bookings']
+        factory = APIRequestFactory()
+        view = CreateProfileAndBookingView.as_view(throttle_classes=[])
+        logger = logging.getLogger(log.LOGGER_NAME)
+        output = os.path.join(tempfile.mkdtemp(), 'bench.log')
+
+        with scratch_database(), FakeProviderServer() as server, \
+                override_settings(RAZORPAY_BASE_URL=server.url, ALLOWED_HOSTS=['*']):
+            gateways.reset()
+            event = Event.objects.create(
+                name='Benchmark', event_date=datetime.date.today(),
+                event_start_time=datetime.time(17), event_end_time=datetime.time(23), active=True
+            )
+            ticket = Ticket.objects.create(
+                event=event, name='General', price=500, total_tickets=bookings * 3, total_tickets_available=bookings * 3
+            )
+
+            def book(user):
+                request = factory.post('/', {
+                    'name': 'Benchmark', 'age': '25-40', 'mobile': user.mobile, 'email': f'{user.mobile}@example.com',
+                    'gender': 'Rather Not To Say', 'event': event.pk, 'ticket': ticket.pk, 'ticket_quantity': 1,
+                    'attending_time': '5PM-7PM'
+                }, format='json')
+                force_authenticate(request, user=user)
+                response = view(request)
+                if response.status_code != 201:
+                    raise RuntimeError(response.status_code)
+
+            record_data = {'name': 'Benchmark', 'mobile': '9876543210', 'email': 'benchmark@example.com',
+                           'event': event.pk, 'ticket': ticket.pk, 'ticket_quantity': 1}
+            results = {}
+            for prefix, mode in zip('789', ('off', 'direct', 'queued')):
+                users = [User.objects.create_user(mobile=f'{prefix}{number:09d}') for number in range(bookings)]
+
+                with open(output, 'w') as stream:
+                    direct = None
+                    if mode == 'off':
+                        log.configure(enabled=False)
+                        logger.setLevel(logging.CRITICAL + 1)
+                    elif mode == 'direct':
+                        log.configure(enabled=False)
+                        direct = logging.StreamHandler(stream)
+                        direct.setFormatter(log.JSONFormatter())
+                        direct.addFilter(log.SamplingFilter(options['sample_rate']))
+                        logger.addHandler(direct)
+                        logger.setLevel(logging.DEBUG)
+                        logger.propagate = False
+                    else:
+                        log.configure(stream=stream, level=logging.INFO, debug_sample_rate=options['sample_rate'])
+
+                    results[mode] = summarize(*run_concurrently(book, users, options['concurrency']))
+
+                    # A booking's own log line is lost in its database time; this is what it costs the thread
+                    started = time.perf_counter()
+                    for number in range(options['records']):
+                        logger.info('Booking request', extra={'user_id': number, 'data': record_data})
+                    results[mode]['per_record_us'] = round((time.perf_counter() - started) / options['records'] * 1e6, 2)
+
+                    log.flush()
+                    results[mode]['dropped'] = log.dropped()
+                    if direct is not None:
+                        logger.removeHandler(direct)
+                    log.configure(enabled=False)
+
+                with open(output) as stream:
+                    results[mode]['lines_written'] = sum(1 for _ in stream)
+
+            gateways.reset()
+
+        # Back to the settings' logging for the rest of the process
+        log.configure()
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,110 @@
+import json
+import random
+import time
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from event_registration.models import OTP
+from event_registration.otp_store import DatabaseOTPStore, purge_otps
+from ._bench import scratch_database, percentile
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill a throwaway copy of the database with historical OTP rows and time the database OTP store\'s '
+        'verification without the index on active codes by user and age, with it, and after purge_otps.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Historical OTP rows, e.g. 10000000.')
+        parser.add_argument('--users', type=int, default=1000, help='Users the rows are spread over.')
+        parser.add_argument('--lookups', type=int, default=500, help='Verifications timed per phase.')
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            users = self.seed(options['rows'], options['users'])
+            index = next(index for index in OTP._meta.indexes if index.name == 'otp_active_user_created_idx')
+            results = {}
+
+            with connection.schema_editor() as schema_editor:
+                schema_editor.remove_index(OTP, index)
+            self.analyze()
+            results['without_index'] = self.time_lookups(users, options['lookups'])
+
+            started = time.perf_counter()
+            with connection.schema_editor() as schema_editor:
+                schema_editor.add_index(OTP, index)
+            self.analyze()
+            results['index_build_s'] = round(time.perf_counter() - started, 2)
+            results['with_index'] = self.time_lookups(users, options['lookups'])
+
+            started = time.perf_counter()
+            deleted = 0
+            for deleted in purge_otps(batch_size=5000):
+                pass
+            results['purge'] = {'deleted': deleted, 'elapsed_s': round(time.perf_counter() - started, 2)}
+            self.analyze()
+            results['after_purge'] = self.time_lookups(users, options['lookups'])
+
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def seed(self, rows, user_count):
+        """
+        `rows` OTPs over the past 90 days, all expired or used, plus one live code per user.
+        """
+        users = User.objects.bulk_create([User(mobile=f'8{index:09d}') for index in range(user_count)])
+        now = timezone.now()
+        batch = []
+
+        for index in range(rows):
+            created_at = now - timedelta(seconds=random.randrange(600, 90 * 86400))
+            batch.append(OTP(
+                user_id=users[index % user_count].pk, otp=random.randint(100000, 999999), created_at=created_at,
+                exprires_at=created_at + timedelta(minutes=10), active=random.random() < 0.3
+            ))
+            if len(batch) == 20000:
+                OTP.objects.bulk_create(batch)
+                batch = []
+
+        batch.extend(
+            OTP(user_id=user.pk, otp=123456, created_at=now, exprires_at=now + timedelta(minutes=10), active=True)
+            for user in users
+        )
+        OTP.objects.bulk_create(batch)
+
+        return users
+
+    def analyze(self):
+        # Let the planner see the table as it now is, as autovacuum would on PostgreSQL.
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(OTP._meta.db_table)}')
+
+    def time_lookups(self, users, lookups):
+        """
+        Latency of the store's read of a user's latest code alone, and of a whole (wrong) verification.
+        """
+        store = DatabaseOTPStore()
+        latencies = {'lookup': [], 'verify': []}
+
+        for _ in range(lookups):
+            user = random.choice(users)
+            started = time.perf_counter()
+            OTP.objects.filter(user=user, active=True).only('otp', 'exprires_at').order_by('-created_at').first()
+            latencies['lookup'].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            store.verify(user, 0)
+            latencies['verify'].append(time.perf_counter() - started)
+
+        return {
+            name: {
+                'p50_ms': round(percentile(samples, 50) * 1000, 3),
+                'p95_ms': round(percentile(samples, 95) * 1000, 3),
+                'p99_ms': round(percentile(samples, 99) * 1000, 3),
+            }
+            for name, samples in latencies.items()
+        }
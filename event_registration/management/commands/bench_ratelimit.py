@@ -0,0 +1,83 @@
+import json
+import time
+from django.core.cache import cache, caches
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from event_registration import ratelimit
+from event_registration.views import SendOTP
+from ._bench import scratch_database, run_concurrently, percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the rate limiter on its own, per check, against the configured cache, and the whole '
+        'send-otp request (with a fake SMS transport) with and without it. Runs against a throwaway '
+        'copy of the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checks', type=int, default=20000, help='Limiter checks per run.')
+        parser.add_argument('--requests', type=int, default=1000, help='send-otp requests per run.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Threads for the concurrent run.')
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        results = {'cache_backend': type(caches['default']).__name__}
+
+        # Spread over clients, as in production, so no run is all rejections.
+        requests = [
+            (factory.post('/', REMOTE_ADDR=self.address(index)), f'9{index:09d}') for index in range(options['checks'])
+        ]
+
+        def check(job):
+            request, mobile = job
+            ratelimit.check('send-otp', request, mobile=mobile)
+
+        for name, concurrency in (('check_sequential', 1), ('check_concurrent', options['concurrency'])):
+            cache.clear()
+            elapsed, latencies, errors = run_concurrently(check, requests, concurrency)
+            results[name] = self.summary(elapsed, latencies, errors)
+
+        views = {
+            'send_otp_without_limiter': SendOTP.as_view(throttle_classes=[]),
+            'send_otp_with_limiter': SendOTP.as_view(throttle_classes=[ratelimit.RateLimitThrottle]),
+        }
+        latencies = {name: [] for name in views}
+        cache.clear()
+
+        with scratch_database():
+            # Alternate between the two, so warm-up and database growth affect both alike. Each
+            # has its own numbers, so both create a user per request.
+            for index in range(options['requests']):
+                for prefix, (name, view) in zip('89', views.items()):
+                    request = factory.post(
+                        '/', {'mobile': f'{prefix}{index:09d}'}, content_type='application/json',
+                        REMOTE_ADDR=self.address(index)
+                    )
+                    started = time.perf_counter()
+                    response = view(request)
+                    latencies[name].append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        raise RuntimeError(response.status_code)
+
+        for name, samples in latencies.items():
+            results[name] = self.summary(sum(samples), samples, 0)
+
+        results['overhead_per_request_us'] = round(
+            results['send_otp_with_limiter']['p50_us'] - results['send_otp_without_limiter']['p50_us'], 1
+        )
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def address(self, index):
+
+        return f'10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}'
+
+    def summary(self, elapsed, latencies, errors):
+
+        return {
+            'calls': len(latencies) + errors,
+            'errors': errors,
+            'per_second': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            'p50_us': round(percentile(latencies, 50) * 1e6, 1),
+            'p99_us': round(percentile(latencies, 99) * 1e6, 1),
+        }
@@ -0,0 +1,72 @@
+import json
+import time
+import uuid
+import qrcode
+from django.core.management.base import BaseCommand
+from event_registration import ticket_payload
+from event_registration.ticket_qr import render_qr_png
+
+
+def legacy_ticket_data(index):
+    """
+    The dict the views used to put in the ticket QR, before the compact payload.
+    """
+    return {
+        'payment_completed': True,
+        'event_id': 3,
+        'user': f'98{index:08d}',
+        'ticket': 'Early Bird',
+        'ticket_quantity': 2,
+        'attending_time': '8:30PM-11:30PM',
+        'cab_facility_required': False,
+        'payment_completed': True,
+        'reference_id': str(uuid.uuid4())
+    }
+
+
+def legacy_booking_data(index):
+    """
+    The dict UserEventBookingsView used to put in its QR.
+    """
+    data = legacy_ticket_data(index)
+    data.update({'payment_link': 'https://rzp.io/i/a1B2c3D4e5', 'name': 'Benchmark Attendee'})
+    return data
+
+
+def compact_ticket_data(index):
+
+    return ticket_payload.encode(100000 + index, 3, 2, True)
+
+
+class Command(BaseCommand):
+    help = 'Compare QR version, payload size and encode time of the compact ticket payload against the old dict payloads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help='Tickets encoded per payload type.')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        results = {}
+
+        for name, build in (('legacy_ticket_dict', legacy_ticket_data),
+                            ('legacy_booking_dict', legacy_booking_data),
+                            ('compact_v1', compact_ticket_data)):
+            payloads = [build(index) for index in range(iterations)]
+
+            qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L)
+            qr.add_data(payloads[0])
+            qr.make(fit=True)
+
+            started = time.perf_counter()
+            for payload in payloads:
+                render_qr_png(payload)
+            elapsed = time.perf_counter() - started
+
+            results[name] = {
+                'payload_chars': len(str(payloads[0])),
+                'qr_version': qr.version,
+                'qr_modules': qr.modules_count,
+                'encode_ms': round(elapsed / iterations * 1000, 3),
+            }
+
+        self.stdout.write(json.dumps(results, indent=2))
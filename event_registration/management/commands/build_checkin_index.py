@@ -0,0 +1,37 @@
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from event_registration.checkin import CheckInIndex, INDEX_DIR, index_path
+from event_registration.models import Event
+
+
+class Command(BaseCommand):
+    help = (
+        'Load every paid booking of an event into a check-in index and export it as a compact file, '
+        'for scanner devices or for servers to load at startup from CHECKIN_INDEX_DIR.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('event', type=int, help='Event id.')
+        parser.add_argument('--output', help='File to write. Defaults to event-<id>.idx in CHECKIN_INDEX_DIR.')
+
+    def handle(self, *args, **options):
+        event_id = options['event']
+        if not Event.objects.filter(pk=event_id).exists():
+            raise CommandError(f'Event {event_id} does not exist.')
+
+        output = options['output']
+        if not output:
+            if not INDEX_DIR:
+                raise CommandError('Pass --output or set CHECKIN_INDEX_DIR.')
+            os.makedirs(INDEX_DIR, exist_ok=True)
+            output = index_path(event_id)
+
+        started = time.perf_counter()
+        index = CheckInIndex.from_database(event_id)
+        index.export(output)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {len(index.bookings)} paid bookings ({len(index.checked_in)} checked in) '
+            f'into {output} in {time.perf_counter() - started:.2f}s.'
+        ))
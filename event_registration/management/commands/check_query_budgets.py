@@ -0,0 +1,231 @@
+import asyncio
+import datetime
+import hashlib
+import hmac
+import json
+import uuid
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from event_registration import gateways, jobs, ticket_payload, waiting_room
+from event_registration.booking import create_pending_booking
+from event_registration.fakes import FakeProviderServer
+from event_registration.models import Event, Ticket, Profile, EventBooking
+from event_registration.otp_store import get_otp_store
+from event_registration.urls import urlpatterns
+from event_registration.utility import generate_tokens_for_user
+from ._bench import scratch_database
+
+User = get_user_model()
+
+PROFILE = {'name': 'Budget Attendee', 'age': '25-40', 'mobile': '9876543210', 'gender': 'Male'}
+
+
+class Command(BaseCommand):
+    help = (
+        'Call every endpoint in event_registration/urls.py once, with a cold cache, against a throwaway '
+        'copy of the database and a local stub of Razorpay, and count its queries. Fails if any endpoint '
+        'runs more than its view\'s query_budget, has no budget, or has no request here to check it with.'
+    )
+
+    def handle(self, *args, **options):
+        with scratch_database(), FakeProviderServer() as server, \
+                override_settings(RAZORPAY_BASE_URL=server.url, ALLOWED_HOSTS=['*'],
+                                  RAZORPAY_WEBHOOK_SECRET=getattr(settings, 'RAZORPAY_WEBHOOK_SECRET', None) or 'budget-check'):
+            gateways.reset()
+            results = asyncio.run(self.check_all())
+            jobs.wait()
+            gateways.reset()
+
+        failures = 0
+        for name, budget, count, problem in results:
+            failures += bool(problem)
+            line = f'{name:<32} {count if count is not None else "-":>3} / {budget if budget is not None else "-":<3} {problem or "ok"}'
+            self.stdout.write(self.style.ERROR(line) if problem else line)
+
+        if failures:
+            raise CommandError(f'{failures} endpoint(s) failed their query budget check.')
+
+    async def check_all(self):
+        await sync_to_async(self.seed)()
+        client = AsyncClient()
+        results = []
+
+        for pattern in urlpatterns:
+            budget = getattr(pattern.callback.view_class, 'query_budget', None)
+            prepare = getattr(self, f'request_{pattern.name.replace("-", "_")}', None)
+
+            if budget is None:
+                results.append((pattern.name, None, None, 'view has no query_budget'))
+                continue
+            if prepare is None:
+                results.append((pattern.name, budget, None, f'no request_{pattern.name.replace("-", "_")}() to call it with'))
+                continue
+
+            method, data, headers, expected_status = await sync_to_async(prepare)()
+            path = reverse(pattern.name)
+
+            # Cold: nothing cached, so the count is the most the endpoint ever runs.
+            await cache.aclear()
+            queries = await sync_to_async(self.start_capture)()
+            if method == 'get':
+                response = await client.get(path, data, headers=headers)
+            else:
+                response = await client.post(path, data, content_type='application/json', headers=headers)
+            count = await sync_to_async(self.stop_capture)(queries)
+
+            problem = None
+            if response.status_code != expected_status:
+                problem = f'answered {response.status_code}, expected {expected_status}'
+            elif count > budget:
+                problem = 'over budget'
+            results.append((pattern.name, budget, count, problem))
+
+        await gateways.async_razorpay_client().close()
+        return results
+
+    # Queries from the views, sync ones included, all run on asgiref's one thread for sync code,
+    # so the capture is started and read there too.
+
+    def start_capture(self):
+        queries = CaptureQueriesContext(connection)
+        queries.__enter__()
+        return queries
+
+    def stop_capture(self, queries):
+        queries.__exit__(None, None, None)
+        return len(queries)
+
+    def seed(self):
+        self.event = Event.objects.create(
+            name='Budget', event_date=datetime.date.today(),
+            event_start_time=datetime.time(17), event_end_time=datetime.time(23), active=True
+        )
+        self.ticket = Ticket.objects.create(
+            event=self.event, name='General', price=500, total_tickets=100, total_tickets_available=100
+        )
+
+        # A user with a profile and a paid booking, so the reads take their longest path.
+        self.user = User.objects.create_user(mobile='9000000000')
+        Profile.objects.create(user=self.user, **PROFILE)
+        self.booking = EventBooking.objects.create(
+            event=self.event, user=self.user, ticket=self.ticket, ticket_quantity=2, attending_time='5PM-7PM',
+            formis_payment_id=str(uuid.uuid4()), payment_amount=1000, payment_completed=True,
+            payment_completed_at=datetime.datetime.now(datetime.timezone.utc)
+        )
+        self.tokens = generate_tokens_for_user(self.user)
+
+        self.admin = User.objects.create_user(mobile='9000000009', is_staff=True)
+        self.users = 0
+
+    def bearer(self, user=None):
+        access = self.tokens['access'] if user is None else generate_tokens_for_user(user)['access']
+        return {'Authorization': f'Bearer {access}'}
+
+    def new_user(self):
+        self.users += 1
+        return User.objects.create_user(mobile=f'91{self.users:08d}')
+
+    def booking_data(self):
+
+        return {**PROFILE, 'event': self.event.pk, 'ticket': self.ticket.pk, 'ticket_quantity': 1,
+                'attending_time': '5PM-7PM'}
+
+    def pending_booking(self):
+        reference_id = str(uuid.uuid4())
+        create_pending_booking(self.new_user(), PROFILE, {
+            'event': self.event, 'ticket': self.ticket, 'ticket_quantity': 1, 'attending_time': '5PM-7PM'
+        }, reference_id, 500)
+        return {'razorpay_payment_id': f'pay_{uuid.uuid4().hex[:14]}', 'razorpay_payment_link_reference_id': reference_id}
+
+    # One request per endpoint, taking the path that runs the most queries:
+    # (method, data, headers, expected status)
+
+    def request_send_otp(self):
+
+        return 'post', {'mobile': '9000000001'}, {}, 200
+
+    def request_verify_otp(self):
+        get_otp_store().issue(self.user, 123456)
+        return 'post', {'mobile': self.user.mobile, 'otp': 123456}, {}, 200
+
+    def request_latest_event_details(self):
+
+        return 'get', {}, self.bearer(), 200
+
+    def request_book_tickets(self):
+
+        return 'post', self.booking_data(), self.bearer(self.new_user()), 201
+
+    def request_callback_for_razorpay(self):
+
+        return 'get', self.pending_booking(), {}, 302
+
+    def request_razorpay_webhook(self):
+        body = json.dumps({
+            'event': 'payment_link.paid',
+            'payload': {
+                'payment': {'entity': {'id': f'pay_{uuid.uuid4().hex[:14]}', 'created_at': 1700000000}},
+                'payment_link': {'entity': {'reference_id': str(uuid.uuid4())}},
+            },
+        }).encode()
+        signature = hmac.new(settings.RAZORPAY_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        return 'post', body, {'X-Razorpay-Signature': signature}, 200
+
+    def request_check_payment_status(self):
+
+        return 'get', {'reference_id': self.booking.formis_payment_id}, self.bearer(), 200
+
+    def request_payment_status_stream(self):
+
+        return 'get', {'reference_id': self.booking.formis_payment_id, 'token': self.tokens['access']}, {}, 200
+
+    def request_verify_token(self):
+
+        return 'post', {'token': self.tokens['access']}, {}, 200
+
+    def request_refresh_token(self):
+
+        return 'post', {'refresh': self.tokens['refresh']}, {}, 200
+
+    def request_logout(self):
+        tokens = generate_tokens_for_user(self.user)
+        return 'post', {'refresh_token': tokens['refresh']}, {'Authorization': f'Bearer {tokens["access"]}'}, 205
+
+    def request_user_event_booking(self):
+
+        return 'get', {}, self.bearer(), 200
+
+    def request_check_in(self):
+
+        return 'post', {'payload': ticket_payload.encode_booking(self.booking)}, self.bearer(self.admin), 200
+
+    def request_join_waiting_room(self):
+
+        return 'post', {}, self.bearer(), 200
+
+    def request_waiting_room_position(self):
+
+        return 'get', {}, {waiting_room.HEADER: waiting_room.join(self.user.id)[0]}, 200
+
+    def request_async_send_otp(self):
+
+        return 'post', {'mobile': '9000000002'}, {}, 200
+
+    def request_async_verify_otp(self):
+
+        return self.request_verify_otp()
+
+    def request_async_book_tickets(self):
+
+        return self.request_book_tickets()
+
+    def request_async_callback_for_razorpay(self):
+
+        return self.request_callback_for_razorpay()
@@ -0,0 +1,224 @@
+import datetime
+import json
+import platform
+import re
+import threading
+import time
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from event_registration import gateways, jobs, sms, waiting_room
+from event_registration.fakes import FakeProviderServer
+from event_registration.models import Event, Ticket
+from ._bench import scratch_database, run_concurrently, summarize
+
+# The steps of one attendee's flow, in order. sms_delivery is the wait between send-otp
+# answering and the code reaching the fake Twilio server; waiting_room is the time from joining
+# the waiting room to being admitted (at once unless WAITING_ROOM_ENABLED).
+STEPS = ('send_otp', 'sms_delivery', 'verify_otp', 'latest_event_details', 'waiting_room', 'book_tickets',
+         'callback', 'check_payment_status')
+
+OTP_PATTERN = re.compile(r'\b(\d{6})\b')
+
+
+class FlowFailed(Exception):
+    pass
+
+
+class Recorder:
+    """
+    Latencies and failures per step, from every flow thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {step: [] for step in STEPS}
+        self.failures = {step: {} for step in STEPS}
+
+    def ok(self, step, elapsed):
+        with self.lock:
+            self.latencies[step].append(elapsed)
+
+    def failed(self, step, reason):
+        with self.lock:
+            self.failures[step][reason] = self.failures[step].get(reason, 0) + 1
+        raise FlowFailed(f'{step}: {reason}')
+
+    def report(self, elapsed):
+        report = {}
+        for step in STEPS:
+            failures = self.failures[step]
+            report[step] = summarize(elapsed, self.latencies[step], sum(failures.values()))
+            report[step]['failures'] = failures
+
+        return report
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the whole attendee flow (send-otp, verify-otp, latest-event-details, the waiting room, '
+        'book-tickets, the Razorpay callback, check-payment-status) through the full middleware stack, from concurrent '
+        'clients, against local fake Razorpay and Twilio servers with injected latency and errors, on a '
+        'throwaway copy of the database. Prints JSON with throughput and p50/p95/p99 per step; '
+        '--baseline compares against an earlier run and fails on a regression.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Attendees, each going through the whole flow once.')
+        parser.add_argument('--concurrency', type=int, default=20, help='Attendees in flight at once.')
+        parser.add_argument('--razorpay-latency', type=float, default=0.05, help='Fake Razorpay latency in seconds.')
+        parser.add_argument('--razorpay-error-rate', type=float, default=0.0, help='Share of Razorpay calls answered 503.')
+        parser.add_argument('--twilio-latency', type=float, default=0.05, help='Fake Twilio latency in seconds.')
+        parser.add_argument('--twilio-error-rate', type=float, default=0.0, help='Share of Twilio calls answered 503.')
+        parser.add_argument('--seed', type=int, default=1, help='Seed for the fakes\' injected errors.')
+        parser.add_argument('--otp-timeout', type=float, default=15.0, help='Seconds to wait for an OTP text to arrive.')
+        parser.add_argument('--output', help='Also write the JSON results to this file.')
+        parser.add_argument('--baseline', help='JSON results of an earlier run to compare against.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed p95 increase and throughput drop against the baseline, as a share.')
+
+    def handle(self, *args, **options):
+        with scratch_database(), \
+                FakeProviderServer(latency=options['razorpay_latency'], error_rate=options['razorpay_error_rate'],
+                                   seed=options['seed']) as razorpay, \
+                FakeProviderServer(latency=options['twilio_latency'], error_rate=options['twilio_error_rate'],
+                                   seed=options['seed'] + 1) as twilio, \
+                override_settings(RAZORPAY_BASE_URL=razorpay.url, TWILIO_BASE_URL=twilio.url, ALLOWED_HOSTS=['*']):
+            gateways.reset()
+            cache.clear()
+            # Texts go to the fake Twilio, whatever SMS_TRANSPORT says, so the flow can read its OTP there.
+            previous_queue = sms.set_queue(sms.InProcessBackend(sms.TwilioTransport()))
+            try:
+                self.seed(options['users'])
+                recorder = Recorder()
+                elapsed, latencies, errors = run_concurrently(
+                    lambda index: self.flow(index, recorder, twilio, options['otp_timeout']),
+                    range(options['users']), options['concurrency']
+                )
+                jobs.wait()
+            finally:
+                sms.set_queue(previous_queue)
+                gateways.reset()
+
+        results = {
+            'started_at': self.started_at,
+            'config': {
+                **{name: options[name] for name in ('users', 'concurrency', 'razorpay_latency', 'razorpay_error_rate',
+                                                    'twilio_latency', 'twilio_error_rate', 'seed', 'otp_timeout')},
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'flows': summarize(elapsed, latencies, errors),
+            'steps': recorder.report(elapsed),
+            'providers': {
+                name: {'requests': server.requests, 'injected_errors': server.errors}
+                for name, server in (('razorpay', razorpay), ('twilio', twilio))
+            },
+        }
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                stream.write(output + '\n')
+        self.stdout.write(output)
+
+        if options['baseline']:
+            with open(options['baseline']) as stream:
+                regressions = self.compare(json.load(stream), results, options['tolerance'])
+            if regressions:
+                raise CommandError('Regressed against the baseline:\n  ' + '\n  '.join(regressions))
+
+    def seed(self, users):
+        self.started_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+        event = Event.objects.create(
+            name='Load test', event_date=datetime.date.today(),
+            event_start_time=datetime.time(17), event_end_time=datetime.time(23), active=True
+        )
+        Ticket.objects.create(event=event, name='General', price=500, total_tickets=users, total_tickets_available=users)
+
+    def flow(self, index, recorder, twilio, otp_timeout):
+        """
+        One attendee, from asking for a code to seeing their paid ticket.
+        """
+        # Each from its own address, as real clients would be, so the per-IP rate limits stay out of it.
+        client = Client(REMOTE_ADDR=f'10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}',
+                        raise_request_exception=False)
+        mobile = f'9{index:09d}'
+
+        def call(step, method, name, data, expected_status, headers=None):
+            started = time.perf_counter()
+            if method == 'get':
+                response = client.get(reverse(name), data, headers=headers)
+            else:
+                response = client.post(reverse(name), data, content_type='application/json', headers=headers)
+            elapsed = time.perf_counter() - started
+
+            if response.status_code != expected_status:
+                recorder.failed(step, str(response.status_code))
+            recorder.ok(step, elapsed)
+            return response
+
+        call('send_otp', 'post', 'send-otp', {'mobile': mobile}, 200)
+
+        started = time.perf_counter()
+        while not (texts := twilio.messages_to(f'+91{mobile}')):
+            if time.perf_counter() - started > otp_timeout:
+                recorder.failed('sms_delivery', 'timeout')
+            time.sleep(0.005)
+        recorder.ok('sms_delivery', time.perf_counter() - started)
+        otp = OTP_PATTERN.search(texts[-1]).group(1)
+
+        tokens = call('verify_otp', 'post', 'verify-otp', {'mobile': mobile, 'otp': otp}, 200).json()
+        headers = {'Authorization': f'Bearer {tokens["access"]}'}
+
+        details = call('latest_event_details', 'get', 'latest-event-details', {}, 200, headers).json()
+
+        started = time.perf_counter()
+        place = client.post(reverse('join-waiting-room'), headers=headers)
+        if place.status_code != 200:
+            recorder.failed('waiting_room', str(place.status_code))
+        place = place.json()
+        headers[waiting_room.HEADER] = place['token']
+        while not place['admitted']:
+            time.sleep(min(place['wait_seconds'], 1.0))
+            place = client.get(reverse('waiting-room-position'), headers={waiting_room.HEADER: headers[waiting_room.HEADER]}).json()
+        recorder.ok('waiting_room', time.perf_counter() - started)
+
+        booking = call('book_tickets', 'post', 'book-tickets', {
+            'name': 'Load Test Attendee', 'age': '25-40', 'mobile': mobile, 'gender': 'Rather Not To Say',
+            'event': details['event']['id'], 'ticket': details['tickets'][0]['id'], 'ticket_quantity': 1,
+            'attending_time': '5PM-7PM'
+        }, 201, headers).json()
+
+        # What Razorpay's redirect does once the attendee has paid
+        call('callback', 'get', 'callback-for-razorpay', {
+            'razorpay_payment_id': f'pay_{booking["id"].replace("-", "")[:14]}',
+            'razorpay_payment_link_reference_id': booking['id']
+        }, 302)
+
+        status = call('check_payment_status', 'get', 'check-payment-status', {'reference_id': booking['id']}, 200, headers)
+        if not status.json()['payment_completed']:
+            recorder.failed('check_payment_status', 'not paid')
+
+    def compare(self, baseline, results, tolerance):
+        """
+        Steps whose p95 or throughput got worse than the baseline's by more than `tolerance`.
+        """
+        regressions = []
+        for step, before in baseline.get('steps', {}).items():
+            after = results['steps'].get(step)
+            if after is None:
+                continue
+
+            if before['p95_ms'] and after['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                regressions.append(f'{step}: p95 {before["p95_ms"]} ms -> {after["p95_ms"]} ms')
+            if after['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+                regressions.append(f'{step}: throughput {before["throughput_rps"]} -> {after["throughput_rps"]} per second')
+            if after['errors'] > before['errors']:
+                regressions.append(f'{step}: errors {before["errors"]} -> {after["errors"]}')
+
+        return regressions
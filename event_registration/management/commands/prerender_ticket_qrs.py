@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from event_registration.models import EventBooking
+from event_registration.ticket_qr import prerender_ticket_qr
+
+
+class Command(BaseCommand):
+    help = 'Render and store the ticket QR of every paid booking that does not have one yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Re-render stored QR codes too, e.g. after the ticket payload format changed.')
+
+    def handle(self, *args, **options):
+        pending = EventBooking.objects.filter(payment_completed=True)
+        if not options['all']:
+            pending = pending.filter(Q(ticket_qr_image__isnull=True) | Q(ticket_qr_image=''))
+
+        rendered = 0
+        for event_booking_id in pending.values_list('pk', flat=True).iterator():
+            prerender_ticket_qr(event_booking_id)
+            rendered += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Rendered {rendered} ticket QR codes.'))
@@ -0,0 +1,47 @@
+import logging
+import time
+from django.core.management.base import BaseCommand
+from event_registration.webhooks import process_batch, BATCH_SIZE
+
+# Longest wait between retries while applying batches keeps failing, e.g. the database is down
+MAX_RETRY_SLEEP = 60
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Apply pending Razorpay webhook deliveries from the inbox table in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Deliveries applied per transaction.')
+        parser.add_argument('--idle-sleep', type=float, default=1.0, help='Seconds to wait when the inbox is empty.')
+        parser.add_argument('--once', action='store_true', help='Drain the inbox once and exit.')
+
+    def handle(self, *args, **options):
+        handled = 0
+        failures = 0
+
+        try:
+            while True:
+                try:
+                    count = process_batch(options['batch_size'])
+                    failures = 0
+                except Exception:
+                    # The batch rolled back and stays pending; try it again, backing off while it keeps failing.
+                    if options['once']:
+                        raise
+                    failures += 1
+                    retry_in = min(options['idle_sleep'] * 2 ** failures, MAX_RETRY_SLEEP)
+                    logger.exception('Applying webhook batch failed, retrying in %s s', retry_in)
+                    time.sleep(retry_in)
+                    continue
+
+                handled += count
+                if not count:
+                    if options['once']:
+                        break
+                    time.sleep(options['idle_sleep'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f'Handled {handled} webhook deliveries.'))
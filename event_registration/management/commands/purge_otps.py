@@ -0,0 +1,19 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from event_registration.otp_store import purge_otps
+
+
+class Command(BaseCommand):
+    help = 'Delete used and expired one-time passwords from the OTP table in small batches. Run it periodically, e.g. from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-minutes', type=int, default=0, help='Keep expired codes this much longer.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows examined per DELETE.')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches.')
+
+    def handle(self, *args, **options):
+        deleted = 0
+        for deleted in purge_otps(timedelta(minutes=options['keep_minutes']), options['batch_size'], options['pause']):
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} OTPs.'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from event_registration.reconcile import reconcile_payments, CHUNK_SIZE, CONCURRENCY
+
+
+class Command(BaseCommand):
+    help = (
+        'Ask Razorpay for the status of every unpaid booking\'s payment link and complete the paid ones. '
+        'Point RAZORPAY_BASE_URL at a local fake gateway to try it out.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Bookings read and written per round.')
+        parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='Payment link lookups in flight at once.')
+        parser.add_argument('--dry-run', action='store_true', help='Report paid bookings without completing them.')
+
+    def handle(self, *args, **options):
+        progress = None
+
+        for progress in reconcile_payments(options['chunk_size'], options['concurrency'], options['dry_run']):
+            self.stdout.write(
+                f"checked {progress['checked']}, paid {progress['paid']}, completed {progress['completed']}, "
+                f"errors {progress['errors']} - {progress['rate']:.0f} bookings/s"
+            )
+
+        if progress is None:
+            self.stdout.write(self.style.SUCCESS('No pending bookings.'))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {progress['checked']} pending bookings in {progress['elapsed']:.1f}s: "
+            f"{progress['paid']} paid, {progress['completed']} completed, {progress['oversold']} oversold, "
+            f"{progress['errors']} lookups failed."
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from event_registration.booking import release_expired_bookings
+from event_registration.gateways import razorpay_client
+
+
+class Command(BaseCommand):
+    help = (
+        'Give the seats of expired ticket reservations back to the inventory and delete their unpaid bookings, '
+        'after cancelling their payment links. Run it periodically, e.g. from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Reservations released per transaction.')
+
+    def handle(self, *args, **options):
+        released = release_expired_bookings(razorpay_client(), batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired reservations.'))
@@ -0,0 +1,45 @@
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import connections
+from event_registration.sms import DatabaseBackend, get_transport, WORKERS, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued text messages from the OutboundSMS table (SMS_QUEUE_BACKEND = "database").'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=WORKERS, help='Worker threads sending in parallel.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Messages claimed per batch.')
+        parser.add_argument('--idle-sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit.')
+
+    def handle(self, *args, **options):
+        backend = DatabaseBackend(get_transport(), batch_size=options['batch_size'])
+        sent = [0]
+        lock = threading.Lock()
+
+        def work():
+            try:
+                while True:
+                    count = backend.process_batch()
+                    with lock:
+                        sent[0] += count
+                    if not count:
+                        if options['once']:
+                            return
+                        time.sleep(options['idle_sleep'])
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {sent[0]} messages.'))
@@ -0,0 +1,288 @@
+import bisect
+import contextvars
+import hmac
+import threading
+import time
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, Http404
+from django.utils.decorators import sync_and_async_middleware
+
+# In-process metrics in the Prometheus text format, served by metrics_view at /metrics.
+#
+# Each thread updates its own shard of every metric, so recording takes no lock; a scrape
+# copies and sums the shards. Async views record on the event loop's thread, between awaits,
+# so they never interleave. A thread's first record, and every scrape, fold the shards of
+# finished threads into one base shard, so servers that start a thread per request (ASGI
+# runs sync views on a new thread each time) keep as many shards as they have live threads,
+# and counts never go down.
+# Every process (worker) keeps its own metrics; scrape each, or sum them in Prometheus.
+#
+# Add 'event_registration.metrics.metrics_middleware' at the top of MIDDLEWARE to record
+# requests and their database queries. Provider calls and QR renders are recorded wherever
+# they happen, including management commands.
+#
+#   METRICS_TOKEN    bearer token Prometheus must send to scrape /metrics; unset, the
+#                    endpoint answers 404.
+
+TOKEN = getattr(settings, 'METRICS_TOKEN', None)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+REGISTRY = []
+
+
+def _escape(value):
+
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metric:
+    """
+    A named family of series, one per combination of label values, sharded by thread.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.local = threading.local()
+        self.shards = []
+        self.base = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def shard(self):
+        try:
+            return self.local.values
+        except AttributeError:
+            values = self.local.values = {}
+            with self.lock:
+                self.fold_finished()
+                self.shards.append((threading.current_thread(), values))
+            return values
+
+    def fold_finished(self):
+        """
+        Merge the shards of threads that have finished, and so write no more, into the base.
+        Called with the lock held.
+        """
+        live = []
+        for thread, values in self.shards:
+            if thread.is_alive():
+                live.append((thread, values))
+                continue
+            for labels, value in values.items():
+                self.base[labels] = self.merge(self.base.get(labels), value)
+
+        self.shards = live
+
+    def collect(self):
+        """
+        {label values: merged value} over every thread's shard.
+        """
+        with self.lock:
+            self.fold_finished()
+            merged = {labels: self.merge(None, value) for labels, value in self.base.items()}
+            shards = [values for _, values in self.shards]
+
+        for shard in shards:
+            # dict.copy() is atomic under the GIL, so the owning thread may keep writing.
+            for labels, value in shard.copy().items():
+                merged[labels] = self.merge(merged.get(labels), value)
+
+        return merged
+
+    def labels_text(self, labels, extra=()):
+        pairs = list(zip(self.labelnames, labels)) + list(extra)
+        if not pairs:
+            return ''
+
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for labels, value in sorted(self.collect().items()):
+            lines.extend(self.samples(labels, value))
+
+        return lines
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        shard = self.shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def merge(self, total, value):
+
+        return value if total is None else total + value
+
+    def samples(self, labels, value):
+
+        return [f'{self.name}{self.labels_text(labels)} {value}']
+
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self.shard()
+        series = shard.get(labels)
+        if series is None:
+            # Per-bucket counts (the last for +Inf), then the sum
+            series = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def merge(self, total, value):
+        if total is None:
+            return list(value)
+
+        return [a + b for a, b in zip(total, value)]
+
+    def samples(self, labels, value):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), value):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{self.labels_text(labels, [("le", bound)])} {cumulative}')
+
+        lines.append(f'{self.name}_sum{self.labels_text(labels)} {value[-1]}')
+        lines.append(f'{self.name}_count{self.labels_text(labels)} {cumulative}')
+        return lines
+
+
+http_requests = Counter('http_requests_total', 'Requests answered, by route, method and status.',
+                        ['route', 'method', 'status'])
+http_request_duration = Histogram('http_request_duration_seconds', 'Time to produce a response, by route.',
+                                  ['route', 'method'])
+db_queries = Counter('db_queries_total', 'Database queries run while handling requests, by route.', ['route'])
+db_query_seconds = Counter('db_query_seconds_total', 'Time spent in database queries while handling requests, by route.',
+                           ['route'])
+db_query_duration = Histogram('db_query_duration_seconds', 'Duration of each database query.', buckets=QUERY_BUCKETS)
+provider_request_duration = Histogram('provider_request_duration_seconds', 'Calls to Razorpay and Twilio, by outcome.',
+                                      ['provider', 'method', 'outcome'])
+provider_circuit_open = Counter('provider_circuit_open_total', 'Calls refused because the provider\'s circuit was open.',
+                                ['provider'])
+qr_render_duration = Histogram('qr_render_duration_seconds', 'Ticket QR code renders.')
+
+
+def outcome(status):
+    """
+    The outcome label of a provider call: its status class, or 'error' if it got no response.
+    """
+    return f'{status // 100}xx' if status else 'error'
+
+
+# Database time is attributed to the request whose context the query runs in. asgiref copies
+# the context into sync_to_async threads, so async views' queries are attributed too.
+
+_request_queries = contextvars.ContextVar('request_queries', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        db_query_duration.observe(elapsed)
+
+        totals = _request_queries.get()
+        if totals is not None:
+            totals[0] += 1
+            totals[1] += elapsed
+
+
+def instrument_connection(sender, connection, **kwargs):
+    # Sent again on every reconnect of the same wrapper. Goes first, so a connection.execute_wrapper()
+    # block that was open when the connection was made pops its own wrapper, not this one.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+connection_created.connect(instrument_connection, dispatch_uid='event_registration.metrics')
+
+
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+
+    return match.route if match is not None else 'unmatched'
+
+
+def _record_request(request, response, started, totals):
+    route = _route(request)
+
+    http_request_duration.observe(time.perf_counter() - started, route, request.method)
+    http_requests.inc(route, request.method, response.status_code)
+    if totals[0]:
+        db_queries.inc(route, amount=totals[0])
+        db_query_seconds.inc(route, amount=totals[1])
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """
+    Records each request's latency, status and database queries by URL route. For streamed
+    responses the latency is the time to the first byte.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.perf_counter()
+            totals = [0, 0.0]
+            token = _request_queries.set(totals)
+            try:
+                response = await get_response(request)
+            finally:
+                _request_queries.reset(token)
+
+            _record_request(request, response, started, totals)
+            return response
+    else:
+        def middleware(request):
+            started = time.perf_counter()
+            totals = [0, 0.0]
+            token = _request_queries.set(totals)
+            try:
+                response = get_response(request)
+            finally:
+                _request_queries.reset(token)
+
+            _record_request(request, response, started, totals)
+            return response
+
+    return middleware
+
+
+def render():
+    """
+    Every metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. Needs METRICS_TOKEN as a bearer token.
+    """
+    if not TOKEN or not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {TOKEN}'):
+        raise Http404
+
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_registration', '0005_alter_eventbooking_event_alter_eventbooking_ticket'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='eventbooking',
+            name='attending_time',
+            field=models.CharField(choices=[('5PM-7PM', '5PM-7PM'), ('8:30PM-11:30PM', '8:30PM-11:30PM')], max_length=30),
+        ),
+        migrations.AlterField(
+            model_name='eventbooking',
+            name='formis_payment_id',
+            field=models.CharField(max_length=50, null=True),
+        ),
+        migrations.CreateModel(
+            name='TicketReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference_id', models.CharField(max_length=50, unique=True)),
+                ('quantity', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('held', 'Held'), ('confirmed', 'Confirmed'), ('released', 'Released')], default='held', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='event_registration.ticket')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'expires_at'], name='event_regis_status_33f8df_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def shard_existing_tickets(apps, schema_editor):
+    Ticket = apps.get_model('event_registration', 'Ticket')
+    TicketInventoryShard = apps.get_model('event_registration', 'TicketInventoryShard')
+
+    # The count inventory.py picks shards from
+    shard_count = getattr(settings, 'TICKET_INVENTORY_SHARDS', 8)
+    shards = []
+    for ticket in Ticket.objects.all():
+        base, remainder = divmod(ticket.total_tickets_available, shard_count)
+        for index in range(shard_count):
+            shards.append(TicketInventoryShard(ticket=ticket, shard=index, available=base + (1 if index < remainder else 0)))
+
+    TicketInventoryShard.objects.bulk_create(shards)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_registration', '0006_ticketreservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketInventoryShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('available', models.PositiveIntegerField()),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_shards', to='event_registration.ticket')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('ticket', 'shard'), name='unique_ticket_inventory_shard')],
+            },
+        ),
+        migrations.RunPython(shard_existing_tickets, migrations.RunPython.noop),
+    ]
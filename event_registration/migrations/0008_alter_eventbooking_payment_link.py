@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_registration', '0007_ticketinventoryshard'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='eventbooking',
+            name='payment_link',
+            field=models.URLField(blank=True, null=True),
+        ),
+    ]
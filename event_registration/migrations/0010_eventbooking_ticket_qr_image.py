@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_registration', '0009_outboundsms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventbooking',
+            name='ticket_qr_image',
+            field=models.FileField(blank=True, null=True, upload_to='tickets/'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_registration', '0013_otp_attempts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='otp',
+            index=models.Index(condition=models.Q(('active', True)), fields=['user', '-created_at'], name='otp_active_user_created_idx'),
+        ),
+    ]
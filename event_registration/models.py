@@ -66,6 +66,15 @@ class OTP(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, null=False)
     exprires_at = models.DateTimeField(null=False)
     active = models.BooleanField(default=False)
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # The latest active code of a user, read on every verification. Partial rather than
+            # (user, active, created_at): Django filters on a bare "active", which SQLite cannot
+            # match against an indexed column but can against the index's condition.
+            models.Index(fields=['user', '-created_at'], condition=models.Q(active=True), name='otp_active_user_created_idx'),
+        ]
 
     def __str__(self):
 
@@ -96,6 +105,60 @@ class Ticket(models.Model):
         return f'{self.name} - {self.event.name}'
 
 
+class TicketInventoryShard(models.Model):
+    """
+    One slice of a Ticket's live seat counter. Reservations decrement a random
+    shard, so concurrent buyers of the same tier rarely contend on one row.
+    The seats left for a ticket are the sum of its shards.
+    """
+
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, null=False, related_name='inventory_shards')
+    shard = models.PositiveSmallIntegerField(null=False)
+    available = models.PositiveIntegerField(null=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ticket', 'shard'], name='unique_ticket_inventory_shard'),
+        ]
+
+    def __str__(self):
+
+        return f'{self.ticket_id} - {self.shard} - {self.available}'
+
+
+class TicketReservation(models.Model):
+    """
+    Seats taken out of a Ticket's inventory while a booking's payment link is pending.
+    Held reservations expire after a TTL and give their seats back to the inventory.
+    """
+
+    HELD = 'held'
+    CONFIRMED = 'confirmed'
+    RELEASED = 'released'
+
+    STATUS_OPTIONS = (
+        (HELD, 'Held'),
+        (CONFIRMED, 'Confirmed'),
+        (RELEASED, 'Released')
+    )
+
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, null=False)
+    reference_id = models.CharField(max_length=50, unique=True, null=False)
+    quantity = models.PositiveIntegerField(null=False)
+    status = models.CharField(choices=STATUS_OPTIONS, default=HELD, max_length=10)
+    created_at = models.DateTimeField(auto_now_add=True, null=False)
+    expires_at = models.DateTimeField(null=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+        ]
+
+    def __str__(self):
+
+        return f'{self.reference_id} - {self.quantity} - {self.status}'
+
+
 class Profile(models.Model):
 
     AGE_OPTIONS = (
@@ -141,13 +204,81 @@ class EventBooking(models.Model):
     formis_payment_id = models.CharField(max_length=50, null=True)
     vendor_payment_id = models.CharField(max_length=50, null=True)
     payment_amount = models.FloatField()
-    payment_link = models.URLField()
+    payment_link = models.URLField(null=True, blank=True)
     payment_completed = models.BooleanField(default=False)
     payment_completed_at = models.DateTimeField(null=True)
+    ticket_qr_image = models.FileField(upload_to='tickets/', null=True, blank=True)
+    checked_in_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
 
         return f'{self.event.name} - {self.user.mobile} - {self.ticket_quantity}'
 
 
+class OutboundSMS(models.Model):
+    """
+    A text message waiting for, or done with, delivery by the SMS queue's database backend.
+    """
+
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    STATUS_OPTIONS = (
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed')
+    )
+
+    to = models.CharField(max_length=20, null=False)
+    body = models.CharField(max_length=320, null=False)
+    status = models.CharField(choices=STATUS_OPTIONS, default=PENDING, max_length=10)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.CharField(max_length=200, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, null=False)
+    next_attempt_at = models.DateTimeField(null=False)
+    sent_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+
+        return f'{self.to} - {self.status}'
+
+
+class RazorpayWebhookEvent(models.Model):
+    """
+    A verified Razorpay webhook delivery, stored as received and applied later by
+    `manage.py process_razorpay_webhooks`.
+    """
+
+    PENDING = 'pending'
+    PROCESSED = 'processed'
+    IGNORED = 'ignored'
+
+    STATUS_OPTIONS = (
+        (PENDING, 'Pending'),
+        (PROCESSED, 'Processed'),
+        (IGNORED, 'Ignored')
+    )
+
+    event_id = models.CharField(max_length=100, unique=True, null=False)
+    event = models.CharField(max_length=100, null=False)
+    payment_id = models.CharField(max_length=100, null=True, blank=True, db_index=True)
+    reference_id = models.CharField(max_length=100, null=True, blank=True)
+    payload = models.JSONField()
+    status = models.CharField(choices=STATUS_OPTIONS, default=PENDING, max_length=10)
+    received_at = models.DateTimeField(auto_now_add=True, null=False)
+    processed_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'received_at']),
+        ]
+
+    def __str__(self):
 
+        return f'{self.event} - {self.event_id} - {self.status}'
@@ -0,0 +1,209 @@
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache, caches
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework import status
+from .models import OTP
+from .caching import cache_is_shared
+
+# Where issued one-time passwords live until they are used.
+#
+#   OTP_STORE           'database' (default) keeps them in the OTP table; 'cache' keeps them in the
+#                       Django cache, so verifying is a couple of key operations and nothing accumulates.
+#                       That needs a cache every worker shares, or a code sent by one worker cannot be
+#                       verified by another; `manage.py check` fails otherwise. Or a dotted path to a store class.
+#   OTP_STORE_FALLBACK  with the cache store, also accept codes still active in the OTP table.
+#                       Turn it on when switching from 'database' and off again once OTP_TTL has passed.
+#   OTP_TTL             how long a code is valid.
+#   OTP_MAX_ATTEMPTS    wrong guesses allowed per code before a new one must be requested.
+
+STORE = getattr(settings, 'OTP_STORE', 'database')
+STORE_FALLBACK = getattr(settings, 'OTP_STORE_FALLBACK', False)
+TTL = getattr(settings, 'OTP_TTL', timedelta(minutes=10))
+MAX_ATTEMPTS = getattr(settings, 'OTP_MAX_ATTEMPTS', 5)
+
+VERIFIED = 'verified'
+INVALID = 'invalid'
+EXPIRED = 'expired'
+NOT_FOUND = 'not_found'
+TOO_MANY_ATTEMPTS = 'too_many_attempts'
+
+
+class DatabaseOTPStore:
+    """
+    Codes kept as rows of the OTP table.
+    """
+
+    def issue(self, user, otp):
+        now = timezone.now()
+        OTP.objects.create(user=user, otp=otp, created_at=now, exprires_at=now + TTL, active=True)
+
+    def verify(self, user, otp):
+        otp_record = OTP.objects.filter(user=user, active=True).only('otp', 'exprires_at').order_by('-created_at').first()
+        if otp_record is None:
+            return NOT_FOUND
+
+        # Count the guess before looking at it, so parallel guesses cannot exceed the limit.
+        if not OTP.objects.filter(pk=otp_record.pk, attempts__lt=MAX_ATTEMPTS).update(attempts=F('attempts') + 1):
+            return TOO_MANY_ATTEMPTS
+
+        if otp_record.otp != otp:
+            return INVALID
+
+        if otp_record.exprires_at < timezone.now():
+            return EXPIRED
+
+        # Only one of two parallel correct guesses gets to consume the code.
+        if not OTP.objects.filter(pk=otp_record.pk, active=True).update(active=False):
+            return NOT_FOUND
+
+        return VERIFIED
+
+
+class CacheOTPStore:
+    """
+    Codes kept in the Django cache under the user's id, one live code per user. A code is stored
+    a little past its expiry so a late attempt can be told apart from a missing one. Relies on the
+    cache backend's incr and delete being atomic, as they are on Redis and Memcached.
+    """
+
+    # Seconds a code is kept after it expires.
+    EXPIRED_GRACE = 300
+
+    def __init__(self, fallback=None):
+        self.fallback = fallback
+
+    def _keys(self, user):
+
+        return f'otp:{user.pk}', f'otp-attempts:{user.pk}'
+
+    def issue(self, user, otp):
+        code_key, attempts_key = self._keys(user)
+        timeout = TTL.total_seconds() + self.EXPIRED_GRACE
+
+        cache.set_many({code_key: (otp, (timezone.now() + TTL).timestamp()), attempts_key: 0}, timeout)
+
+    def verify(self, user, otp):
+        code_key, attempts_key = self._keys(user)
+
+        try:
+            attempts = cache.incr(attempts_key)
+        except ValueError:
+            # No code issued, or it is long gone.
+            return self.fallback.verify(user, otp) if self.fallback else NOT_FOUND
+
+        if attempts > MAX_ATTEMPTS:
+            cache.delete(code_key)
+            return TOO_MANY_ATTEMPTS
+
+        stored = cache.get(code_key)
+        if stored is None:
+            return NOT_FOUND
+
+        code, expires_at = stored
+        if code != otp:
+            return INVALID
+
+        if expires_at < timezone.now().timestamp():
+            return EXPIRED
+
+        # Only one of two parallel correct guesses gets to consume the code.
+        if not cache.delete(code_key):
+            return NOT_FOUND
+
+        cache.delete(attempts_key)
+        return VERIFIED
+
+
+def purge_otps(keep=timedelta(0), batch_size=1000, pause=0.0):
+    """
+    Delete OTP rows that can no longer be used: consumed ones, and ones expired for longer
+    than `keep`. Works through the table in primary key order, `batch_size` rows per
+    statement, sleeping `pause` seconds in between so no lock is held for long.
+    Yields the running total after each batch.
+    """
+    cutoff = timezone.now() - keep
+    purgeable = Q(active=False) | Q(exprires_at__lt=cutoff)
+    last_pk = 0
+    total = 0
+
+    while True:
+        pks = list(
+            OTP.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not pks:
+            return
+
+        last_pk = pks[-1]
+        deleted, _ = OTP.objects.filter(purgeable, pk__gte=pks[0], pk__lte=last_pk).delete()
+        total += deleted
+        yield total
+
+        if pause:
+            time.sleep(pause)
+
+
+STORES = {
+    'database': DatabaseOTPStore,
+    'cache': CacheOTPStore,
+}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _store_class():
+
+    return STORES.get(STORE) or import_string(STORE)
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    A code and its attempt count are only one code and one count if every worker reads the same cache.
+    """
+    if not issubclass(_store_class(), CacheOTPStore) or cache_is_shared():
+        return []
+
+    return [checks.Error(
+        "OTP_STORE = 'cache' needs a cache shared by every worker process.",
+        hint=f'The default cache is a {type(caches["default"]).__name__}; configure Redis, Memcached or the database cache in CACHES.',
+        id='event_registration.E002',
+    )]
+
+
+def get_otp_store():
+    """
+    The process-wide OTP store configured by OTP_STORE.
+    """
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store_class = _store_class()
+                if store_class is CacheOTPStore and STORE_FALLBACK:
+                    _store = CacheOTPStore(fallback=DatabaseOTPStore())
+                else:
+                    _store = store_class()
+
+    return _store
+
+
+def error_response(result, response_class):
+    """
+    The error response for an OTP that failed verification.
+    """
+    if result == TOO_MANY_ATTEMPTS:
+        return response_class({"error": "Too many attempts. Please request a new OTP."}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    if result == EXPIRED:
+        return response_class({"error": "OTP has expired."}, status=status.HTTP_400_BAD_REQUEST)
+    if result == INVALID:
+        return response_class({"error": "Invalid OTP."}, status=status.HTTP_400_BAD_REQUEST)
+
+    return response_class({"error": "No active OTP found for this user."}, status=status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Publish/subscribe hub for pushing state changes to waiting clients (see
+# PaymentStatusStreamView). Publishers may run in any thread; subscribers are asyncio tasks.
+#
+#   PUBSUB_BACKEND    dotted path of the backend class. The default InProcessBackend only
+#                     reaches subscribers in the same process; a backend relaying through
+#                     a shared broker fans messages out across workers with the same interface.
+
+
+class InProcessBackend:
+    """
+    Delivers messages to subscribers in this process.
+    """
+
+    def __init__(self):
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, channel):
+        """
+        Start receiving `channel`'s messages. Returns an asyncio.Queue bound to the running loop.
+        """
+        subscription = (asyncio.get_running_loop(), asyncio.Queue())
+
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(subscription)
+
+        return subscription[1]
+
+    def unsubscribe(self, channel, queue):
+
+        with self.lock:
+            subscriptions = self.subscribers.get(channel, set())
+            subscriptions.difference_update({s for s in subscriptions if s[1] is queue})
+            if not subscriptions:
+                self.subscribers.pop(channel, None)
+
+    def publish(self, channel, message):
+        """
+        Send `message` to every subscriber of `channel`. Safe to call from any thread.
+        """
+        with self.lock:
+            subscriptions = list(self.subscribers.get(channel, ()))
+
+        for loop, queue in subscriptions:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+            except RuntimeError:
+                # The subscriber's loop has closed.
+                self.unsubscribe(channel, queue)
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    """
+    The process-wide pub/sub backend configured by PUBSUB_BACKEND.
+    """
+    global _hub
+
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                _hub = import_string(getattr(settings, 'PUBSUB_BACKEND', 'event_registration.pubsub.InProcessBackend'))()
+
+    return _hub
+
+
+def payment_channel(formis_payment_id):
+
+    return f'payment:{formis_payment_id}'
+
+
+def publish(channel, message):
+
+    get_hub().publish(channel, message)
@@ -0,0 +1,120 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+# Request rate limits for the endpoints that send SMS, check codes or hold seats, counted in
+# the Django cache so every worker shares them (use Redis or Memcached in production; the
+# local memory cache counts per process).
+#
+# Each limit is a sliding window: the count for the current fixed window plus the previous
+# window's count weighted by how much of it still overlaps. A check is an incr of one key
+# and a get of another, whatever the limit or traffic. Rejected requests count too, so a
+# client that keeps hammering stays limited.
+#
+#   RATE_LIMITS    {'<scope>:<ip|mobile|user>': (requests, seconds) or None} merged over
+#                  DEFAULT_RATES; None turns that limit off. A view's scope is its throttle_scope.
+#                  Behind a proxy, set REST_FRAMEWORK['NUM_PROXIES'] so clients are told apart by IP.
+
+DEFAULT_RATES = {
+    'send-otp:mobile': (3, 600),
+    'send-otp:ip': (20, 600),
+    'verify-otp:mobile': (10, 600),
+    'verify-otp:ip': (50, 600),
+    'book-tickets:user': (10, 600),
+    'book-tickets:ip': (50, 600),
+    'waiting-room:ip': (30, 600),
+}
+
+RATES = {**DEFAULT_RATES, **getattr(settings, 'RATE_LIMITS', {})}
+
+
+def hit(name, ident, now=None):
+    """
+    Count one request by `ident` against the named limit. Returns 0 if it is within the
+    limit, else the seconds until it would be.
+    """
+    limit, period = RATES[name]
+    now = time.time() if now is None else now
+    window, elapsed = divmod(now, period)
+    key = f'ratelimit:{name}:{ident}:{int(window)}'
+
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # First request of the window. Kept for two windows: it is the previous one next.
+        if cache.add(key, 1, period * 2):
+            count = 1
+        else:
+            count = cache.incr(key)
+
+    previous = cache.get(f'ratelimit:{name}:{ident}:{int(window) - 1}', 0)
+    overlap = 1 - elapsed / period
+
+    if count + previous * overlap <= limit:
+        return 0
+
+    # The wait is until a retry, itself counted, would be within the limit.
+    if count >= limit:
+        # Past this window's end, until enough of it has slid out in turn.
+        return period - elapsed + period * (1 - (limit - 1) / count)
+
+    # Until enough of the previous window has slid out.
+    return max(period * (1 - (limit - count - 1) / previous) - elapsed, 1)
+
+
+def normalize_mobile(mobile):
+    """
+    The 10 digit number the serializers would accept `mobile` as, or None.
+    """
+    digits = ''.join(character for character in str(mobile or '') if character.isdigit())
+
+    return digits[-10:] if 10 <= len(digits) <= 12 else None
+
+
+def client_ip(request):
+    """
+    The client's address, honouring REST_FRAMEWORK['NUM_PROXIES'] like DRF's own throttles.
+    """
+    return BaseThrottle().get_ident(request)
+
+
+def check(scope, request, mobile=None, user=None):
+    """
+    Count one request to `scope` against each of its limits that applies. Returns 0 if it
+    may proceed, else the seconds until it may.
+    """
+    idents = {
+        'ip': client_ip(request),
+        'mobile': normalize_mobile(mobile),
+        'user': user.pk if user is not None and user.is_authenticated else None,
+    }
+
+    wait = 0
+    for kind, ident in idents.items():
+        name = f'{scope}:{kind}'
+        if ident is not None and RATES.get(name):
+            wait = max(wait, hit(name, ident))
+
+    return wait
+
+
+class RateLimitThrottle(BaseThrottle):
+    """
+    DRF throttle applying the limits of the view's throttle_scope, by client IP, by the
+    mobile number in the request body and by the authenticated user.
+    """
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if scope is None:
+            return True
+
+        # A JSON body may be a list or a scalar; the view's serializer rejects those.
+        mobile = request.data.get('mobile') if isinstance(request.data, dict) else None
+        self.retry_after = check(scope, request, mobile=mobile, user=request.user)
+        return not self.retry_after
+
+    def wait(self):
+
+        return self.retry_after
@@ -0,0 +1,88 @@
+import logging
+import time
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from .models import EventBooking
+from .gateways import razorpay_client, circuit
+from .booking import attach_payment_link, captured_payment, complete_payments
+
+# Catching up on payments whose callback and webhook never arrived: every unpaid booking is
+# looked up on Razorpay, and the paid ones are completed in bulk. That includes bookings
+# with no payment link stored, whose link may have been made and paid all the same.
+# Bookings are streamed in chunks, so memory stays flat however many are pending.
+#
+#   RECONCILE_CHUNK_SIZE     bookings read, looked up and written per round.
+#   RECONCILE_CONCURRENCY    payment link lookups in flight at once.
+
+CHUNK_SIZE = getattr(settings, 'RECONCILE_CHUNK_SIZE', 500)
+CONCURRENCY = getattr(settings, 'RECONCILE_CONCURRENCY', 16)
+
+logger = logging.getLogger(__name__)
+
+
+def pending_bookings():
+
+    return EventBooking.objects.filter(payment_completed=False).only(
+        'pk', 'user_id', 'formis_payment_id', 'vendor_payment_id', 'payment_link'
+    ).order_by('pk')
+
+
+def fetch_payment_link(client, formis_payment_id, vendor_payment_id):
+    """
+    The booking's payment link as Razorpay has it, or None if Razorpay has no link for it.
+    """
+    with circuit('razorpay'):
+        if vendor_payment_id and vendor_payment_id.startswith('plink_'):
+            return client.payment_link.fetch(vendor_payment_id)
+
+        links = client.payment_link.all({'reference_id': formis_payment_id}).get('payment_links') or []
+        return links[0] if links else None
+
+
+def reconcile_payments(chunk_size=CHUNK_SIZE, concurrency=CONCURRENCY, dry_run=False):
+    """
+    Look up every pending booking's payment link and complete the paid ones.
+    Yields running totals after each chunk.
+    """
+    client = razorpay_client()
+    totals = {'checked': 0, 'paid': 0, 'completed': 0, 'oversold': 0, 'errors': 0}
+    started = time.monotonic()
+
+    def lookup(booking):
+        try:
+            payment_link = fetch_payment_link(client, booking.formis_payment_id, booking.vendor_payment_id)
+            return booking, payment_link, captured_payment(payment_link)
+        except Exception as e:
+            logger.warning('Payment link lookup failed: %s', e, extra={'reference_id': booking.formis_payment_id})
+            return booking, None, False
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='reconcile') as executor:
+        bookings = pending_bookings().iterator(chunk_size=chunk_size)
+
+        while True:
+            chunk = list(islice(bookings, chunk_size))
+            if not chunk:
+                break
+
+            payments = {}
+            for booking, payment_link, payment in executor.map(lookup, chunk):
+                if payment is False:
+                    totals['errors'] += 1
+                elif payment:
+                    payments[booking.formis_payment_id] = payment
+                    if not booking.payment_link and not dry_run:
+                        attach_payment_link(booking, payment_link)
+
+            totals['checked'] += len(chunk)
+            totals['paid'] += len(payments)
+
+            if payments and not dry_run:
+                completed, oversold = complete_payments(payments)
+                totals['completed'] += len(completed)
+                totals['oversold'] += len(oversold)
+                for reference_id in oversold:
+                    logger.error('Payment captured after reservation expired and tickets sold out', extra={'reference_id': reference_id})
+
+            elapsed = time.monotonic() - started
+            yield dict(totals, elapsed=elapsed, rate=totals['checked'] / elapsed if elapsed else 0.0)
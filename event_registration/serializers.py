@@ -1,6 +1,7 @@
 from rest_framework import serializers
 import re
 from .models import Profile, EventBooking, Event, Ticket, User
+from .inventory import available_for
 
 class SendOTPSerializer(serializers.Serializer):
     mobile = serializers.CharField(max_length=15)
@@ -33,10 +34,17 @@ class EventSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'event_date', 'event_start_time', 'event_end_time', 'active']
 
 class TicketSerializer(serializers.ModelSerializer):
+    # Live count from the sharded inventory; annotate the queryset with
+    # inventory.with_available() to avoid a query per ticket.
+    total_tickets_available = serializers.SerializerMethodField()
+
     class Meta:
         model = Ticket
         fields = ['id', 'name', 'price', 'total_tickets_available']
 
+    def get_total_tickets_available(self, ticket):
+        return available_for(ticket)
+
 class ProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = Profile
@@ -86,8 +94,9 @@ class EventBookingSerializer(serializers.ModelSerializer):
 
         if ticket is not None:
             try:
-                if ticket_quantity > ticket.total_tickets_available:
-                    raise serializers.ValidationError(f"Only {ticket.total_tickets_available} tickets are available.")
+                available = available_for(ticket)
+                if ticket_quantity > available:
+                    raise serializers.ValidationError(f"Only {available} tickets are available.")
             except Ticket.DoesNotExist:
                 raise serializers.ValidationError("Ticket does not exist.")
 
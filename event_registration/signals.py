@@ -0,0 +1,49 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from .models import User, Event, Ticket, EventBooking, Profile
+from .inventory import create_shards
+from .caching import invalidate_latest_event, bump_version, bump_booking_version, user_bookings_scope
+from .authentication import invalidate_cached_user
+
+
+@receiver(post_save, sender=Ticket)
+def shard_new_ticket_inventory(sender, instance, created, raw=False, **kwargs):
+    """
+    Give every new ticket its sharded seat counter.
+    """
+    if created and not raw:
+        create_shards(instance)
+
+
+@receiver([post_save, post_delete], sender=Event)
+@receiver([post_save, post_delete], sender=Ticket)
+def invalidate_cached_event_details(sender, **kwargs):
+
+    transaction.on_commit(invalidate_latest_event)
+
+
+@receiver([post_save, post_delete], sender=EventBooking)
+def bump_booking_versions(sender, instance, **kwargs):
+
+    bump_booking_version(instance.formis_payment_id, instance.user_id)
+
+
+@receiver(post_save, sender=Profile)
+def bump_profile_booking_version(sender, instance, **kwargs):
+
+    # The user's booking response includes the profile name.
+    transaction.on_commit(lambda: bump_version(user_bookings_scope(instance.user_id)))
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_auth_user(sender, instance, **kwargs):
+
+    transaction.on_commit(lambda: invalidate_cached_user(instance.pk))
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def invalidate_cached_auth_user_on_logout(sender, instance, **kwargs):
+
+    transaction.on_commit(lambda: invalidate_cached_user(instance.token.user_id))
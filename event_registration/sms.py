@@ -0,0 +1,234 @@
+import logging
+import queue
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from settings.config import TWILIO_PHONE_NUMBER
+from .models import OutboundSMS
+from .gateways import twilio_client, circuit, CONNECT_TIMEOUT, READ_TIMEOUT
+
+# Outbound SMS are queued and delivered by a pool of worker threads, so request
+# threads never wait on the SMS provider.
+#
+#   SMS_QUEUE_BACKEND    'memory' (default) keeps the queue in this process;
+#                        'database' stores it in OutboundSMS, drained by `manage.py run_sms_worker`.
+#   SMS_TRANSPORT        'twilio' (default), 'fake', or a dotted path to a transport class.
+#   SMS_WORKERS          worker threads per process.
+#   SMS_BATCH_SIZE       messages a worker takes from the queue at a time.
+#   SMS_MAX_ATTEMPTS     deliveries tried before a message is given up on.
+#   SMS_RETRY_DELAY      seconds before the first retry; doubles on each further attempt.
+
+QUEUE_BACKEND = getattr(settings, 'SMS_QUEUE_BACKEND', 'memory')
+TRANSPORT = getattr(settings, 'SMS_TRANSPORT', 'twilio')
+WORKERS = getattr(settings, 'SMS_WORKERS', 4)
+BATCH_SIZE = getattr(settings, 'SMS_BATCH_SIZE', 20)
+MAX_ATTEMPTS = getattr(settings, 'SMS_MAX_ATTEMPTS', 3)
+RETRY_DELAY = getattr(settings, 'SMS_RETRY_DELAY', 2)
+
+logger = logging.getLogger(__name__)
+
+
+class TwilioTransport:
+    """
+    Delivers messages through the shared Twilio client. While Twilio's circuit is open,
+    sends fail fast with gateways.CircuitOpen and are retried later.
+    """
+
+    def send(self, message):
+        with circuit('twilio'):
+            twilio_client().messages.create(body=message.body, from_=TWILIO_PHONE_NUMBER, to=message.to)
+
+
+class FakeTransport:
+    """
+    Keeps messages in memory instead of sending them, for tests and local development.
+    Set `fail_next` to make that many upcoming sends raise.
+    """
+
+    outbox = []
+    fail_next = 0
+    lock = threading.Lock()
+
+    def send(self, message):
+        with self.lock:
+            if FakeTransport.fail_next:
+                FakeTransport.fail_next -= 1
+                raise ConnectionError('FakeTransport: simulated provider failure')
+            FakeTransport.outbox.append((message.to, message.body))
+
+
+TRANSPORTS = {
+    'twilio': TwilioTransport,
+    'fake': FakeTransport,
+}
+
+
+def _retry_at(attempts):
+
+    return timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** (attempts - 1))
+
+
+class InProcessBackend:
+    """
+    Queue held in memory and drained by daemon threads in this process. Fast, but
+    messages still queued when the process exits are lost.
+    """
+
+    def __init__(self, transport, workers=WORKERS, batch_size=BATCH_SIZE):
+        self.transport = transport
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def enqueue(self, to, body):
+        self._start()
+        self.queue.put(OutboundSMS(to=to, body=body))
+
+    def _start(self):
+        if self.threads:
+            return
+
+        with self.lock:
+            if self.threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'sms-worker-{index}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def _work(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for message in batch:
+                message.attempts += 1
+                try:
+                    self.transport.send(message)
+                except Exception as e:
+                    logger.warning('SMS failed (attempt %s): %s', message.attempts, e, extra={'to': message.to})
+                    if message.attempts < MAX_ATTEMPTS:
+                        delay = RETRY_DELAY * 2 ** (message.attempts - 1)
+                        threading.Timer(delay, self.queue.put, args=(message,)).start()
+                finally:
+                    self.queue.task_done()
+
+
+class DatabaseBackend:
+    """
+    Queue stored in the OutboundSMS table. Enqueueing is a single INSERT in the caller's
+    transaction, so a message is durable exactly when the data it belongs to is.
+    Workers started by `manage.py run_sms_worker` claim batches with SKIP LOCKED
+    where the database supports it, so several can run side by side.
+    """
+
+    def __init__(self, transport, batch_size=BATCH_SIZE):
+        self.transport = transport
+        self.batch_size = batch_size
+        # Long enough for every send in a batch to run into the gateway timeouts, so a slow
+        # batch is never claimed again, and sent twice, while it is still being sent.
+        self.lease = timedelta(seconds=batch_size * (CONNECT_TIMEOUT + READ_TIMEOUT))
+
+    def enqueue(self, to, body):
+        OutboundSMS.objects.create(to=to, body=body, next_attempt_at=timezone.now())
+
+    def process_batch(self):
+        """
+        Send one batch of due messages. Returns how many were attempted.
+        """
+        with transaction.atomic():
+            batch = list(
+                OutboundSMS.objects.select_for_update(skip_locked=True)
+                .filter(status=OutboundSMS.PENDING, next_attempt_at__lte=timezone.now())
+                .order_by('next_attempt_at')[:self.batch_size]
+            )
+
+            if not batch:
+                return 0
+
+            # Lease the batch: other workers skip it while it is being sent, and it
+            # becomes due again if this worker dies before recording the outcome.
+            OutboundSMS.objects.filter(pk__in=[message.pk for message in batch]).update(
+                next_attempt_at=timezone.now() + self.lease
+            )
+
+        for message in batch:
+            message.attempts += 1
+            try:
+                self.transport.send(message)
+                message.status = OutboundSMS.SENT
+                message.sent_at = timezone.now()
+                message.last_error = None
+            except Exception as e:
+                message.last_error = str(e)[:200]
+                if message.attempts < MAX_ATTEMPTS:
+                    message.next_attempt_at = _retry_at(message.attempts)
+                else:
+                    message.status = OutboundSMS.FAILED
+
+        OutboundSMS.objects.bulk_update(batch, ['status', 'attempts', 'last_error', 'next_attempt_at', 'sent_at'])
+
+        return len(batch)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_transport(name=None):
+
+    name = name or TRANSPORT
+    transport_class = TRANSPORTS.get(name) or import_string(name)
+    return transport_class()
+
+
+def get_queue():
+    """
+    The process-wide SMS queue configured by SMS_QUEUE_BACKEND.
+    """
+    global _queue
+
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                if QUEUE_BACKEND == 'database':
+                    _queue = DatabaseBackend(get_transport())
+                else:
+                    _queue = InProcessBackend(get_transport())
+
+    return _queue
+
+
+def set_queue(sms_queue):
+    """
+    Replace the process-wide SMS queue, e.g. to deliver through another transport for a
+    benchmark. Returns the queue it replaced (None if none was made yet).
+    """
+    global _queue
+
+    with _queue_lock:
+        previous, _queue = _queue, sms_queue
+
+    return previous
+
+
+def send_sms(to, body):
+    """
+    Queue a text message for delivery and return immediately.
+    """
+    sms_queue = get_queue()
+
+    if isinstance(sms_queue, DatabaseBackend):
+        sms_queue.enqueue(to, body)
+    else:
+        # Don't hand the message to a worker before the data it refers to is committed.
+        transaction.on_commit(lambda: sms_queue.enqueue(to, body))
@@ -0,0 +1,63 @@
+import asyncio
+import json
+from django.conf import settings
+from .models import EventBooking
+from .pubsub import get_hub, payment_channel
+
+# Server-sent events telling a client when its booking is paid, so it can stop polling
+# CheckPaymentStatus. booking.complete_payment() publishes on the booking's pub/sub channel.
+#
+# Serve these through settings/asgi.py: under WSGI every open stream holds a worker thread.
+#
+#   PAYMENT_STREAM_TIMEOUT      seconds a stream stays open before the client reconnects.
+#   PAYMENT_STREAM_HEARTBEAT    seconds between keep-alive comments. Each heartbeat also reads
+#                               the booking's payment_completed from the database, which catches
+#                               payments completed in another process when the pub/sub backend
+#                               is in-process only.
+
+STREAM_TIMEOUT = getattr(settings, 'PAYMENT_STREAM_TIMEOUT', 300)
+STREAM_HEARTBEAT = getattr(settings, 'PAYMENT_STREAM_HEARTBEAT', 15)
+RECONNECT_DELAY_MS = 3000
+
+
+def sse_event(name, data):
+
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+async def payment_completed(reference_id):
+
+    return await EventBooking.objects.filter(formis_payment_id=reference_id).values_list(
+        'payment_completed', flat=True
+    ).afirst()
+
+
+async def payment_status_events(reference_id, queue, paid):
+    """
+    The event stream for a booking whose channel `queue` is already subscribed to.
+    Ends after the payment completes or STREAM_TIMEOUT passes.
+    """
+    hub = get_hub()
+    channel = payment_channel(reference_id)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STREAM_TIMEOUT
+
+    try:
+        yield f'retry: {RECONNECT_DELAY_MS}\n'
+        yield sse_event('status', {'payment_completed': paid})
+
+        while not paid and loop.time() < deadline:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=min(STREAM_HEARTBEAT, deadline - loop.time()))
+                paid = message.get('payment_completed', False)
+
+            except asyncio.TimeoutError:
+                paid = bool(await payment_completed(reference_id))
+
+                if not paid:
+                    yield ': keep-alive\n\n'
+
+            if paid:
+                yield sse_event('status', {'payment_completed': True})
+    finally:
+        hub.unsubscribe(channel, queue)
@@ -1,3 +1,1073 @@
-from django.test import TestCase
+import base64
+import datetime
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import threading
+import time
+import unittest
+import uuid
+from unittest import mock
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from . import caching, checkin, gateways, log, metrics, otp_store, ratelimit, sms, streams, ticket_payload, tokens, waiting_room, webhooks
+from .pubsub import get_hub, payment_channel
+from django.urls import reverse
+from django.utils import timezone
+from .fakes import FakeProviderServer
+from .reconcile import reconcile_payments
+from .management.commands import check_query_budgets
+from .booking import attach_payment_link, create_pending_booking, abandon_pending_booking, complete_payments, release_expired_bookings
+from .caching import bump_version, booking_scope
+from .inventory import available_for, reserve_tickets, SoldOut
+from .models import Event, Ticket, EventBooking, OutboundSMS, RazorpayWebhookEvent, TicketInventoryShard, TicketReservation
+from .urls import urlpatterns
+from .utility import generate_tokens_for_user
+from .authentication import CachedJWTAuthentication, user_cache_key
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
-# Create your tests here.
+User = get_user_model()
+
+PROFILE = {'name': 'Test Attendee', 'age': '25-40', 'mobile': '9876543210', 'gender': 'Male'}
+
+
+class BookingTestCase(TestCase):
+    """
+    An active event with one ticket tier, and a helper to make pending bookings against it.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.event = Event.objects.create(
+            name='Test', event_date=datetime.date.today(),
+            event_start_time=datetime.time(17), event_end_time=datetime.time(23), active=True
+        )
+        self.ticket = Ticket.objects.create(
+            event=self.event, name='General', price=500, total_tickets=10, total_tickets_available=10
+        )
+
+    def pending_booking(self, mobile='9000000001', quantity=2):
+        user = User.objects.get_or_create(mobile=mobile)[0]
+        return create_pending_booking(user, PROFILE, {
+            'event': self.event, 'ticket': self.ticket, 'ticket_quantity': quantity, 'attending_time': '5PM-7PM'
+        }, str(uuid.uuid4()), self.ticket.price * quantity)
+
+
+class ReleaseExpiredBookingsTests(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        gateways.reset()
+
+    def expire(self, reservation):
+        TicketReservation.objects.filter(pk=reservation.pk).update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+
+    def link(self, event_booking, status, **fields):
+        return {'id': 'plink_1', 'short_url': 'https://rzp.io/i/1', 'reference_id': event_booking.formis_payment_id,
+                'status': status, **fields}
+
+    def test_releases_seats_and_deletes_unpaid_booking(self):
+        event_booking, reservation = self.pending_booking()
+        self.expire(reservation)
+        client = StubRazorpayClient(links=[self.link(event_booking, 'created')])
+
+        self.assertEqual(release_expired_bookings(client), 1)
+
+        self.assertEqual(client.payment_link.cancelled, ['plink_1'])
+        self.assertFalse(EventBooking.objects.filter(pk=event_booking.pk).exists())
+        self.assertEqual(available_for(self.ticket), 10)
+
+        # The user is free to book again
+        self.pending_booking()
+        self.assertEqual(available_for(self.ticket), 8)
+
+    def test_completes_booking_whose_link_was_paid(self):
+        event_booking, reservation = self.pending_booking()
+        self.expire(reservation)
+        client = StubRazorpayClient(links=[self.link(event_booking, 'paid', payments=[
+            {'payment_id': 'pay_1', 'status': 'captured', 'created_at': int(time.time())}
+        ])])
+
+        self.assertEqual(release_expired_bookings(client), 0)
+
+        event_booking.refresh_from_db()
+        self.assertTrue(event_booking.payment_completed)
+        self.assertEqual(event_booking.vendor_payment_id, 'pay_1')
+        self.assertEqual(event_booking.payment_link, 'https://rzp.io/i/1')
+        self.assertEqual(TicketReservation.objects.get(pk=reservation.pk).status, TicketReservation.CONFIRMED)
+        self.assertEqual(client.payment_link.cancelled, [])
+        self.assertEqual(available_for(self.ticket), 8)
+
+    def test_keeps_hold_when_razorpay_is_unreachable(self):
+        event_booking, reservation = self.pending_booking()
+        other_booking, other_reservation = self.pending_booking(mobile='9000000002')
+        self.expire(reservation)
+        self.expire(other_reservation)
+        client = StubRazorpayClient(fail=True)
+
+        with self.assertLogs('event_registration.booking', 'WARNING'):
+            self.assertEqual(release_expired_bookings(client, batch_size=1), 0)
+
+        self.assertEqual(EventBooking.objects.filter(pk__in=[event_booking.pk, other_booking.pk]).count(), 2)
+        self.assertEqual(available_for(self.ticket), 6)
+
+        client.payment_link.fail = False
+        self.assertEqual(release_expired_bookings(client), 2)
+        self.assertEqual(available_for(self.ticket), 10)
+
+    def test_keeps_paid_booking(self):
+        event_booking, reservation = self.pending_booking()
+        EventBooking.objects.filter(pk=event_booking.pk).update(payment_completed=True)
+        self.expire(reservation)
+
+        release_expired_bookings(StubRazorpayClient(fail=True))
+
+        self.assertTrue(EventBooking.objects.filter(pk=event_booking.pk).exists())
+
+    def test_leaves_live_holds(self):
+        event_booking, _ = self.pending_booking()
+
+        self.assertEqual(release_expired_bookings(StubRazorpayClient()), 0)
+        self.assertTrue(EventBooking.objects.filter(pk=event_booking.pk).exists())
+
+    def test_warns_of_payment_for_a_missing_booking(self):
+        with self.assertLogs('event_registration.booking', 'WARNING') as logs:
+            completed, oversold = complete_payments({str(uuid.uuid4()): ('pay_1', timezone.now())})
+
+        self.assertEqual((completed, oversold), ([], []))
+        self.assertIn('does not exist', logs.output[0])
+
+
+class InventoryTests(BookingTestCase):
+
+    def test_reservation_gathers_seats_across_shards(self):
+        # 10 seats over 8 shards: no single shard holds 3
+        reserve_tickets(self.ticket, 3, str(uuid.uuid4()))
+
+        self.assertEqual(available_for(self.ticket), 7)
+
+    def test_sold_out(self):
+        reserve_tickets(self.ticket, 10, str(uuid.uuid4()))
+
+        with self.assertRaises(SoldOut):
+            reserve_tickets(self.ticket, 1, str(uuid.uuid4()))
+
+    def test_admin_edit_redistributes_shards(self):
+        self.pending_booking(quantity=4)
+        admin_user = User.objects.create_superuser(mobile='9000000009', password='secret')
+        self.client.force_login(admin_user)
+        url = reverse('admin:event_registration_ticket_change', args=[self.ticket.pk])
+
+        form = self.client.get(url).context['adminform'].form
+        self.assertEqual(form.initial['total_tickets_available'], 6)
+
+        response = self.client.post(url, {
+            'event': self.event.pk, 'name': 'General', 'price': 500, 'total_tickets': 30, 'total_tickets_available': 20
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(available_for(self.ticket), 20)
+        self.assertEqual(TicketInventoryShard.objects.filter(ticket=self.ticket).count(), 8)
+
+    def test_admin_save_without_edit_keeps_shards(self):
+        self.pending_booking(quantity=4)
+        admin_user = User.objects.create_superuser(mobile='9000000009', password='secret')
+        self.client.force_login(admin_user)
+        url = reverse('admin:event_registration_ticket_change', args=[self.ticket.pk])
+
+        self.client.post(url, {
+            'event': self.event.pk, 'name': 'Renamed', 'price': 500, 'total_tickets': 10, 'total_tickets_available': 6
+        })
+
+        self.assertEqual(available_for(self.ticket), 6)
+
+
+class StubPaymentLinks:
+    """
+    The payment_link part of a razorpay.Client, holding links in memory.
+    """
+
+    def __init__(self, links=(), fail=False):
+        self.links = list(links)
+        self.fail = fail
+        self.cancelled = []
+
+    def all(self, params):
+        if self.fail:
+            raise ConnectionError('Razorpay unreachable')
+        return {'payment_links': [link for link in self.links if link['reference_id'] == params['reference_id']]}
+
+    def cancel(self, payment_link_id):
+        self.cancelled.append(payment_link_id)
+
+
+class StubRazorpayClient:
+
+    def __init__(self, **kwargs):
+        self.payment_link = StubPaymentLinks(**kwargs)
+
+
+class AbandonPendingBookingTests(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        gateways.reset()
+
+    def link(self, event_booking, status):
+        return {'id': 'plink_1', 'reference_id': event_booking.formis_payment_id, 'status': status}
+
+    def test_deletes_booking_without_link(self):
+        event_booking, _ = self.pending_booking()
+
+        self.assertTrue(abandon_pending_booking(StubRazorpayClient(), event_booking))
+
+        self.assertFalse(EventBooking.objects.filter(pk=event_booking.pk).exists())
+        self.assertEqual(available_for(self.ticket), 10)
+
+    def test_cancels_link_created_despite_the_error(self):
+        event_booking, _ = self.pending_booking()
+        client = StubRazorpayClient(links=[self.link(event_booking, 'created')])
+
+        self.assertTrue(abandon_pending_booking(client, event_booking))
+
+        self.assertEqual(client.payment_link.cancelled, ['plink_1'])
+        self.assertFalse(EventBooking.objects.filter(pk=event_booking.pk).exists())
+
+    def test_completes_booking_when_link_was_paid(self):
+        event_booking, reservation = self.pending_booking()
+        client = StubRazorpayClient(links=[{**self.link(event_booking, 'paid'), 'short_url': 'https://rzp.io/i/1', 'payments': [
+            {'payment_id': 'pay_1', 'status': 'captured', 'created_at': int(time.time())}
+        ]}])
+
+        self.assertFalse(abandon_pending_booking(client, event_booking))
+
+        event_booking.refresh_from_db()
+        self.assertTrue(event_booking.payment_completed)
+        self.assertEqual(event_booking.payment_link, 'https://rzp.io/i/1')
+        self.assertEqual(TicketReservation.objects.get(pk=reservation.pk).status, TicketReservation.CONFIRMED)
+
+    def test_keeps_booking_when_razorpay_is_unreachable(self):
+        event_booking, _ = self.pending_booking()
+
+        self.assertFalse(abandon_pending_booking(StubRazorpayClient(fail=True), event_booking))
+
+        self.assertTrue(EventBooking.objects.filter(pk=event_booking.pk).exists())
+
+    def test_deletes_booking_at_once_when_razorpay_was_never_reached(self):
+        event_booking, _ = self.pending_booking()
+        client = StubRazorpayClient(fail=True)
+
+        self.assertTrue(abandon_pending_booking(client, event_booking, gateways.CircuitOpen('razorpay circuit is open')))
+
+        self.assertFalse(EventBooking.objects.filter(pk=event_booking.pk).exists())
+        self.assertEqual(available_for(self.ticket), 10)
+
+    def test_refused_connection_never_reached_razorpay(self):
+        with FakeProviderServer() as server:
+            url = server.url
+        session = gateways.PooledSession(provider='razorpay')
+
+        with self.assertRaises(Exception) as refused:
+            session.get(f'{url}/v1/payment_links')
+
+        self.assertTrue(gateways.never_reached(refused.exception))
+        self.assertFalse(gateways.never_reached(ConnectionError('Connection reset by peer')))
+
+    def test_retry_of_a_kept_booking_conflicts(self):
+        event_booking, _ = self.pending_booking()
+        user = User.objects.get(mobile='9000000001')
+        headers = {'Authorization': f'Bearer {generate_tokens_for_user(user)["access"]}'}
+
+        response = self.client.post(reverse('book-tickets'), {
+            **PROFILE, 'event': self.event.pk, 'ticket': self.ticket.pk, 'ticket_quantity': 2, 'attending_time': '5PM-7PM'
+        }, content_type='application/json', headers=headers)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['id'], event_booking.formis_payment_id)
+        self.assertEqual(available_for(self.ticket), 8)
+
+
+class ReconcilePaymentsTests(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.razorpay = FakeProviderServer(seed=1).__enter__()
+        self.addCleanup(self.razorpay.__exit__, None, None, None)
+        settings = override_settings(RAZORPAY_BASE_URL=self.razorpay.url)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        gateways.reset()
+        self.addCleanup(gateways.reset)
+
+    def booking_with_link(self, mobile, paid):
+        event_booking, _ = self.pending_booking(mobile=mobile)
+        link = self.razorpay.add_payment_link(event_booking.formis_payment_id, 100000, paid=paid)
+        attach_payment_link(event_booking, link)
+        return event_booking, link
+
+    def reconcile(self):
+        *_, totals = reconcile_payments(chunk_size=10, concurrency=2)
+        return totals
+
+    def test_completes_paid_links_and_leaves_unpaid_ones(self):
+        paid_booking, paid_link = self.booking_with_link('9000000001', paid=True)
+        unpaid_booking, _ = self.booking_with_link('9000000002', paid=False)
+
+        totals = self.reconcile()
+
+        self.assertEqual((totals['checked'], totals['paid'], totals['completed'], totals['errors']), (2, 1, 1, 0))
+        paid_booking.refresh_from_db()
+        self.assertTrue(paid_booking.payment_completed)
+        self.assertEqual(paid_booking.vendor_payment_id, paid_link['payments'][0]['payment_id'])
+        self.assertFalse(EventBooking.objects.get(pk=unpaid_booking.pk).payment_completed)
+
+    def test_completes_booking_whose_link_was_never_stored(self):
+        event_booking, _ = self.pending_booking()
+        link = self.razorpay.add_payment_link(event_booking.formis_payment_id, 100000, paid=True)
+
+        self.assertEqual(self.reconcile()['completed'], 1)
+
+        event_booking.refresh_from_db()
+        self.assertTrue(event_booking.payment_completed)
+        self.assertEqual(event_booking.payment_link, link['short_url'])
+
+    def test_provider_error_is_counted_and_leaves_the_booking(self):
+        event_booking, _ = self.booking_with_link('9000000001', paid=True)
+        self.razorpay.error_rate = 1.0
+
+        with self.assertLogs('event_registration.reconcile', 'WARNING'):
+            totals = self.reconcile()
+
+        self.assertEqual((totals['errors'], totals['completed']), (1, 0))
+        self.assertFalse(EventBooking.objects.get(pk=event_booking.pk).payment_completed)
+
+
+class WaitingRoomTests(BookingTestCase):
+
+    def bearer(self, user):
+
+        return {'Authorization': f'Bearer {generate_tokens_for_user(user)["access"]}'}
+
+    def test_pass_is_made_out_to_the_user_who_joined(self):
+        owner = User.objects.create(mobile='9000000001')
+        other = User.objects.create(mobile='9000000002')
+        token, admit_at = waiting_room.join(owner.id)
+
+        self.assertEqual(waiting_room.admission_time(token, owner.id), admit_at)
+        with self.assertRaises(waiting_room.InvalidPass):
+            waiting_room.admission_time(token, other.id)
+
+    def test_middleware_refuses_another_users_pass(self):
+        owner = User.objects.create(mobile='9000000001')
+        other = User.objects.create(mobile='9000000002')
+        token, _ = waiting_room.join(owner.id, now=time.time() - 1)
+        factory = RequestFactory()
+
+        stolen = factory.post(reverse('book-tickets'), headers={waiting_room.HEADER: token, **self.bearer(other)})
+        own = factory.post(reverse('book-tickets'), headers={waiting_room.HEADER: token, **self.bearer(owner)})
+
+        self.assertEqual(waiting_room._refusal(stolen).status_code, 403)
+        self.assertIsNone(waiting_room._refusal(own))
+
+    def test_join_reuses_own_pass_only(self):
+        owner = User.objects.create(mobile='9000000001')
+        other = User.objects.create(mobile='9000000002')
+        token = self.client.post(reverse('join-waiting-room'), headers=self.bearer(owner)).json()['token']
+
+        kept = self.client.post(reverse('join-waiting-room'), headers={waiting_room.HEADER: token, **self.bearer(owner)})
+        taken = self.client.post(reverse('join-waiting-room'), headers={waiting_room.HEADER: token, **self.bearer(other)})
+
+        self.assertEqual(kept.json()['token'], token)
+        self.assertNotEqual(taken.json()['token'], token)
+
+    def test_check_fails_without_a_shared_cache(self):
+        with mock.patch.object(waiting_room, 'ENABLED', True):
+            errors = waiting_room.check_shared_cache(None)
+
+        self.assertEqual([error.id for error in errors], ['event_registration.E001'])
+
+
+class OTPStoreTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(mobile='9000000001')
+        self.stores = {'database': otp_store.DatabaseOTPStore(), 'cache': otp_store.CacheOTPStore()}
+
+    def test_code_is_consumed_once(self):
+        for name, store in self.stores.items():
+            with self.subTest(name):
+                store.issue(self.user, 123456)
+
+                self.assertEqual(store.verify(self.user, 123456), otp_store.VERIFIED)
+                self.assertEqual(store.verify(self.user, 123456), otp_store.NOT_FOUND)
+
+    def test_attempts_run_out(self):
+        for name, store in self.stores.items():
+            with self.subTest(name):
+                store.issue(self.user, 123456)
+
+                for _ in range(otp_store.MAX_ATTEMPTS):
+                    self.assertEqual(store.verify(self.user, 111111), otp_store.INVALID)
+                # Even the right code is refused once the guesses are spent.
+                self.assertEqual(store.verify(self.user, 123456), otp_store.TOO_MANY_ATTEMPTS)
+
+    def test_expired_code(self):
+        for name, store in self.stores.items():
+            with self.subTest(name), mock.patch.object(otp_store, 'TTL', datetime.timedelta(seconds=-1)):
+                store.issue(self.user, 123456)
+
+                self.assertEqual(store.verify(self.user, 123456), otp_store.EXPIRED)
+
+    def test_check_fails_for_the_cache_store_without_a_shared_cache(self):
+        with mock.patch.object(otp_store, 'STORE', 'cache'):
+            errors = otp_store.check_shared_cache(None)
+
+        self.assertEqual([error.id for error in errors], ['event_registration.E002'])
+        self.assertEqual(otp_store.check_shared_cache(None), [])
+
+
+@mock.patch.dict(ratelimit.RATES, {'test:ip': (3, 100)})
+class RateLimitTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def hits(self, count, now):
+
+        return [ratelimit.hit('test:ip', '10.0.0.1', now=now) for _ in range(count)]
+
+    def test_burst_past_the_limit_waits_for_the_window_to_slide(self):
+        self.assertEqual(self.hits(3, now=1000), [0, 0, 0])
+
+        # 4 in a window of 3: the rest of this window, then until half of it has slid out,
+        # leaving room for the retry.
+        wait = ratelimit.hit('test:ip', '10.0.0.1', now=1000)
+        self.assertAlmostEqual(wait, 150)
+        self.assertEqual(ratelimit.hit('test:ip', '10.0.0.1', now=1000 + wait + 0.01), 0)
+
+    def test_refused_requests_count(self):
+        self.hits(4, now=1000)
+
+        self.assertAlmostEqual(ratelimit.hit('test:ip', '10.0.0.1', now=1000), 100 + 100 * (1 - 2 / 5))
+
+    def test_previous_window_weighs_by_its_overlap(self):
+        self.hits(3, now=1000)
+
+        # Half way through the next window, the previous one's 3 count as 1.5.
+        self.assertEqual(ratelimit.hit('test:ip', '10.0.0.1', now=1150), 0)
+        self.assertAlmostEqual(ratelimit.hit('test:ip', '10.0.0.1', now=1150), 50)
+
+    def test_retry_is_let_in_once_enough_of_the_previous_window_slid_out(self):
+        self.hits(5, now=1000)
+
+        # 1 + 5 at half overlap is 3.5; the retry makes 2 + 5 * 20% overlap, which is 3.
+        wait = ratelimit.hit('test:ip', '10.0.0.1', now=1150)
+        self.assertAlmostEqual(wait, 30)
+        self.assertEqual(ratelimit.hit('test:ip', '10.0.0.1', now=1150 + wait + 0.01), 0)
+
+    def test_windows_two_apart_do_not_count(self):
+        self.hits(5, now=1000)
+
+        self.assertEqual(self.hits(3, now=1200), [0, 0, 0])
+
+    def test_clients_are_counted_apart(self):
+        self.hits(4, now=1000)
+
+        self.assertEqual(ratelimit.hit('test:ip', '10.0.0.2', now=1000), 0)
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.counter = metrics.Counter('test_total', 'Test counter.', ['route'])
+        self.histogram = metrics.Histogram('test_seconds', 'Test histogram.')
+
+    def tearDown(self):
+        metrics.REGISTRY.remove(self.counter)
+        metrics.REGISTRY.remove(self.histogram)
+
+    def in_thread(self, record):
+        thread = threading.Thread(target=record)
+        thread.start()
+        thread.join()
+
+    def test_finished_threads_shards_are_folded(self):
+        for _ in range(50):
+            self.in_thread(lambda: (self.counter.inc('a'), self.histogram.observe(0.02)))
+        self.counter.inc('a')
+
+        self.assertEqual(len(self.counter.shards), 1)
+        self.assertEqual(self.counter.collect(), {('a',): 51})
+        self.assertEqual(len(self.histogram.collect()[()]), len(metrics.LATENCY_BUCKETS) + 2)
+        self.assertEqual(sum(self.histogram.collect()[()][:-1]), 50)
+        self.assertEqual(self.histogram.shards, [])
+
+    def test_collect_leaves_base_unchanged(self):
+        self.in_thread(lambda: self.histogram.observe(0.02))
+
+        self.histogram.collect()[()][0] += 100
+
+        self.assertEqual(sum(self.histogram.collect()[()][:-1]), 1)
+
+
+class QueryBudgetTests(TransactionTestCase):
+    """
+    No endpoint runs more than its view's query_budget queries on a cold cache, taking the
+    path with the most queries; the requests are check_query_budgets' own. A TransactionTestCase,
+    so the views' transactions commit as in production instead of adding savepoint queries.
+    """
+
+    def setUp(self):
+        self.razorpay = FakeProviderServer().__enter__()
+        self.addCleanup(self.razorpay.__exit__, None, None, None)
+        settings = override_settings(RAZORPAY_BASE_URL=self.razorpay.url, RAZORPAY_WEBHOOK_SECRET='whsecret')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        gateways.reset()
+        self.addCleanup(gateways.reset)
+
+        self.requests = check_query_budgets.Command()
+        self.requests.seed()
+
+    def test_endpoints_stay_within_their_budgets(self):
+        for pattern in urlpatterns:
+            with self.subTest(pattern.name):
+                budget = pattern.callback.view_class.query_budget
+                method, data, headers, expected_status = getattr(
+                    self.requests, f'request_{pattern.name.replace("-", "_")}'
+                )()
+
+                cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = async_to_sync(self.request)(method, reverse(pattern.name), data, headers)
+
+                self.assertEqual(response.status_code, expected_status)
+                self.assertLessEqual(len(queries), budget)
+
+    async def request(self, method, path, data, headers):
+        # Through the async stack, as check_query_budgets does. Sync code run from it comes back
+        # to this thread, so its queries are on the connection being captured.
+        try:
+            if method == 'get':
+                return await self.async_client.get(path, data, headers=headers)
+            return await self.async_client.post(path, data, content_type='application/json', headers=headers)
+        finally:
+            await gateways.async_razorpay_client().close()
+
+
+class DatabaseSMSQueueTests(TestCase):
+
+    def setUp(self):
+        sms.FakeTransport.outbox = []
+        sms.FakeTransport.fail_next = 0
+        self.backend = sms.DatabaseBackend(sms.FakeTransport())
+
+    def make_due(self):
+        OutboundSMS.objects.update(next_attempt_at=timezone.now())
+
+    def test_sends_queued_message(self):
+        self.backend.enqueue('+919000000001', 'Your code is 123456')
+
+        self.assertEqual(self.backend.process_batch(), 1)
+
+        message = OutboundSMS.objects.get()
+        self.assertEqual((message.status, message.attempts), (OutboundSMS.SENT, 1))
+        self.assertEqual(sms.FakeTransport.outbox, [('+919000000001', 'Your code is 123456')])
+
+    def test_retries_with_backoff(self):
+        self.backend.enqueue('+919000000001', 'Your code is 123456')
+        sms.FakeTransport.fail_next = 2
+
+        delays = []
+        for _ in range(2):
+            started = timezone.now()
+            self.backend.process_batch()
+            message = OutboundSMS.objects.get()
+            self.assertEqual(message.status, OutboundSMS.PENDING)
+            delays.append(round((message.next_attempt_at - started).total_seconds()))
+            self.make_due()
+
+        self.assertEqual(delays, [sms.RETRY_DELAY, sms.RETRY_DELAY * 2])
+
+        self.backend.process_batch()
+
+        message = OutboundSMS.objects.get()
+        self.assertEqual((message.status, message.attempts, message.last_error), (OutboundSMS.SENT, 3, None))
+
+    def test_gives_up_after_max_attempts(self):
+        self.backend.enqueue('+919000000001', 'Your code is 123456')
+        sms.FakeTransport.fail_next = sms.MAX_ATTEMPTS
+
+        for _ in range(sms.MAX_ATTEMPTS):
+            self.backend.process_batch()
+            self.make_due()
+
+        message = OutboundSMS.objects.get()
+        self.assertEqual((message.status, message.attempts), (OutboundSMS.FAILED, sms.MAX_ATTEMPTS))
+        self.assertIn('simulated provider failure', message.last_error)
+        self.assertEqual(self.backend.process_batch(), 0)
+        self.assertEqual(sms.FakeTransport.outbox, [])
+
+    def test_batch_being_sent_is_not_claimed_again(self):
+        self.backend.enqueue('+919000000001', 'Your code is 123456')
+        other_worker = sms.DatabaseBackend(sms.FakeTransport())
+        # As if every send of a full batch ran into the gateway timeouts
+        batch_seconds = sms.BATCH_SIZE * (gateways.CONNECT_TIMEOUT + gateways.READ_TIMEOUT) - 1
+        claimed = []
+
+        class SlowTransport:
+            def send(self, message):
+                later = timezone.now() + datetime.timedelta(seconds=batch_seconds)
+                with mock.patch.object(sms.timezone, 'now', return_value=later):
+                    claimed.append(other_worker.process_batch())
+
+        sms.DatabaseBackend(SlowTransport()).process_batch()
+
+        self.assertEqual(claimed, [0])
+        self.assertEqual(sms.FakeTransport.outbox, [])
+
+
+class ConditionalGetTests(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.event_booking, _ = self.pending_booking()
+        access = generate_tokens_for_user(self.event_booking.user)['access']
+        self.headers = {'Authorization': f'Bearer {access}'}
+        self.url = reverse('check-payment-status')
+        self.data = {'reference_id': self.event_booking.formis_payment_id}
+
+    @mock.patch('event_registration.views.cache_is_shared', return_value=True)
+    def test_not_modified_until_the_version_moves(self, _):
+        etag = self.client.get(self.url, self.data, headers=self.headers)['ETag']
+
+        unchanged = self.client.get(self.url, self.data, headers={**self.headers, 'If-None-Match': etag})
+        bump_version(booking_scope(self.event_booking.formis_payment_id))
+        changed = self.client.get(self.url, self.data, headers={**self.headers, 'If-None-Match': etag})
+
+        self.assertEqual(unchanged.status_code, 304)
+        self.assertEqual(changed.status_code, 200)
+
+    def test_per_process_stamp_is_not_trusted(self):
+        # Another worker may have taken the payment without this worker's stamp moving.
+        etag = self.client.get(self.url, self.data, headers=self.headers)['ETag']
+
+        response = self.client.get(self.url, self.data, headers={**self.headers, 'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_reference(self):
+        response = self.client.get(self.url, {'reference_id': str(uuid.uuid4())}, headers=self.headers)
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_if_modified_since_is_not_trusted(self):
+        # A date only says which second a copy is from, not whether it missed a change within it.
+        response = self.client.get(self.url, self.data, headers={
+            **self.headers, 'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+
+
+class PaymentStatusStreamTests(BookingTestCase):
+
+    @mock.patch.object(streams, 'STREAM_HEARTBEAT', 0.01)
+    async def test_heartbeat_sees_payment_made_elsewhere(self):
+        event_booking, _ = await sync_to_async(self.pending_booking)()
+        reference_id = event_booking.formis_payment_id
+        queue = get_hub().subscribe(payment_channel(reference_id))
+        events = streams.payment_status_events(reference_id, queue, False)
+
+        self.assertIn('retry', await anext(events))
+        self.assertIn('false', await anext(events))
+
+        # Paid through another process: nothing is published on this one's hub.
+        await EventBooking.objects.filter(pk=event_booking.pk).aupdate(payment_completed=True)
+
+        self.assertEqual(await anext(events), streams.sse_event('status', {'payment_completed': True}))
+        with self.assertRaises(StopAsyncIteration):
+            await anext(events)
+
+
+class NonObjectBodyTests(TestCase):
+
+    def test_throttled_views_reject_non_object_json(self):
+        for name in ('send-otp', 'verify-otp', 'async-send-otp', 'async-verify-otp'):
+            for body in (['9876543210'], '9876543210', 42):
+                with self.subTest(name=name, body=body):
+                    response = self.client.post(reverse(name), body, content_type='application/json')
+
+                    self.assertEqual(response.status_code, 400)
+
+
+class VerifyTokenTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(mobile='9000000001')
+        self.tokens = generate_tokens_for_user(self.user)
+
+    def test_access_token_needs_no_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(tokens.verify_token(self.tokens['access']), (self.user.pk, '9000000001'))
+
+    def test_expired_token_is_rejected(self):
+        token = AccessToken(self.tokens['access'])
+        token.set_exp(lifetime=-datetime.timedelta(seconds=1))
+
+        with self.assertRaises(TokenError):
+            tokens.verify_token(str(token))
+        response = self.client.post(reverse('verify-token'), {'token': str(token)}, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+    @mock.patch.object(tokens.api_settings, 'BLACKLIST_AFTER_ROTATION', True)
+    def test_blacklisted_refresh_token_is_rejected(self):
+        self.assertEqual(tokens.verify_token(self.tokens['refresh']), (self.user.pk, '9000000001'))
+
+        RefreshToken(self.tokens['refresh']).blacklist()
+
+        with self.assertRaisesMessage(TokenError, 'blacklisted'):
+            tokens.verify_token(self.tokens['refresh'])
+
+
+class CachedJWTAuthenticationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(mobile='9000000001', password='secret', is_staff=True)
+        self.token = AccessToken(generate_tokens_for_user(self.user)['access'])
+        self.authentication = CachedJWTAuthentication()
+
+    def test_caches_only_what_authentication_reads(self):
+        self.authentication.get_user(self.token)
+
+        entry = cache.get(user_cache_key(self.user.pk))
+        self.assertNotIn('password', entry)
+        self.assertNotIn(self.user.password, entry.values())
+
+    def test_cached_user_needs_no_query(self):
+        self.authentication.get_user(self.token)
+
+        with self.assertNumQueries(0):
+            user = self.authentication.get_user(self.token)
+
+        self.assertEqual((user.pk, user.mobile, user.is_staff, user.is_active), (self.user.pk, '9000000001', True, True))
+
+    def test_cached_user_still_rejects_deactivated_user(self):
+        self.authentication.get_user(self.token)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.get_user(self.token)
+
+
+class LogTests(TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.logger = logging.getLogger('event_registration.tests')
+        self.addCleanup(log.configure)
+
+    def lines(self):
+        log.flush()
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_debug_records_are_sampled_at_the_default_level(self):
+        log.configure(stream=self.stream, level='INFO', debug_sample_rate=1)
+
+        self.logger.debug('Booking request', extra={'data': {'name': 'Asha Rao', 'age': '25-40', 'gender': 'Female'}})
+
+        [line] = self.lines()
+        self.assertEqual(line['data'], {'name': '***', 'age': '***', 'gender': '***'})
+
+    def test_debug_records_dropped_without_sampling(self):
+        log.configure(stream=self.stream, level='INFO', debug_sample_rate=0)
+
+        self.logger.debug('Booking request')
+        self.logger.info('Kept')
+
+        self.assertEqual([line['message'] for line in self.lines()], ['Kept'])
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork()')
+    def test_forked_child_logs_through_its_own_listener(self):
+        read_end, write_end = os.pipe()
+        with os.fdopen(write_end, 'w') as stream:
+            log.configure(stream=stream)
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    self.logger.warning('From the child')
+                    log.configure(enabled=False)  # stops the listener once it has written the queue out
+                finally:
+                    os._exit(0)
+            os.waitpid(pid, 0)
+            log.configure(enabled=False)
+
+        with os.fdopen(read_end) as output:
+            self.assertIn('From the child', output.read())
+
+
+class BookingValidationTests(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create(mobile='9000000001')
+        self.headers = {'Authorization': f'Bearer {generate_tokens_for_user(user)["access"]}'}
+
+    def book(self, url_name, **changes):
+        data = {**PROFILE, 'event': self.event.pk, 'ticket': self.ticket.pk, 'ticket_quantity': 1,
+                'attending_time': '5PM-7PM', **changes}
+        return self.client.post(reverse(url_name), data, content_type='application/json', headers=self.headers)
+
+    def test_sync_and_async_views_answer_alike(self):
+        for url_name in ('book-tickets', 'async-book-tickets'):
+            with self.subTest(url_name):
+                invalid_booking = self.book(url_name, ticket=0)
+                invalid_profile = self.book(url_name, name='')
+
+                self.assertEqual(invalid_booking.status_code, 207)
+                self.assertIn('ticket', invalid_booking.json()['error_detail'])
+                self.assertEqual(invalid_profile.status_code, 400)
+                self.assertIn('name', invalid_profile.json()['error'])
+
+    def test_sold_out_booking_is_a_booking_error(self):
+        for url_name in ('book-tickets', 'async-book-tickets'):
+            with self.subTest(url_name):
+                response = self.book(url_name, ticket_quantity=11)
+
+                self.assertEqual(response.status_code, 207)
+                self.assertIn('non_field_errors', response.json()['error_detail'])
+
+    def test_rejects_non_object_body(self):
+        for name in ('book-tickets', 'async-book-tickets'):
+            with self.subTest(name):
+                response = self.client.post(reverse(name), [PROFILE], content_type='application/json', headers=self.headers)
+
+                self.assertEqual(response.status_code, 400)
+
+
+class PaymentCallbackTests(TestCase):
+
+    def test_unknown_reference_id_is_not_found(self):
+        for name in ('callback-for-razorpay', 'async-callback-for-razorpay'):
+            for query in ({'razorpay_payment_id': 'pay_1', 'razorpay_payment_link_reference_id': str(uuid.uuid4())},
+                          {'razorpay_payment_id': 'pay_1'}):
+                with self.subTest(name=name, query=query):
+                    self.assertEqual(self.client.get(reverse(name), query).status_code, 404)
+
+
+class LatestEventCacheTests(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create(mobile='9000000002')
+        self.headers = {'Authorization': f'Bearer {generate_tokens_for_user(user)["access"]}'}
+
+    def seats(self, response):
+
+        return response.json()['tickets'][0]['total_tickets_available']
+
+    def get(self, **headers):
+
+        return self.client.get(reverse('latest-event-details'), headers={**self.headers, **headers})
+
+    def test_reservations_keep_the_payload_cached_for_a_while(self):
+        first = self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pending_booking()
+
+        with self.assertNumQueries(0):
+            second = self.get(**{'If-None-Match': first['ETag']})
+
+        self.assertEqual(second.status_code, 304)
+
+    @mock.patch.object(caching, 'LATEST_EVENT_SEATS_DELAY', 0)
+    def test_payload_is_rebuilt_once_its_seats_are_out_of_date(self):
+        first = self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pending_booking()
+        time.sleep(0.01)
+
+        second = self.get(**{'If-None-Match': first['ETag']})
+
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual((self.seats(first), self.seats(second)), (10, 8))
+
+
+@override_settings(RAZORPAY_WEBHOOK_SECRET='whsecret')
+class RazorpayWebhookTests(BookingTestCase):
+
+    def deliver(self, payload, event_id='evt_1', secret='whsecret'):
+        body = json.dumps(payload).encode()
+        signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return self.client.post(reverse('razorpay-webhook'), body, content_type='application/json', headers={
+            'X-Razorpay-Signature': signature, 'X-Razorpay-Event-Id': event_id
+        })
+
+    def paid(self, reference_id, payment_id='pay_1'):
+        return {
+            'event': webhooks.PAYMENT_LINK_PAID,
+            'payload': {
+                'payment': {'entity': {'id': payment_id, 'created_at': int(time.time())}},
+                'payment_link': {'entity': {'reference_id': reference_id}},
+            },
+        }
+
+    def test_rejects_a_bad_signature(self):
+        response = self.deliver(self.paid('ref'), secret='not-the-secret')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(RazorpayWebhookEvent.objects.exists())
+
+    @override_settings(RAZORPAY_WEBHOOK_SECRET=None)
+    def test_refuses_every_delivery_without_a_secret(self):
+        response = self.deliver(self.paid('ref'), secret='')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(RazorpayWebhookEvent.objects.exists())
+
+    def test_rejects_a_body_that_is_not_an_object(self):
+        for payload in ([self.paid('ref')], 'payment_link.paid'):
+            with self.subTest(payload=payload):
+                self.assertEqual(self.deliver(payload).status_code, 400)
+
+        # An object of another shape is stored, and ignored when applied.
+        self.assertEqual(self.deliver({'event': webhooks.PAYMENT_LINK_PAID, 'payload': []}).status_code, 200)
+
+    def test_stores_a_redelivery_once(self):
+        self.assertEqual(self.deliver(self.paid('ref')).status_code, 200)
+        self.assertEqual(self.deliver(self.paid('ref')).status_code, 200)
+
+        self.assertEqual(RazorpayWebhookEvent.objects.count(), 1)
+
+    def test_batch_completes_bookings_once_per_payment(self):
+        event_booking, reservation = self.pending_booking()
+        self.deliver(self.paid(event_booking.formis_payment_id), event_id='evt_1')
+        # The same payment again under another event id, and a delivery for a booking that is gone
+        self.deliver(self.paid(event_booking.formis_payment_id), event_id='evt_2')
+        self.deliver(self.paid(str(uuid.uuid4()), payment_id='pay_2'), event_id='evt_3')
+
+        with self.assertLogs('event_registration.booking', 'WARNING'):
+            self.assertEqual(webhooks.process_batch(), 3)
+
+        event_booking.refresh_from_db()
+        self.assertTrue(event_booking.payment_completed)
+        self.assertEqual(event_booking.vendor_payment_id, 'pay_1')
+        self.assertEqual(TicketReservation.objects.get(pk=reservation.pk).status, TicketReservation.CONFIRMED)
+        self.assertEqual(
+            dict(RazorpayWebhookEvent.objects.values_list('event_id', 'status')),
+            {'evt_1': RazorpayWebhookEvent.PROCESSED, 'evt_2': RazorpayWebhookEvent.IGNORED,
+             'evt_3': RazorpayWebhookEvent.IGNORED}
+        )
+        self.assertEqual(webhooks.process_batch(), 0)
+
+
+class TicketPayloadTests(TestCase):
+
+    def test_round_trip(self):
+        text = ticket_payload.encode(2 ** 40, 7, 3, True)
+
+        self.assertEqual(ticket_payload.decode(text), ticket_payload.TicketPayload(1, 2 ** 40, 7, 3, True))
+        # Scanners may hand over the text lower-cased or with a trailing newline.
+        self.assertEqual(ticket_payload.decode(f'{text.lower()}\n').booking_id, 2 ** 40)
+
+    def test_tampered_payload_is_rejected(self):
+        text = ticket_payload.encode(1, 7, 1, False)
+        raw = bytearray(base64.b32decode(text + '=' * (-len(text) % 8)))
+        raw[1] |= ticket_payload.FLAG_PAID
+        tampered = base64.b32encode(bytes(raw)).decode('ascii').rstrip('=')
+
+        with self.assertRaisesMessage(ticket_payload.InvalidTicketPayload, 'signature'):
+            ticket_payload.decode(tampered)
+
+    def test_signed_with_another_secret_is_rejected(self):
+        with mock.patch.object(ticket_payload, 'SECRET', 'another-secret'):
+            text = ticket_payload.encode(1, 7, 1, True)
+
+        with self.assertRaises(ticket_payload.InvalidTicketPayload):
+            ticket_payload.decode(text)
+
+    def test_unknown_version_is_rejected(self):
+        raw = bytes([2]) + bytes(23)
+
+        with self.assertRaisesMessage(ticket_payload.InvalidTicketPayload, 'version'):
+            ticket_payload.decode(base64.b32encode(raw).decode('ascii'))
+
+    def test_garbage_is_rejected(self):
+        for text in ('', 'not base32!', ticket_payload.encode(1, 7, 1, True)[:-8]):
+            with self.subTest(text=text), self.assertRaises(ticket_payload.InvalidTicketPayload):
+                ticket_payload.decode(text)
+
+
+class CheckInTests(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        checkin._indexes.clear()
+        self.addCleanup(checkin._indexes.clear)
+        admin_user = User.objects.create_superuser(mobile='9000000009', password='secret')
+        self.headers = {'Authorization': f'Bearer {generate_tokens_for_user(admin_user)["access"]}'}
+        self.event_booking, _ = self.pending_booking()
+        EventBooking.objects.filter(pk=self.event_booking.pk).update(payment_completed=True)
+        self.event_booking.refresh_from_db()
+
+    def scan(self, payload):
+
+        return self.client.post(reverse('check-in'), {'payload': payload}, content_type='application/json', headers=self.headers)
+
+    def test_ticket_is_admitted_once(self):
+        payload = ticket_payload.encode_booking(self.event_booking)
+
+        self.assertEqual(self.scan(payload).json()['status'], checkin.ADMITTED)
+        self.assertEqual(self.scan(payload).status_code, 409)
+        self.assertIsNotNone(EventBooking.objects.get(pk=self.event_booking.pk).checked_in_at)
+
+    def test_second_worker_does_not_admit_again(self):
+        # Two processes, each with its own index loaded before either scan.
+        first = checkin.CheckInIndex.from_database(self.event.pk)
+        second = checkin.CheckInIndex.from_database(self.event.pk)
+
+        self.assertEqual(first.check_in(self.event_booking.pk), (checkin.ADMITTED, 2))
+        self.assertEqual(second.check_in(self.event_booking.pk), (checkin.ALREADY_CHECKED_IN, 2))
+
+    def test_unknown_ticket(self):
+        response = self.scan(ticket_payload.encode(self.event_booking.pk + 1000, self.event.pk, 2, True))
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['status'], checkin.NOT_FOUND)
+
+
+class FakeProviderServerTests(TestCase):
+
+    def failures(self, server, mobiles):
+        server.error_rate = 0.3
+        return {mobile for mobile in mobiles if server.draw('POST', '/Messages.json', {}, {'To': mobile}) < server.error_rate}
+
+    def test_seed_fails_the_same_calls_in_any_order(self):
+        mobiles = [f'+91900000{index:04d}' for index in range(200)]
+        with FakeProviderServer(seed=7) as first, FakeProviderServer(seed=7) as second, FakeProviderServer(seed=8) as other:
+            failed = self.failures(first, mobiles)
+
+            self.assertEqual(self.failures(second, reversed(mobiles)), failed)
+            self.assertNotEqual(self.failures(other, mobiles), failed)
+            self.assertTrue(20 < len(failed) < 100)
+
+    def test_retry_of_a_call_is_drawn_afresh(self):
+        with FakeProviderServer(seed=7) as server:
+            draws = {server.draw('GET', '/v1/payments/pay_1', {}, {}) for _ in range(5)}
+
+        self.assertEqual(len(draws), 5)
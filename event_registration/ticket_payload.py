@@ -0,0 +1,88 @@
+import base64
+import hmac
+import struct
+from collections import namedtuple
+from django.conf import settings
+from django.utils.crypto import salted_hmac
+
+# What a ticket QR encodes: a few fixed-width binary fields plus a truncated HMAC,
+# in base32 so the QR can use its compact alphanumeric mode.
+#
+# Version 1, 24 bytes before base32 (39 characters, fits a version 2 QR):
+#   version      1 byte
+#   flags        1 byte    bit 0: payment completed
+#   booking id   8 bytes
+#   event id     4 bytes
+#   quantity     2 bytes
+#   signature    8 bytes   HMAC-SHA256 of the fields above, truncated
+#
+# Gate scanners holding TICKET_PAYLOAD_SECRET (SECRET_KEY by default) can verify a
+# ticket offline. New layouts get a new version number; decode() keeps reading old ones.
+
+SECRET = getattr(settings, 'TICKET_PAYLOAD_SECRET', None)
+
+CURRENT_VERSION = 1
+
+FLAG_PAID = 0x01
+
+FORMATS = {
+    1: (struct.Struct('>BBQIH'), 8),
+}
+
+TicketPayload = namedtuple('TicketPayload', ['version', 'booking_id', 'event_id', 'quantity', 'paid'])
+
+
+class InvalidTicketPayload(ValueError):
+    """
+    Raised for QR contents that are not a genuine ticket payload.
+    """
+
+
+def _signature(fields, length):
+
+    digest = salted_hmac('event_registration.ticket_payload', fields, secret=SECRET or settings.SECRET_KEY,
+                         algorithm='sha256').digest()
+    return digest[:length]
+
+
+def encode(booking_id, event_id, quantity, paid, version=CURRENT_VERSION):
+    """
+    The signed QR text for a ticket.
+    """
+    layout, signature_length = FORMATS[version]
+    fields = layout.pack(version, FLAG_PAID if paid else 0, booking_id, event_id, quantity)
+
+    return base64.b32encode(fields + _signature(fields, signature_length)).decode('ascii').rstrip('=')
+
+
+def encode_booking(event_booking):
+    """
+    The signed QR text for an EventBooking. Only reads the booking's own columns.
+    """
+    return encode(event_booking.pk, event_booking.event_id, event_booking.ticket_quantity, event_booking.payment_completed)
+
+
+def decode(text):
+    """
+    Verify and unpack QR text produced by encode(). Raises InvalidTicketPayload.
+    """
+    try:
+        text = text.strip().upper()
+        raw = base64.b32decode(text + '=' * (-len(text) % 8))
+    except (ValueError, TypeError, AttributeError):
+        raise InvalidTicketPayload('Not a ticket payload.')
+
+    if not raw or raw[0] not in FORMATS:
+        raise InvalidTicketPayload('Unknown ticket payload version.')
+
+    layout, signature_length = FORMATS[raw[0]]
+    if len(raw) != layout.size + signature_length:
+        raise InvalidTicketPayload('Ticket payload has the wrong length.')
+
+    fields, signature = raw[:layout.size], raw[layout.size:]
+    if not hmac.compare_digest(signature, _signature(fields, signature_length)):
+        raise InvalidTicketPayload('Ticket signature does not match.')
+
+    version, flags, booking_id, event_id, quantity = layout.unpack(fields)
+
+    return TicketPayload(version, booking_id, event_id, quantity, bool(flags & FLAG_PAID))
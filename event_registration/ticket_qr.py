@@ -0,0 +1,127 @@
+import base64
+import logging
+import time
+from io import BytesIO
+import qrcode
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from .models import EventBooking
+from .utility import LRUCache
+from . import jobs, metrics, ticket_payload
+
+# Rendered ticket QR codes, as base64 PNG, cached per booking reference. A booking's QR
+# only changes when its payment completes, so the payment state is part of the key
+# and complete_payment() drops the booking's entries.
+#
+# Paid tickets are also rendered ahead of time by a background job when the payment is
+# captured, and stored in EventBooking.ticket_qr_image (the default file storage), so
+# read endpoints only load bytes even for a ticket's first view.
+#
+#   TICKET_QR_CACHE_SIZE    bookings kept in the cache.
+#   TICKET_QR_CACHE_TTL     seconds an entry is kept.
+
+CACHE_SIZE = getattr(settings, 'TICKET_QR_CACHE_SIZE', 4096)
+CACHE_TTL = getattr(settings, 'TICKET_QR_CACHE_TTL', 60 * 60)
+
+_cache = LRUCache(CACHE_SIZE, CACHE_TTL)
+
+logger = logging.getLogger(__name__)
+
+
+def ticket_data(event_booking):
+    """
+    What the QR of a booking's ticket encodes: a compact signed payload, see ticket_payload.py.
+    """
+    return ticket_payload.encode_booking(event_booking)
+
+
+def render_qr_png(data):
+    """
+    Render `data` as a QR code and return the PNG bytes.
+    """
+    started = time.perf_counter()
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill='black', back_color='white')
+
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+
+    metrics.qr_render_duration.observe(time.perf_counter() - started)
+    return buffer.getvalue()
+
+
+def render_qr(data):
+    """
+    Render `data` as a QR code and return the PNG, base64 encoded.
+    """
+    return base64.b64encode(render_qr_png(data)).decode('utf-8')
+
+
+def ticket_qr(event_booking):
+    """
+    The base64 PNG QR of the booking's ticket_data(), rendered at most once per booking and
+    payment state.
+    """
+    renders = _cache.get(event_booking.formis_payment_id)
+    if renders is None:
+        renders = {}
+        _cache.set(event_booking.formis_payment_id, renders)
+
+    img_str = renders.get(event_booking.payment_completed)
+
+    if img_str is None:
+        if event_booking.payment_completed and event_booking.ticket_qr_image:
+            img_str = _load_stored(event_booking)
+        if img_str is None:
+            img_str = render_qr(ticket_data(event_booking))
+        renders[event_booking.payment_completed] = img_str
+
+    return img_str
+
+
+def _load_stored(event_booking):
+
+    try:
+        with event_booking.ticket_qr_image.open('rb') as stored:
+            return base64.b64encode(stored.read()).decode('utf-8')
+    except OSError as e:
+        logger.warning('Stored ticket QR unreadable: %s', e, extra={'reference_id': event_booking.formis_payment_id})
+        return None
+
+
+def invalidate(formis_payment_id):
+    """
+    Forget every QR rendered for a booking.
+    """
+    _cache.pop(formis_payment_id)
+
+
+def prerender_ticket_qr(event_booking_id):
+    """
+    Render a paid booking's ticket QR and store it on the booking.
+    """
+    event_booking = EventBooking.objects.get(pk=event_booking_id)
+
+    if not event_booking.payment_completed:
+        return
+
+    png = render_qr_png(ticket_data(event_booking))
+    event_booking.ticket_qr_image.save(f'{event_booking.formis_payment_id}.png', ContentFile(png), save=False)
+    EventBooking.objects.filter(pk=event_booking.pk).update(ticket_qr_image=event_booking.ticket_qr_image.name)
+
+
+def schedule_prerender(event_booking):
+    """
+    Pre-render a booking's ticket QR in the background once the current transaction commits.
+    """
+    transaction.on_commit(lambda: jobs.submit(prerender_ticket_qr, event_booking.pk))
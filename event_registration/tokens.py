@@ -0,0 +1,59 @@
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, UntypedToken
+from .utility import LRUCache, MOBILE_CLAIM
+
+# Token verification for the frontend's check on every page load: one decode, and the user's
+# mobile number from the token's own claims rather than the database. Access tokens cannot
+# be blacklisted, so a verified one stays valid until it expires and is remembered until then.
+#
+#   TOKEN_VERIFY_CACHE_SIZE    access tokens remembered per process; 0 turns the cache off.
+
+CACHE_SIZE = getattr(settings, 'TOKEN_VERIFY_CACHE_SIZE', 10000)
+
+User = get_user_model()
+
+_verified = LRUCache(CACHE_SIZE) if CACHE_SIZE else None
+
+
+def check_blacklist(token):
+    """
+    The blacklist check TokenVerifySerializer makes, for tokens that can be blacklisted.
+    """
+    if api_settings.BLACKLIST_AFTER_ROTATION and 'rest_framework_simplejwt.token_blacklist' in settings.INSTALLED_APPS:
+        from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+        if BlacklistedToken.objects.filter(token__jti=token.get(api_settings.JTI_CLAIM)).exists():
+            raise TokenError('Token is blacklisted')
+
+
+def verify_token(raw_token):
+    """
+    (user id, mobile) for a valid token. Raises TokenError.
+    """
+    if _verified is not None:
+        cached = _verified.get(raw_token)
+        if cached is not None and cached[2] > time.time():
+            return cached[:2]
+
+    token = UntypedToken(raw_token)
+    is_access = token.get(api_settings.TOKEN_TYPE_CLAIM) == AccessToken.token_type
+    if not is_access:
+        check_blacklist(token)
+
+    user_id = token[api_settings.USER_ID_CLAIM]
+    mobile = token.get(MOBILE_CLAIM)
+
+    if mobile is None:
+        # Issued before tokens carried the mobile number
+        mobile = User.objects.filter(pk=user_id).values_list('mobile', flat=True).first()
+        if mobile is None:
+            raise TokenError('User not found')
+
+    if _verified is not None and is_access:
+        _verified.set(raw_token, (user_id, mobile, token['exp']))
+
+    return user_id, mobile
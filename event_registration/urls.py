@@ -1,7 +1,9 @@
 from django.urls import path
 from .views import (SendOTP, VerifyOTP, LatestActiveEventView, CreateProfileAndBookingView, 
-                    CallbackForPaymentGateway, CheckPaymentStatus, RefreshTokenView, VerifyTokenView, 
-                    LogoutView, UserEventBookingsView)
+                    CallbackForPaymentGateway, RazorpayWebhookView, CheckPaymentStatus, PaymentStatusStreamView, RefreshTokenView, VerifyTokenView, 
+                    LogoutView, UserEventBookingsView, CheckInView, JoinWaitingRoomView, WaitingRoomPositionView)
+from .async_views import (AsyncSendOTP, AsyncVerifyOTP, AsyncCreateProfileAndBookingView,
+                          AsyncCallbackForPaymentGateway)
 
 urlpatterns = [
     path('send-otp', SendOTP.as_view(), name='send-otp'),
@@ -9,9 +11,20 @@ urlpatterns = [
     path('latest-event-details', LatestActiveEventView.as_view(), name='latest-event-details'),
     path('book-tickets', CreateProfileAndBookingView.as_view(), name='book-tickets'),
     path('callback-for-razorpay', CallbackForPaymentGateway.as_view(), name='callback-for-razorpay'),
+    path('razorpay-webhook', RazorpayWebhookView.as_view(), name='razorpay-webhook'),
     path('check-payment-status', CheckPaymentStatus.as_view(), name='check-payment-status'),
+    path('payment-status-stream', PaymentStatusStreamView.as_view(), name='payment-status-stream'),
     path('verify-token', VerifyTokenView.as_view(), name='verify-token'),
     path('refresh-token', RefreshTokenView.as_view(), name='refresh-token'),
     path('logout', LogoutView.as_view(), name='logout'),
     path('user-event-booking', UserEventBookingsView.as_view(), name='user-event-booking'),
+    path('check-in', CheckInView.as_view(), name='check-in'),
+    path('waiting-room', JoinWaitingRoomView.as_view(), name='join-waiting-room'),
+    path('waiting-room/position', WaitingRoomPositionView.as_view(), name='waiting-room-position'),
+
+    # Async versions of the views that wait on a provider; serve them through settings/asgi.py
+    path('async/send-otp', AsyncSendOTP.as_view(), name='async-send-otp'),
+    path('async/verify-otp', AsyncVerifyOTP.as_view(), name='async-verify-otp'),
+    path('async/book-tickets', AsyncCreateProfileAndBookingView.as_view(), name='async-book-tickets'),
+    path('async/callback-for-razorpay', AsyncCallbackForPaymentGateway.as_view(), name='async-callback-for-razorpay'),
 ]
\ No newline at end of file
@@ -1,14 +1,69 @@
 import random
+import threading
+import time
+from collections import OrderedDict
 from rest_framework_simplejwt.tokens import RefreshToken
 
+# Claim carrying the user's mobile number in issued tokens, so verifying one needs no user lookup
+MOBILE_CLAIM = 'mobile'
+
 def generate_otp():
 
     return random.randint(100000, 999999)
 
 def generate_tokens_for_user(user):
     refresh = RefreshToken.for_user(user)
-    
+    # Copied into the access token, and into every access token refreshed from it
+    refresh[MOBILE_CLAIM] = user.mobile
+
     return {
         'refresh': str(refresh),
         'access': str(refresh.access_token),
-    }
\ No newline at end of file
+    }
+
+class LRUCache:
+    """
+    Thread-safe in-process cache holding at most `max_size` entries, each for at most `ttl` seconds.
+    The least recently used entry is evicted first.
+    """
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self.entries[key]
+                return default
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+        return entry[0] if entry else default
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
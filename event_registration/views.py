@@ -1,34 +1,57 @@
 from rest_framework.exceptions import ValidationError
 from django.utils import timezone
-from datetime import timedelta
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
 from django.contrib.auth import get_user_model
-from django.db.models import ObjectDoesNotExist
-from django.db import transaction
-from .models import OTP, Event, Ticket, Profile, EventBooking
-from .serializers import SendOTPSerializer, VerifyOTPSerializer, EventSerializer, TicketSerializer, ProfileSerializer, EventBookingSerializer
-from twilio.rest import Client
-from settings.config import TWILIO_PHONE_NUMBER, TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, RAZORPAY_KEY, RAZORPAY_SECRET
+from django.db.models import ObjectDoesNotExist, Subquery
+from .models import Event, Ticket, EventBooking
+from .serializers import SendOTPSerializer, VerifyOTPSerializer, EventSerializer, TicketSerializer
 from .utility import generate_otp, generate_tokens_for_user
+from .sms import send_sms
+from . import otp_store
+from .otp_store import get_otp_store
+from .gateways import razorpay_client, circuit
+from .ticket_qr import ticket_qr
+from .ticket_payload import decode as decode_ticket_payload, InvalidTicketPayload
+from . import checkin
+from .caching import (get_latest_event, set_latest_event, get_version, cache_is_shared, EVENTS_SCOPE, booking_scope,
+                      user_bookings_scope)
+from .conditional import not_modified_response, with_validators
+from .inventory import with_available, SoldOut
+from .booking import (validate_booking, booking_error_response, create_pending_booking, request_payment_link, attach_payment_link,
+                      abandon_pending_booking, complete_payment, bookings_for_ticket, bookings_for_details, BookingExists)
+from .pubsub import get_hub, payment_channel
+from .streams import payment_status_events
+from .webhooks import verify_signature, record_event, InvalidSignature, WebhookSecretMissing
+from .ratelimit import RateLimitThrottle
+from .tokens import verify_token
+from .authentication import CachedJWTAuthentication
+from . import waiting_room
 import uuid
-import razorpay
 import datetime
+import hashlib
+import logging
 from django.shortcuts import redirect
-import qrcode
-import base64
-from io import BytesIO
-from rest_framework_simplejwt.serializers import TokenVerifySerializer, TokenRefreshSerializer
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework_simplejwt.exceptions import TokenError
-from rest_framework_simplejwt.tokens import UntypedToken
-from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.authentication import JWTAuthentication
 
 User = get_user_model()
 
+logger = logging.getLogger(__name__)
+
+
 class SendOTP(APIView):
+    throttle_classes = [RateLimitThrottle]
+    throttle_scope = 'send-otp'
+    # Most queries one request may run; `manage.py check_query_budgets` fails when exceeded
+    query_budget = 5
 
     def post(self, request):
         try:
@@ -41,17 +64,10 @@ class SendOTP(APIView):
 
                 otp = generate_otp()
 
-                expires_at = timezone.now() + timedelta(minutes=10)
-
-                OTP.objects.create(user=user, otp=otp, created_at=timezone.now(), exprires_at=expires_at, active=True)
+                get_otp_store().issue(user, otp)
 
-                client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-
-                message = client.messages.create(
-                    body=f'Your Kitsa Hydrovibe 2024 code is {otp}',
-                    from_=TWILIO_PHONE_NUMBER,
-                    to=f'+91{mobile_number}',  
-                )
+                # Delivered by the SMS queue's workers, not on this request
+                send_sms(f'+91{mobile_number}', f'Your Kitsa Hydrovibe 2024 code is {otp}')
 
                 data = {
                     'user': {
@@ -65,17 +81,20 @@ class SendOTP(APIView):
             else:
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         except ValidationError as e:
-            print(f'Validation Error: {e} ')
+            logger.info('Validation error: %s', e)
             return Response({'error': 'Validation Error'})
         except ValueError as e:
-            print(f"Value error: {e}")
+            logger.info('Invalid request: %s', e)
             return Response({'error': 'Invalid request'}, status=status.HTTP_400_BAD_REQUEST)
 
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}")
+        except Exception:
+            logger.exception('Unexpected error')
             return Response({'error': 'Something went wrong. Please try again later.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
 class VerifyOTP(APIView):
+    throttle_classes = [RateLimitThrottle]
+    throttle_scope = 'verify-otp'
+    query_budget = 6
 
     def post(self, request):
         serializer = VerifyOTPSerializer(data=request.data)
@@ -85,261 +104,182 @@ class VerifyOTP(APIView):
 
             try:
                 user = User.objects.get(mobile=mobile_number)
-                
-                otp_record = OTP.objects.filter(user=user, active=True).latest('created_at')
-                
-                if otp_record.otp == otp_input:
-                    if otp_record.exprires_at >= timezone.now():
-                        otp_record.active = False
-                        otp_record.save()
-
-                        tokens = generate_tokens_for_user(user)
-                        event_booking = EventBooking.objects.filter(user=user, payment_completed=True).first()
-
-                        if event_booking:
-                            qr_data = {
-                                    'payment_completed': True,
-                                    'event_id': event_booking.event.id,
-                                    'user': event_booking.user.mobile,
-                                    'ticket': event_booking.ticket.name,
-                                    'ticket_quantity': event_booking.ticket_quantity,
-                                    'attending_time': event_booking.attending_time,
-                                    'cab_facility_required': event_booking.cab_facility_required,
-                                    'payment_completed': event_booking.payment_completed,
-                                    'reference_id': event_booking.formis_payment_id
-                                }
-
-                            qr = qrcode.QRCode(
-                                version=1,
-                                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                                box_size=10,
-                                border=4,
-                            )
-                            qr.add_data(qr_data)
-                            qr.make(fit=True)
-
-                            img = qr.make_image(fill='black', back_color='white')
-
-                            # Save the image to a BytesIO object
-                            buffer = BytesIO()
-                            img.save(buffer, format="PNG")
-                            buffer.seek(0)
-
-                            # Encode the image to base64
-                            img_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
-
-                            return Response({"message": "OTP verified successfully!", "ticket": img_str, 'access': tokens['access'],
-                                            'refresh': tokens['refresh']}, status=status.HTTP_200_OK)
-
-                        
-                        return Response({"message": "OTP verified successfully!", "ticket": None, 'access': tokens['access'],
+
+                result = get_otp_store().verify(user, otp_input)
+
+                if result == otp_store.VERIFIED:
+                    tokens = generate_tokens_for_user(user)
+                    event_booking = bookings_for_ticket().filter(user=user, payment_completed=True).first()
+
+                    if event_booking:
+                        img_str = ticket_qr(event_booking)
+
+                        return Response({"message": "OTP verified successfully!", "ticket": img_str, 'access': tokens['access'],
                                         'refresh': tokens['refresh']}, status=status.HTTP_200_OK)
-                    else:
-                        return Response({"error": "OTP has expired."}, status=status.HTTP_400_BAD_REQUEST)
-                else:
-                    return Response({"error": "Invalid OTP."}, status=status.HTTP_400_BAD_REQUEST)
+
+                    
+                    return Response({"message": "OTP verified successfully!", "ticket": None, 'access': tokens['access'],
+                                    'refresh': tokens['refresh']}, status=status.HTTP_200_OK)
+
+                return otp_store.error_response(result, Response)
             except ValidationError as e:
-                print(f'Validation Error: {e} ')
+                logger.info('Validation error: %s', e)
                 return Response({'error': 'Validation Error'})
             
             except User.DoesNotExist:
                 return Response({"error": "User does not exist."}, status=status.HTTP_400_BAD_REQUEST)
-            except OTP.DoesNotExist:
-                return Response({"error": "No active OTP found for this user."}, status=status.HTTP_400_BAD_REQUEST)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class LatestActiveEventView(APIView):
 
     permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication]
+    query_budget = 2
 
     def get(self, request):
         try:
-            event = Event.objects.filter(active=True, event_date__gte=timezone.now().date()).order_by('event_date').first()
-
-            if not event:
-                raise Event.DoesNotExist("No active event available")
-
-            event_data = EventSerializer(event).data
-
-            tickets = Ticket.objects.filter(event=event).distinct()
-
-            if not tickets.exists():
-                raise Ticket.DoesNotExist("No tickets available for this event")
+            version = get_version(EVENTS_SCOPE)
+            today = timezone.now().date().isoformat()
+            cached = get_latest_event()
+
+            if cached is not None:
+                # Seat counts move without a version bump; the payload's build time tells them apart.
+                built_at, data = cached
+                not_modified = not_modified_response(request, version, today, built_at)
+                if not_modified:
+                    return not_modified
+            else:
+                upcoming_events = Event.objects.filter(active=True, event_date__gte=timezone.now().date())
+                next_event = upcoming_events.order_by('event_date').values('pk')[:1]
+
+                # The event, its tickets and their seat counts in one query
+                tickets = list(
+                    with_available(Ticket.objects.filter(event=Subquery(next_event)))
+                    .select_related('event')
+                    .order_by('pk')
+                )
 
-            total_available_tickets = sum(ticket.total_tickets_available for ticket in tickets)
+                if not tickets:
+                    if not upcoming_events.exists():
+                        raise Event.DoesNotExist("No active event available")
+                    raise Ticket.DoesNotExist("No tickets available for this event")
 
-            if total_available_tickets == 0:
-                raise Ticket.DoesNotExist("No tickets available for this event")
+                total_available_tickets = sum(ticket.available for ticket in tickets)
 
-            ticket_data = TicketSerializer(tickets, many=True).data
+                if total_available_tickets == 0:
+                    raise Ticket.DoesNotExist("No tickets available for this event")
 
-            data = {
-                'event': event_data,
-                'tickets': ticket_data
-            }
+                data = {
+                    'event': EventSerializer(tickets[0].event).data,
+                    'tickets': TicketSerializer(tickets, many=True).data
+                }
+                built_at = set_latest_event(data)
 
-            return Response(data, status=status.HTTP_200_OK)
+            return with_validators(Response(data, status=status.HTTP_200_OK), version, today, built_at)
         except ValidationError as e:
-            print(f'Validation Error: {e} ')
+            logger.info('Validation error: %s', e)
             return Response({'error': 'Validation Error'})
 
         except Event.DoesNotExist as e:
-            print(f"Event not found: {e}")
+            logger.info('Event not found: %s', e)
             return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
 
         except Ticket.DoesNotExist as e:
-            print(f"Ticket not found: {e}")
+            logger.info('Ticket not found: %s', e)
             return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
 
         except ValueError as e:
-            print(f"Value error: {e}")
+            logger.info('Invalid request: %s', e)
             return Response({'error': 'Invalid request'}, status=status.HTTP_400_BAD_REQUEST)
 
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}")
+        except Exception:
+            logger.exception('Unexpected error')
             return Response({'error': 'Something went wrong. Please try again later.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 class CreateProfileAndBookingView(APIView):
     permission_classes = [IsAuthenticated]
-    
-    @transaction.atomic
+    authentication_classes = [CachedJWTAuthentication]
+    throttle_classes = [RateLimitThrottle]
+    throttle_scope = 'book-tickets'
+    query_budget = 17
+
     def post(self, request):
         try:
             user = request.user  # Fetch the user from the token
 
-            print('------------ request data ----------- ', request.data)
-
-            profile_data = {
-                'name': request.data.get('name'),
-                'age': request.data.get('age'),
-                'mobile': request.data.get('mobile'),
-                'email': request.data.get('email'),
-                'gender': request.data.get('gender')
-            }
-
-            booking_data = {
-                'event': request.data.get('event'), 
-                'ticket': request.data.get('ticket'),  
-                'ticket_quantity': request.data.get('ticket_quantity'),
-                'attending_time': request.data.get('attending_time'),
-                'cab_facility_required': request.data.get('cab_facility_required', False)
-            }
+            logger.debug('Booking request', extra={'user_id': user.id, 'data': request.data})
 
-            print('Profile serializer...')
-
-            # Validate and save Profile
-            profile_serializer = ProfileSerializer(data=profile_data)
-            profile_serializer.is_valid(raise_exception=True)
-            print('Profile serializer done...')
-            # No need to fetch user from the database using mobile number, as user is already available
-            profile, created = Profile.objects.get_or_create(user=user, defaults=profile_serializer.validated_data)
-            print('Profile serializer created...')
-            # Validate and save EventBooking
-            print('booking serializer...')
-            booking_serializer = EventBookingSerializer(data=booking_data)
-            
             try:
-                booking_serializer.is_valid(raise_exception=True)
+                profile_data, booking_data = validate_booking(request.data)
             except ValidationError as e:
-                # Print the exception message
-                print("Validation Error:", e)
-                # Optionally, you can print the detailed error dictionary
-                print("Detailed Error:", e.detail)
-                return Response({'error_detail': e.detail, 'error_validation': e}, status=status.HTTP_207_MULTI_STATUS)
-            print('Profile serializer done...')
-
-            ticket_price = booking_serializer.validated_data['ticket'].price
-            ticket_quantity = booking_serializer.validated_data['ticket_quantity']
-            ticket_amount = ticket_price * ticket_quantity
-            print('Ticket amount...')
+                logger.info('Booking validation error', extra={'errors': e.detail})
+                return booking_error_response(e, Response)
+
+            ticket_amount = booking_data['ticket'].price * booking_data['ticket_quantity']
             reference_id = str(uuid.uuid4())
 
-            # Create payment link
+            # Phase 1: short local transaction saving the profile, the seat hold and a pending booking
+            try:
+                event_booking, reservation = create_pending_booking(
+                    user, profile_data, booking_data, reference_id, ticket_amount
+                )
+            except SoldOut as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            except BookingExists as e:
+                return Response(
+                    {'error': str(e), 'id': e.event_booking.formis_payment_id, 'payment_link': e.event_booking.payment_link},
+                    status=status.HTTP_409_CONFLICT
+                )
+
+            # Phase 2: create payment link, outside of any transaction
             try:
                 scheme = request.scheme
                 host = request.get_host()
                 full_url = f"{scheme}://{host}"
-                razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY, RAZORPAY_SECRET))
-                payment_details = razorpay_client.payment_link.create({
-                                "amount": ticket_amount * 100,
-                                "currency": "INR",
-                                "description": "For Hydrovibe 2024",
-                                "customer": {
-                                    "name": profile_serializer.validated_data['name'],
-                                    "contact": profile_serializer.validated_data['mobile']
-                                },
-                                "notify": {
-                                    "sms": True
-                                },
-                                "reminder_enable": True,
-                                "notes": {
-                                    "event_name": "Hydrovibe 2024"
-                                },
-                                "reference_id": reference_id,
-                                "callback_url": f"{full_url}/event-registration/callback-for-razorpay",
-                                "callback_method": "get"
-                                })
+                with circuit('razorpay'):
+                    payment_details = request_payment_link(
+                        razorpay_client(),
+                        event_booking,
+                        customer={
+                            "name": profile_data['name'],
+                            "contact": profile_data['mobile']
+                        },
+                        callback_url=f"{full_url}/event-registration/callback-for-razorpay",
+                        expire_by=int(reservation.expires_at.timestamp())
+                    )
             except Exception as e:
-                print('Exception in creating payment link : ', e)
+                logger.warning('Payment link creation failed', exc_info=True, extra={'reference_id': reference_id})
+                abandon_pending_booking(razorpay_client(), event_booking, e)
                 return Response({'error': 'Failed to create payment link'}, status=status.HTTP_502_BAD_GATEWAY)
 
-            # Save EventBooking
-            event_booking = EventBooking(
-                event=booking_serializer.validated_data['event'],
-                user=user,
-                ticket=booking_serializer.validated_data['ticket'],
-                ticket_quantity=booking_serializer.validated_data['ticket_quantity'],
-                attending_time=booking_serializer.validated_data['attending_time'],
-                cab_facility_required=booking_serializer.validated_data.get('cab_facility_required', False),
-                location=booking_serializer.validated_data.get('location', ''),
-                address=booking_serializer.validated_data.get('address', ''),
-                formis_payment_id=reference_id,
-                vendor_payment_id=payment_details.get('id'),
-                payment_amount=ticket_amount,
-                payment_link=payment_details.get('short_url')
-            )
-            event_booking.save()
+            payment_link = attach_payment_link(event_booking, payment_details)
 
             return Response(
                 {
                     'id': reference_id,
-                    'payment_link': payment_details.get('short_url')
+                    'payment_link': payment_link
                 },
                 status=status.HTTP_201_CREATED
             )
 
-        except ValidationError as e:
-            error_details = e.detail
-            unique_error_messages = []
-
-            if 'event' in error_details and 'unique' in error_details['event'][0].code:
-                unique_error_messages.append('An event booking with this event already exists.')
-            
-            if 'ticket' in error_details and 'unique' in error_details['ticket'][0].code:
-                unique_error_messages.append('An event booking with this ticket already exists.')
-
-            if unique_error_messages:
-                return Response({'error': unique_error_messages}, status=status.HTTP_400_BAD_REQUEST)
-            print('Validation Error --- ', e)
-            return Response({'error': error_details}, status=status.HTTP_400_BAD_REQUEST)
-
         except ObjectDoesNotExist as e:
-            print('Object does not exist --- ', e)
+            logger.info('Event or ticket not found: %s', e)
             return Response({'error': 'Event or ticket not found'}, status=status.HTTP_404_NOT_FOUND)
 
         except ValueError as e:
-            print('Value Error --- ', e)
+            logger.info('Invalid request: %s', e)
             return Response({'error': 'Invalid request'}, status=status.HTTP_400_BAD_REQUEST)
 
-        except Exception as e:
-            print('Internal server error --- ', e)
+        except Exception:
+            logger.exception('Unexpected error')
             return Response({'error': 'Something went wrong. Please try again later.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     
 
 class CallbackForPaymentGateway(APIView):
+    query_budget = 5
 
     def get(self, request):
         try:
@@ -349,73 +289,93 @@ class CallbackForPaymentGateway(APIView):
             razorpay_payment_link_reference_id = request.query_params.get('razorpay_payment_link_reference_id')
 
             event_booking = EventBooking.objects.filter(formis_payment_id = razorpay_payment_link_reference_id).first()
+            if event_booking is None:
+                logger.info('Callback for unknown booking', extra={'reference_id': razorpay_payment_link_reference_id})
+                return Response({'error': 'Booking not found'}, status=status.HTTP_404_NOT_FOUND)
 
-            razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY, RAZORPAY_SECRET))
+            if event_booking.payment_completed:
+                # The webhook got here first
+                return redirect('https://heyformis.com/hydrovibe2024/tickets')
 
-            razorpay_payment_status = razorpay_client.payment.fetch(razorpay_payment_id)
+            with circuit('razorpay'):
+                razorpay_payment_status = razorpay_client().payment.fetch(razorpay_payment_id)
 
             captured = razorpay_payment_status.get('captured')
 
             if captured:
-                event_booking.vendor_payment_id = razorpay_payment_id
-                event_booking.payment_completed = True
-                event_booking.payment_completed_at = datetime.datetime.fromtimestamp(razorpay_payment_status.get('created_at'))
-                event_booking.save()
+                paid_at = datetime.datetime.fromtimestamp(razorpay_payment_status.get('created_at'), tz=datetime.timezone.utc)
+
+                if not complete_payment(event_booking, razorpay_payment_id, paid_at):
+                    logger.error('Payment captured after reservation expired and tickets sold out', extra={'reference_id': event_booking.formis_payment_id})
             else:
 
-                print(razorpay_payment_status)
+                logger.info('Payment not captured', extra={'reference_id': event_booking.formis_payment_id, 'payment_status': razorpay_payment_status.get('status')})
 
             return redirect('https://heyformis.com/hydrovibe2024/tickets')
         except ValueError as e:
-            print(f"Value error: {e}")
+            logger.info('Invalid request: %s', e)
             return Response({'error': 'Invalid request'}, status=status.HTTP_400_BAD_REQUEST)
 
-        except Exception as e:
-            print(f"Unexpected error: {e}")
+        except Exception:
+            logger.exception('Unexpected error')
             return Response({'error': 'Something went wrong. Please try again later.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
 
+class RazorpayWebhookView(APIView):
+    """
+    Razorpay posts payment events here. Verified deliveries go into the webhook inbox and are
+    applied by `manage.py process_razorpay_webhooks`, so this only has to store them.
+    """
+    authentication_classes = []
+    query_budget = 3
+
+    def post(self, request):
+        try:
+            body = request.body
+            verify_signature(body, request.headers.get('X-Razorpay-Signature'))
+            record_event(body, request.headers.get('X-Razorpay-Event-Id') or hashlib.sha256(body).hexdigest())
+
+            return Response({'status': 'ok'}, status=status.HTTP_200_OK)
+
+        except InvalidSignature:
+            return Response({'error': 'Invalid signature'}, status=status.HTTP_400_BAD_REQUEST)
+
+        except WebhookSecretMissing as e:
+            # Razorpay retries the delivery, so nothing is lost once the secret is set.
+            logger.error('Webhook refused: %s', e)
+            return Response({'error': 'Webhooks are not configured'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        except ValueError as e:
+            logger.info('Invalid request: %s', e)
+            return Response({'error': 'Invalid request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception:
+            logger.exception('Unexpected error')
+            return Response({'error': 'Something went wrong. Please try again later.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 class CheckPaymentStatus(APIView):
 
     permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication]
+    query_budget = 2
 
     def get(self, request):
         try:
 
             reference_id = request.query_params.get('reference_id')
 
-            event_booking = EventBooking.objects.filter(formis_payment_id = reference_id).first()
-
-            
-
-            qr_data = {
-                    'payment_completed': True,
-                    'event_id': event_booking.event.id,
-                    'user': event_booking.user.mobile,
-                    'ticket': event_booking.ticket.name,
-                    'ticket_quantity': event_booking.ticket_quantity,
-                    'attending_time': event_booking.attending_time,
-                    'cab_facility_required': event_booking.cab_facility_required,
-                    'payment_completed': event_booking.payment_completed,
-                    'reference_id': event_booking.formis_payment_id
-                }
+            version = get_version(booking_scope(reference_id))
+            # A stamp kept per worker may not have seen the payment yet; only a shared one can vouch for a copy.
+            not_modified = cache_is_shared() and not_modified_response(request, version, reference_id)
+            if not_modified:
+                return not_modified
 
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(qr_data)
-            qr.make(fit=True)
+            event_booking = bookings_for_ticket().filter(formis_payment_id = reference_id).first()
+            if event_booking is None:
+                return Response({'error': 'Booking not found'}, status=status.HTTP_404_NOT_FOUND)
 
-            img = qr.make_image(fill='black', back_color='white')
-
-            buffer = BytesIO()
-            img.save(buffer, format="PNG")
-            buffer.seek(0)
-
-            img_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
+            img_str = ticket_qr(event_booking)
 
             if event_booking.payment_completed:
                 data = {
@@ -429,35 +389,70 @@ class CheckPaymentStatus(APIView):
                     'ticket': img_str
                 }
 
-            return Response(data=data, status=status.HTTP_200_OK)
+            return with_validators(Response(data=data, status=status.HTTP_200_OK), version, reference_id)
         except ValueError as e:
-            print(f"Value error: {e}")
+            logger.info('Invalid request: %s', e)
             return Response({'error': 'Invalid request'}, status=status.HTTP_400_BAD_REQUEST)
 
-        except Exception as e:
-            print(f"Unexpected error: {e}")
+        except Exception:
+            logger.exception('Unexpected error')
             return Response({'error': 'Something went wrong. Please try again later.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
 
-class VerifyTokenView(APIView):
-    def post(self, request):
-        serializer = TokenVerifySerializer(data=request.data)
-        
+
+class PaymentStatusStreamView(View):
+    """
+    Pushes a booking's payment status as server-sent events instead of having the client poll
+    CheckPaymentStatus. EventSource cannot set headers, so the access token may also be sent as ?token=.
+    """
+    query_budget = 1
+
+    async def get(self, request):
+        reference_id = request.GET.get('reference_id')
+        if not reference_id:
+            return JsonResponse({'error': 'Invalid request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        token = request.GET.get('token')
+        header = request.headers.get('Authorization', '')
+        if header.startswith('Bearer '):
+            token = header[len('Bearer '):]
+
         try:
-            serializer.is_valid(raise_exception=True)
-            token = request.data.get('token')
+            user_id = AccessToken(token)['user_id']
+        except (TokenError, KeyError):
+            return JsonResponse({'error': 'Token is invalid or expired'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        # Subscribe before reading the booking so a payment landing in between is not missed.
+        hub = get_hub()
+        queue = hub.subscribe(payment_channel(reference_id))
+
+        paid = await EventBooking.objects.filter(formis_payment_id=reference_id, user_id=user_id).values_list(
+            'payment_completed', flat=True
+        ).afirst()
+        if paid is None:
+            hub.unsubscribe(payment_channel(reference_id), queue)
+            return JsonResponse({'error': 'Booking not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        response = StreamingHttpResponse(payment_status_events(reference_id, queue, paid), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
 
-            decoded_token = UntypedToken(token)
-            user_id = decoded_token['user_id']
+class VerifyTokenView(APIView):
+    query_budget = 0
 
-            # Fetch user from the database
-            user = User.objects.get(id=user_id)
-            return Response({'message': 'Token is valid', 'mobile': user.mobile}, status=status.HTTP_200_OK)
+    def post(self, request):
+        try:
+            # Decoded once; the mobile number comes from the token, not the database
+            user_id, mobile = verify_token(str(request.data.get('token', '')))
+            return Response({'message': 'Token is valid', 'mobile': mobile}, status=status.HTTP_200_OK)
         
         except Exception as e:
             return Response({'error': 'Token is invalid or expired'}, status=status.HTTP_401_UNAUTHORIZED)
         
 class RefreshTokenView(APIView):
+    query_budget = 1
+
     def post(self, request):
         serializer = TokenRefreshSerializer(data=request.data)
 
@@ -470,6 +465,8 @@ class RefreshTokenView(APIView):
         
 class LogoutView(APIView):
     permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication]
+    query_budget = 7
 
     def post(self, request):
         try:
@@ -488,30 +485,36 @@ class LogoutView(APIView):
             return Response({'message': 'Successfully logged out'}, status=status.HTTP_205_RESET_CONTENT)
 
         except ObjectDoesNotExist as e:
-            print(f"Object not found: {e}")
+            logger.info('Object not found: %s', e)
             return Response({'error': 'Invalid tokens'}, status=status.HTTP_400_BAD_REQUEST)
 
-        except Exception as e:
-            print(f"Unexpected error: {e}")
+        except Exception:
+            logger.exception('Unexpected error')
             return Response({'error': 'Something went wrong. Please try again later.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
 class UserEventBookingsView(APIView):
     permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication]
+    query_budget = 2
 
     def get(self, request):
         try:
             user = request.user
 
-            event_booking = EventBooking.objects.filter(user=user).first()
+            version = get_version(user_bookings_scope(user.id))
+            not_modified = cache_is_shared() and not_modified_response(request, version, user.id)
+            if not_modified:
+                return not_modified
+
+            # The booking, its ticket, user and profile in one query
+            event_booking = bookings_for_details().filter(user=user).first()
 
             if not event_booking:
                 return Response({'message': 'No bookings found for this user.'}, status=status.HTTP_404_NOT_FOUND)
-            
-            booking_serializer = EventBookingSerializer(event_booking)
 
             booking_data = {
                     'payment_completed': event_booking.payment_completed,
-                    'event_id': event_booking.event.id,
+                    'event_id': event_booking.event_id,
                     'user': event_booking.user.mobile,
                     'ticket': event_booking.ticket.name,
                     'ticket_quantity': event_booking.ticket_quantity,
@@ -520,34 +523,95 @@ class UserEventBookingsView(APIView):
                     'payment_completed': event_booking.payment_completed,
                     'reference_id': event_booking.formis_payment_id,
                     'payment_link': event_booking.payment_link,
-                    'name': request.user.profile.name
+                    'name': event_booking.user.profile.name
                 }
 
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(booking_data)
-            qr.make(fit=True)
+            img_str = ticket_qr(event_booking)
 
-            img = qr.make_image(fill='black', back_color='white')
+            return with_validators(Response({'data': booking_data, 'qr': img_str}, status=status.HTTP_200_OK), version, user.id)
 
-            buffer = BytesIO()
-            img.save(buffer, format="PNG")
-            buffer.seek(0)
+        except ObjectDoesNotExist as e:
+            logger.info('Object not found: %s', e)
+            return Response({'error': 'Event booking not found'}, status=status.HTTP_404_NOT_FOUND)
 
-            img_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        except Exception:
+            logger.exception('Unexpected error')
+            return Response({'error': 'Something went wrong. Please try again later.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-            
-            return Response({'data': booking_data, 'qr': img_str}, status=status.HTTP_200_OK)
+class CheckInView(APIView):
+    """
+    Gate scanners post the scanned QR text; answers whether to let the holder in.
+    """
+    permission_classes = [IsAdminUser]
+    # Not the cached user: a revoked is_staff must take effect at once on every worker.
+    authentication_classes = [JWTAuthentication]
+    # The user, the conditional UPDATE admitting the ticket, and on a process's first scan the event's index
+    query_budget = 3
 
-        except ObjectDoesNotExist as e:
-            print(f"Object not found: {e}")
-            return Response({'error': 'Event booking not found'}, status=status.HTTP_404_NOT_FOUND)
+    def post(self, request):
+        try:
+            payload = decode_ticket_payload(request.data.get('payload') or '')
+        except InvalidTicketPayload as e:
+            return Response({'status': 'invalid', 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        except Exception as e:
-            print(f"Unexpected error: {e}")
-            return Response({'error': 'Something went wrong. Please try again later.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+        try:
+            result, quantity = checkin.check_in(payload)
+
+            if result == checkin.NOT_FOUND:
+                return Response({'status': result, 'error': 'No paid booking for this ticket.'}, status=status.HTTP_404_NOT_FOUND)
+
+            data = {
+                'status': result,
+                'booking_id': payload.booking_id,
+                'ticket_quantity': quantity
+            }
+
+            if result == checkin.ALREADY_CHECKED_IN:
+                return Response(data, status=status.HTTP_409_CONFLICT)
+
+            return Response(data, status=status.HTTP_200_OK)
+
+        except Exception:
+            logger.exception('Unexpected error')
+            return Response({'error': 'Something went wrong. Please try again later.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class JoinWaitingRoomView(APIView):
+    """
+    Takes a place in the waiting room for the user, to book once its turn comes. A pass of
+    theirs that is still valid, sent in X-Waiting-Room-Token, keeps its place instead of going
+    to the back.
+    """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication]
+    throttle_classes = [RateLimitThrottle]
+    throttle_scope = 'waiting-room'
+    query_budget = 1
+
+    def post(self, request):
+        token = request.headers.get(waiting_room.HEADER)
+        try:
+            admit_at = waiting_room.admission_time(token, request.user.id)
+        except waiting_room.InvalidPass:
+            token, admit_at = waiting_room.join(request.user.id)
+
+        return Response({'token': token, **waiting_room.status(admit_at)}, status=status.HTTP_200_OK)
+
+
+class WaitingRoomPositionView(View):
+    """
+    Where a waiting room pass stands. Polled by everyone waiting, so it reads nothing but the
+    pass: no authentication, throttling, cache or database.
+    """
+    query_budget = 0
+
+    def get(self, request):
+        try:
+            admit_at = waiting_room.pass_time(request.headers.get(waiting_room.HEADER) or request.GET.get('token'))
+        except waiting_room.InvalidPass as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_403_FORBIDDEN)
+
+        response = JsonResponse(waiting_room.status(admit_at))
+        response['Cache-Control'] = 'no-store'
+        return response
@@ -0,0 +1,213 @@
+import math
+import time
+from functools import cache as memoize
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core import checks, signing
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from .caching import cache_is_shared
+
+# A virtual waiting room in front of booking, so a ticket launch reaches the database and
+# Razorpay at a rate they can sustain instead of all at once.
+#
+# Joining takes the next place in one queue shared by every worker: an incr of a counter in
+# the Django cache, and a read of when the queue's schedule started. That needs a cache every
+# worker shares (Redis, Memcached, the database); with a per-process one each worker would run
+# its own queue, so `manage.py check` fails and the middleware refuses to load. Place n is admitted n/RATE
+# seconds after that start. The time goes into a signed pass the client keeps and sends with
+# X-Waiting-Room-Token, so the server holds nothing per client, and checking a pass or
+# reporting its position is a signature check and some arithmetic. A pass is made out to the
+# user who joined, and only lets the bearer of that user's access token book, so one place
+# cannot be handed round. When nobody is waiting,
+# the schedule restarts at the next arrival, so a quiet spell does not bank admissions for
+# the next rush. Workers joining the same instant the schedule restarts may share an
+# admission time, so the rate is approximate.
+#
+# Add 'event_registration.waiting_room.waiting_room_middleware' to MIDDLEWARE to hold
+# book-tickets (sync and async) to the pass's time.
+#
+#   WAITING_ROOM_ENABLED          False admits everyone on joining, and the middleware stands aside.
+#   WAITING_ROOM_RATE             admissions per second; what the booking path sustains (measure
+#                                 it with manage.py load_test).
+#   WAITING_ROOM_ADMISSION_TTL    seconds after its turn a pass still lets its holder book.
+
+ENABLED = getattr(settings, 'WAITING_ROOM_ENABLED', False)
+RATE = getattr(settings, 'WAITING_ROOM_RATE', 10)
+ADMISSION_TTL = getattr(settings, 'WAITING_ROOM_ADMISSION_TTL', 600)
+
+HEADER = 'X-Waiting-Room-Token'
+GUARDED_URLS = ('book-tickets', 'async-book-tickets')
+
+SALT = 'event_registration.waiting_room'
+SLOTS_KEY = 'waiting-room:slots'
+START_KEY = 'waiting-room:start'
+
+
+class InvalidPass(Exception):
+    pass
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    The queue is only one queue if every worker reads the same cache.
+    """
+    if not ENABLED or cache_is_shared():
+        return []
+
+    return [checks.Error(
+        'WAITING_ROOM_ENABLED needs a cache shared by every worker process.',
+        hint=f'The default cache is a {type(caches["default"]).__name__}; configure Redis, Memcached or the database cache in CACHES.',
+        id='event_registration.E001',
+    )]
+
+
+def _take_slot():
+    try:
+        return cache.incr(SLOTS_KEY)
+    except ValueError:
+        if cache.add(SLOTS_KEY, 1, None):
+            return 1
+        return cache.incr(SLOTS_KEY)
+
+
+def join(user_id, now=None):
+    """
+    A new place in the queue for the user `user_id`: (signed pass, time it is admitted at).
+    """
+    now = time.time() if now is None else now
+
+    if not ENABLED:
+        admit_at = now
+    else:
+        slot = _take_slot()
+        start = cache.get(START_KEY)
+        if start is None or start + slot / RATE < now:
+            # Everyone ahead has been admitted: this arrival goes in now, and the schedule restarts from it.
+            start = now - slot / RATE
+            cache.set(START_KEY, start, None)
+        admit_at = start + slot / RATE
+
+    admit_at = round(admit_at, 3)
+    return signing.dumps({'at': admit_at, 'user': user_id}, salt=SALT), admit_at
+
+
+def _load(token, now):
+    now = time.time() if now is None else now
+
+    try:
+        payload = signing.loads(token or '', salt=SALT)
+        admit_at = payload['at']
+    except (signing.BadSignature, KeyError, TypeError):
+        raise InvalidPass('Invalid waiting room pass')
+
+    if admit_at + ADMISSION_TTL < now:
+        raise InvalidPass('Waiting room pass has expired')
+
+    return payload
+
+
+def pass_time(token, now=None):
+    """
+    When the pass `token` is admitted, whoever holds it. Raises InvalidPass if it is forged
+    or has expired.
+    """
+    return _load(token, now)['at']
+
+
+def admission_time(token, user_id, now=None):
+    """
+    When the pass `token` lets the user `user_id` book. Raises InvalidPass if it is forged,
+    has expired, or was made out to another user.
+    """
+    payload = _load(token, now)
+
+    if user_id is None or payload.get('user') != user_id:
+        raise InvalidPass('Waiting room pass belongs to another user')
+
+    return payload['at']
+
+
+def status(admit_at, now=None):
+    """
+    {'admitted', 'position', 'wait_seconds'} for a pass admitted at `admit_at`.
+    """
+    now = time.time() if now is None else now
+    wait = max(admit_at - now, 0.0)
+
+    return {
+        'admitted': not wait,
+        'position': math.ceil(wait * RATE),
+        'wait_seconds': round(wait, 1),
+    }
+
+
+@memoize
+def _guarded_paths():
+    # Resolved on first use: the URLconf may not be loadable yet when middleware is built.
+    return frozenset(reverse(name) for name in GUARDED_URLS)
+
+
+def _user_id(request):
+    """
+    The user named by the request's access token, or None. Only the token's signature is
+    checked, without a query; the view still authenticates the request in full.
+    """
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = header and authentication.get_raw_token(header)
+    if not raw_token:
+        return None
+
+    try:
+        return authentication.get_validated_token(raw_token)[api_settings.USER_ID_CLAIM]
+    except (InvalidToken, KeyError):
+        return None
+
+
+def _refusal(request):
+    """
+    The response turning `request` away, or None if it may go on to the view.
+    """
+    if request.method != 'POST' or request.path not in _guarded_paths():
+        return None
+
+    try:
+        admit_at = admission_time(request.headers.get(HEADER), _user_id(request))
+    except InvalidPass as e:
+        return JsonResponse({'error': str(e), 'waiting_room': reverse('join-waiting-room')}, status=403)
+
+    state = status(admit_at)
+    if state['admitted']:
+        return None
+
+    response = JsonResponse({'error': 'Not your turn yet', **state}, status=429)
+    response['Retry-After'] = str(math.ceil(state['wait_seconds']))
+    return response
+
+
+@sync_and_async_middleware
+def waiting_room_middleware(get_response):
+    """
+    Turns away bookings without a pass whose turn has come.
+    """
+    if not ENABLED:
+        raise MiddlewareNotUsed
+    if not cache_is_shared():
+        raise ImproperlyConfigured('WAITING_ROOM_ENABLED needs a cache shared by every worker process.')
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            return _refusal(request) or await get_response(request)
+    else:
+        def middleware(request):
+            return _refusal(request) or get_response(request)
+
+    return middleware
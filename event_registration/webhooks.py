@@ -0,0 +1,141 @@
+import datetime
+import hashlib
+import hmac
+import json
+import logging
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import RazorpayWebhookEvent
+from .booking import complete_payments
+
+# Razorpay webhooks, received into an inbox table and applied in batches.
+#
+# The endpoint only checks the signature and inserts the delivery, so Razorpay gets its
+# 200 at once however many captures arrive together. `manage.py process_razorpay_webhooks`
+# then claims pending deliveries in batches, keeps one per payment, and marks all of that
+# batch's bookings paid in a single transaction. Redeliveries share an event id and are
+# dropped on insert.
+#
+# Configure the webhook for `payment_link.paid`; other events are stored and ignored.
+#
+#   RAZORPAY_WEBHOOK_SECRET        the secret set on the webhook in the Razorpay dashboard.
+#                                  Without it every delivery is refused.
+#   RAZORPAY_WEBHOOK_BATCH_SIZE    deliveries applied per transaction.
+
+BATCH_SIZE = getattr(settings, 'RAZORPAY_WEBHOOK_BATCH_SIZE', 500)
+
+PAYMENT_LINK_PAID = 'payment_link.paid'
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidSignature(Exception):
+    """
+    Raised for a webhook body whose X-Razorpay-Signature does not match.
+    """
+
+
+class WebhookSecretMissing(Exception):
+    """
+    Raised for every delivery while RAZORPAY_WEBHOOK_SECRET is not set.
+    """
+
+
+def verify_signature(body, signature):
+    """
+    Check the HMAC-SHA256 Razorpay signs each webhook body with.
+    Raises InvalidSignature, or WebhookSecretMissing when there is no secret to check it with.
+    """
+    secret = getattr(settings, 'RAZORPAY_WEBHOOK_SECRET', None)
+    if not secret:
+        raise WebhookSecretMissing('RAZORPAY_WEBHOOK_SECRET is not set.')
+
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+    if not signature or not hmac.compare_digest(expected, signature):
+        raise InvalidSignature('Webhook signature does not match.')
+
+
+def record_event(body, event_id):
+    """
+    Store one verified delivery as pending. A redelivery of a stored event is a no-op.
+    Raises ValueError for a body that is not a JSON object.
+    """
+    payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError('Webhook body is not a JSON object.')
+
+    payment = _entity(payload, 'payment')
+    payment_link = _entity(payload, 'payment_link')
+
+    RazorpayWebhookEvent.objects.bulk_create([
+        RazorpayWebhookEvent(
+            event_id=event_id,
+            event=payload.get('event', ''),
+            payment_id=payment.get('id'),
+            reference_id=payment_link.get('reference_id'),
+            payload=payload
+        )
+    ], ignore_conflicts=True)
+
+
+def _entity(payload, name):
+    """
+    payload['payload'][name]['entity'], or {} where any part of that is missing or not an object.
+    """
+    entity = payload.get('payload')
+    for key in (name, 'entity'):
+        entity = entity.get(key) if isinstance(entity, dict) else None
+
+    return entity if isinstance(entity, dict) else {}
+
+
+def process_batch(batch_size=BATCH_SIZE):
+    """
+    Apply one batch of pending deliveries. Returns how many deliveries were handled.
+    """
+    with transaction.atomic():
+        batch = list(
+            RazorpayWebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(status=RazorpayWebhookEvent.PENDING)
+            .order_by('received_at')
+            .only('pk', 'event', 'payment_id', 'reference_id', 'payload')[:batch_size]
+        )
+
+        if not batch:
+            return 0
+
+        payments = {}
+        seen_payments = set()
+        ignored = set()
+
+        for event in batch:
+            captured = event.event == PAYMENT_LINK_PAID and event.payment_id and event.reference_id
+            if not captured or event.payment_id in seen_payments:
+                ignored.add(event.pk)
+                continue
+
+            seen_payments.add(event.payment_id)
+            paid_at = _entity(event.payload, 'payment').get('created_at')
+            payments[event.reference_id] = (
+                event.payment_id,
+                datetime.datetime.fromtimestamp(paid_at, tz=datetime.timezone.utc) if paid_at else timezone.now()
+            )
+
+        if payments:
+            completed, oversold = complete_payments(payments)
+            for reference_id in oversold:
+                logger.error('Payment captured after reservation expired and tickets sold out', extra={'reference_id': reference_id})
+
+            # Payments an earlier batch or the browser callback already applied.
+            completed = {event_booking.formis_payment_id for event_booking in completed}
+            ignored.update(event.pk for event in batch if event.reference_id in payments and event.reference_id not in completed)
+
+        now = timezone.now()
+        RazorpayWebhookEvent.objects.filter(pk__in=ignored).update(status=RazorpayWebhookEvent.IGNORED, processed_at=now)
+        RazorpayWebhookEvent.objects.filter(pk__in=[event.pk for event in batch if event.pk not in ignored]).update(
+            status=RazorpayWebhookEvent.PROCESSED, processed_at=now
+        )
+
+    return len(batch)
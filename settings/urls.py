@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.urls import path, include
+from event_registration.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('event-registration/', include('event_registration.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]